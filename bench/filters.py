@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Describe filter benchmark for ebs-pin
+
+Compares the describe calls ebs-pin made with `tag-key=UUID` plus
+`tag-value=<uuid>` and no owner against the current `tag:UUID` filters
+with status filters and OwnerIds=['self'], against the EC2 simulator. The
+simulated account has --uuids UUIDs with a history each, copies tagged
+with another UUID that keep the original UUID in a Source tag, volumes
+being deleted, and public snapshots from other accounts. Reports items,
+pages, response bytes and time per lookup.
+
+    python3 bench/filters.py [--uuids 200] [--snapshots 50] [--public 5000]
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from ebspin import inventory, simulator  # noqa: E402
+
+
+def old_filters(uuid):
+    return [{'Name': 'tag-key', 'Values': ['UUID']}, {'Name': 'tag-value', 'Values': [uuid]}]
+
+
+def new_filters(uuid):
+    return [{'Name': 'tag:UUID', 'Values': [uuid]}]
+
+
+LOOKUPS = [
+    # name, operation, old request, new request
+    ('volumes', 'describe_volumes',
+     lambda uuid: {'Filters': old_filters(uuid)},
+     lambda uuid: {'Filters': new_filters(uuid) + [{'Name': 'status', 'Values': inventory.VOLUME_STATES}]}),
+    ('snapshots', 'describe_snapshots',
+     lambda uuid: {'Filters': old_filters(uuid)},
+     lambda uuid: {'Filters': new_filters(uuid), 'OwnerIds': ['self']}),
+    ('latest snapshot', 'describe_snapshots',
+     lambda uuid: {'Filters': old_filters(uuid) + [{'Name': 'status', 'Values': ['completed']}]},
+     lambda uuid: {'Filters': new_filters(uuid) + [{'Name': 'status', 'Values': ['completed']}], 'OwnerIds': ['self']}),
+]
+
+
+def build(args):
+    sim = simulator.Simulator(seed=0)
+    uuids = ['uuid-%04d' % x for x in range(args.uuids)]
+    sim.populate(uuids, volumes=2, snapshots=args.snapshots)
+    for index, uuid in enumerate(uuids):
+        # copies made by another tool: their own UUID, the original kept as Source
+        copy_tags = [{'Key': 'UUID', 'Value': 'copy-%s' % uuid}, {'Key': 'Source', 'Value': uuid}]
+        for x in range(args.copies):
+            sim.add_snapshot(tags=copy_tags)
+        volume_id = sim.add_volume(tags=[{'Key': 'UUID', 'Value': uuid}], created=-60)
+        sim.volumes[volume_id]['State'] = 'deleting'
+    for x in range(args.public):
+        sim.add_snapshot(owner_id='%012d' % (x % 50), tags=[{'Key': 'UUID', 'Value': uuids[x % len(uuids)]}])
+    return sim, uuids
+
+
+def measure(sim, operation, request):
+    """Items, pages, response bytes and seconds for one paginated lookup"""
+
+    items = pages = size = 0
+    key = 'Volumes' if operation == 'describe_volumes' else 'Snapshots'
+    started = time.perf_counter()
+    for page in sim.get_paginator(operation).paginate(**request):
+        pages += 1
+        items += len(page[key])
+        size += len(json.dumps(page, default=str))
+    return items, pages, size, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--uuids', default=200, type=int)
+    parser.add_argument('--snapshots', default=50, type=int, help='Snapshots per UUID, default=50')
+    parser.add_argument('--copies', default=20, type=int, help='Snapshots per UUID copied by another tool, default=20')
+    parser.add_argument('--public', default=5000, type=int, help="Other accounts' public snapshots, default=5000")
+    parser.add_argument('--samples', default=20, type=int, help='UUIDs to look up, default=20')
+    args = parser.parse_args()
+
+    sim, uuids = build(args)
+    print("%-16s %-4s %8s %6s %12s %10s" % ('lookup', 'set', 'items', 'pages', 'bytes', 'ms'))
+    for name, operation, old, new in LOOKUPS:
+        for label, request in (('old', old), ('new', new)):
+            totals = [0, 0, 0, 0]
+            for uuid in uuids[:args.samples]:
+                totals = [x + y for x, y in zip(totals, measure(sim, operation, request(uuid)))]
+            samples = min(args.samples, len(uuids))
+            print("%-16s %-4s %8.1f %6.1f %12.0f %10.2f" % (
+                name, label, totals[0] / samples, totals[1] / samples, totals[2] / samples, 1000 * totals[3] / samples))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+"""
+Scenario benchmark for ebs-pin against stubbed EC2
+
+Runs Base.attach, Base.snapshot and Base.gc end to end against a botocore
+Stubber that adds a fixed latency to every call and can throttle deletes,
+then reports wall time, API calls, waiter polls and peak Python memory.
+Waiter and backoff sleeps are counted rather than slept, so only the
+injected latency and ebs-pin's own work make up the wall time.
+
+    python3 bench/scenarios.py [--latency 0.005] [--throttle 0.05] [--check] [--save]
+
+--check compares against bench/baseline.json and exits 1 if a scenario
+makes more (unthrottled) API calls than its baseline, or its wall time or peak memory
+grew by more than --tolerance. --save records the current results as the
+new baseline. Baseline times are only comparable on similar machines;
+call counts are exact.
+"""
+
+import argparse
+import datetime
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import tracemalloc
+from unittest.mock import patch
+
+from botocore.stub import Stubber
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from ebspin import base, defaults  # noqa: E402
+
+BASELINE = os.path.join(ROOT, 'bench', 'baseline.json')
+METADATA = {'region': 'ap-southeast-2', 'availabilityZone': 'ap-southeast-2a', 'instanceId': 'i-bench'}
+UUID = 'bench'
+NOW = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+PAGE_SIZE = 1000
+# Waiter and backoff sleeps are patched out while a scenario runs; injected latency is slept for real
+real_sleep = time.sleep
+
+# Throttling on anything else is retried by botocore itself, below the stubs,
+# so these are the calls whose throttling ebs-pin handles
+THROTTLED_OPERATIONS = ('DeleteSnapshot', 'DeleteVolume')
+
+
+class LatencyStubber(Stubber):
+    """Stubber that waits `latency` seconds per call and throttles a share of deletes.
+
+    Responses are matched to the first queued response for the same
+    operation, rather than strictly in order, so concurrent deletes and
+    snapshots can share one queue.
+    """
+
+    def __init__(self, client, latency=0.0, throttle=0.0, seed=0):
+        super().__init__(client)
+        self.latency = latency
+        self.throttle = throttle
+        self.random = random.Random(seed)
+        self.calls = {}
+        self.throttled = 0
+        self._queue_lock = threading.Lock()
+
+    def _next(self, operation_name):
+        for index, response in enumerate(self._queue):
+            if response['operation_name'] == operation_name:
+                return index, response
+        raise AssertionError("Unstubbed %s call" % operation_name)
+
+    def _assert_expected_params(self, model, params, context, **kwargs):
+        return None
+
+    def _get_response_handler(self, model, params, context, **kwargs):
+        real_sleep(self.latency)
+        with self._queue_lock:
+            self.calls[model.name] = self.calls.get(model.name, 0) + 1
+            if model.name in THROTTLED_OPERATIONS and self.random.random() < self.throttle:
+                self.throttled += 1
+                return throttled()
+            index, response = self._next(model.name)
+            del self._queue[index]
+        return response['response']
+
+
+def throttled():
+    from botocore.awsrequest import AWSResponse
+
+    return (
+        AWSResponse(None, 503, {}, None),
+        {'ResponseMetadata': {'HTTPStatusCode': 503}, 'Error': {'Code': 'RequestLimitExceeded', 'Message': 'Rate exceeded.'}}
+    )
+
+
+class Clock:
+    """Stands in for time.sleep, adding up what would have been slept"""
+
+    def __init__(self):
+        self.slept = 0
+        self._lock = threading.Lock()
+
+    def sleep(self, seconds):
+        with self._lock:
+            self.slept += seconds
+
+
+def tags(name='i-bench-/dev/xvdf'):
+    return [{'Key': 'Name', 'Value': name}, {'Key': 'UUID', 'Value': UUID}]
+
+
+def volume(volume_id, availability_zone, state='available', instance_id=None):
+    attachments = []
+    if instance_id:
+        attachments = [{'VolumeId': volume_id, 'InstanceId': instance_id, 'Device': '/dev/xvdf', 'State': 'attached'}]
+    return {
+        'VolumeId': volume_id,
+        'AvailabilityZone': availability_zone,
+        'State': state,
+        'Size': 10,
+        'VolumeType': 'gp2',
+        'CreateTime': NOW,
+        'Attachments': attachments,
+        'Tags': tags()
+    }
+
+
+def snapshot(snapshot_id, volume_id, state='completed', minutes=0):
+    return {
+        'SnapshotId': snapshot_id,
+        'VolumeId': volume_id,
+        'State': state,
+        'VolumeSize': 10,
+        'StartTime': NOW - datetime.timedelta(minutes=minutes),
+        'Tags': tags()
+    }
+
+
+def add_snapshot_pages(stubber, snapshots):
+    """Stub a filtered DescribeSnapshots listing, PAGE_SIZE snapshots per page"""
+
+    pages = [snapshots[x:x + PAGE_SIZE] for x in range(0, len(snapshots), PAGE_SIZE)] or [[]]
+    for index, page in enumerate(pages):
+        response = {'Snapshots': page}
+        if index < len(pages) - 1:
+            response['NextToken'] = 'page-%s' % (index + 1)
+        stubber.add_response('describe_snapshots', response)
+
+
+def add_old_snapshots(stubber, count, extra=()):
+    snapshots = list(extra) + [snapshot('snap-%08d' % x, 'vol-old', minutes=x + 1) for x in range(count)]
+    add_snapshot_pages(stubber, snapshots)
+    for x in range(len(snapshots)):
+        stubber.add_response('delete_snapshot', {})
+
+
+def add_attach(stubber, volume_id):
+    stubber.add_response('describe_volumes', {'Volumes': [volume(volume_id, 'ap-southeast-2a')]})
+    stubber.add_response('attach_volume', {'VolumeId': volume_id, 'InstanceId': 'i-bench', 'Device': '/dev/xvdf', 'State': 'attaching'})
+    stubber.add_response('describe_volumes', {'Volumes': [volume(volume_id, 'ap-southeast-2a', 'in-use', 'i-bench')]})
+
+
+def attach_same_az(b, stubber, snapshots):
+    """Latest volume is already in this AZ: attach it and clean up the old snapshots"""
+
+    stubber.add_response('describe_tags', {'Tags': [{'Key': 'Name', 'Value': 'i-bench', 'ResourceId': 'i-bench', 'ResourceType': 'instance'}]})
+    stubber.add_response('describe_volumes', {'Volumes': [volume('vol-current', 'ap-southeast-2a')]})
+    add_attach(stubber, 'vol-current')
+    add_old_snapshots(stubber, snapshots)
+    return b.attach
+
+
+def attach_cross_az(b, stubber, snapshots):
+    """Latest volume is in another AZ: snapshot it, restore here, attach and clean up"""
+
+    stubber.add_response('describe_tags', {'Tags': [{'Key': 'Name', 'Value': 'i-bench', 'ResourceId': 'i-bench', 'ResourceType': 'instance'}]})
+    stubber.add_response('describe_volumes', {'Volumes': [volume('vol-old', 'ap-southeast-2b')]})
+    stubber.add_response('create_snapshot', snapshot('snap-move', 'vol-old', 'pending'))
+    stubber.add_response('describe_snapshots', {'Snapshots': [snapshot('snap-move', 'vol-old', 'pending')]})
+    stubber.add_response('describe_snapshots', {'Snapshots': [snapshot('snap-move', 'vol-old')]})
+    stubber.add_response('create_volume', volume('vol-new', 'ap-southeast-2a', 'creating'))
+    stubber.add_response('describe_volumes', {'Volumes': [volume('vol-new', 'ap-southeast-2a', 'creating')]})
+    stubber.add_response('describe_volumes', {'Volumes': [volume('vol-new', 'ap-southeast-2a')]})
+    add_attach(stubber, 'vol-new')
+    stubber.add_response('delete_volume', {})
+    add_old_snapshots(stubber, snapshots, [snapshot('snap-move', 'vol-old')])
+    return b.attach
+
+
+def snapshot_volumes(b, stubber, volumes):
+    """Snapshot every attached volume of the UUID and wait for them together"""
+
+    attached = [volume('vol-%08d' % x, 'ap-southeast-2a', 'in-use', 'i-bench') for x in range(volumes)]
+    stubber.add_response('describe_volumes', {'Volumes': attached})
+    for x in attached:
+        stubber.add_response('create_snapshot', snapshot('snap-%s' % x['VolumeId'], x['VolumeId'], 'pending'))
+    stubber.add_response('describe_snapshots', {'Snapshots': [snapshot('snap-%s' % x['VolumeId'], x['VolumeId'], 'pending') for x in attached]})
+    stubber.add_response('describe_snapshots', {'Snapshots': [snapshot('snap-%s' % x['VolumeId'], x['VolumeId']) for x in attached]})
+    return b.snapshot
+
+
+def cleanup(b, stubber, snapshots):
+    """gc of a UUID with one volume and `snapshots` deletable snapshots"""
+
+    stubber.add_response('describe_volumes', {'Volumes': [volume('vol-current', 'ap-southeast-2a', 'in-use', 'i-bench')]})
+    add_old_snapshots(stubber, snapshots)
+    return b.gc
+
+
+SCENARIOS = [
+    ('attach_same_az', attach_same_az, 10),
+    ('attach_cross_az', attach_cross_az, 10),
+    ('snapshot_8_volumes', snapshot_volumes, 8),
+    ('cleanup_10', cleanup, 10),
+    ('cleanup_1000', cleanup, 1000),
+    ('cleanup_10000', cleanup, 10000),
+]
+
+
+def options(concurrency):
+    return defaults.options(uuid=UUID, concurrency=concurrency, cleanup_log=os.devnull)
+
+
+def run(scenario, size, args, memory=False):
+    b = base.Base(options(args.concurrency), METADATA)
+    stubber = LatencyStubber(b.ec2.client, args.latency, args.throttle, args.seed)
+    command = scenario(b, stubber, size)
+    clock = Clock()
+    stubber.activate()
+    if memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    with patch('time.sleep', clock.sleep):
+        command()
+    wall = time.perf_counter() - started
+    peak = None
+    if memory:
+        peak = tracemalloc.get_traced_memory()[1] / 1024
+        tracemalloc.stop()
+    stubber.deactivate()
+    return {
+        'wall': round(wall, 4),
+        'calls': b.stats.as_dict()['calls'],
+        'operations': dict(sorted(stubber.calls.items())),
+        'throttled': stubber.throttled,
+        'polls': sum(b.ec2.poller.polls.values()),
+        'slept': round(clock.slept, 3),
+        'peak_kb': None if peak is None else round(peak)
+    }
+
+
+def compare(name, result, baseline, tolerance):
+    """Regressions of result against its baseline, as messages"""
+
+    problems = []
+    # which deletes are throttled depends on thread scheduling, so they're left out
+    calls = result['calls'] - result['throttled']
+    baseline_calls = baseline['calls'] - baseline['throttled']
+    if calls > baseline_calls:
+        problems.append("%s: %s API calls, baseline %s" % (name, calls, baseline_calls))
+    for key in ('wall', 'peak_kb'):
+        if baseline.get(key) and result[key] > baseline[key] * (1 + tolerance):
+            problems.append("%s: %s %s, baseline %s" % (name, key, result[key], baseline[key]))
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--latency', default=0.002, type=float, help='Seconds added to every EC2 call, default=0.002')
+    parser.add_argument('--throttle', default=0.0, type=float, help='Share of delete calls throttled, default=0')
+    parser.add_argument('--concurrency', default=4, type=int)
+    parser.add_argument('--seed', default=0, type=int)
+    parser.add_argument('--scenario', action='append', help='Only run these scenarios')
+    parser.add_argument('--check', action='store_true', help='Exit 1 on a regression against %s' % BASELINE)
+    parser.add_argument('--save', action='store_true', help='Save the results as the new baseline')
+    parser.add_argument('--tolerance', default=0.25, type=float, help='Allowed wall time and memory growth over the baseline, default=0.25')
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    results = {}
+    for name, scenario, size in SCENARIOS:
+        if args.scenario and name not in args.scenario:
+            continue
+        result = run(scenario, size, args)
+        result['peak_kb'] = run(scenario, size, args, memory=True)['peak_kb']
+        results[name] = result
+
+    print("%-20s %10s %8s %9s %6s %10s %10s" % ('scenario', 'wall s', 'calls', 'throttled', 'polls', 'slept s', 'peak KB'))
+    for name, result in results.items():
+        print("%-20s %10.3f %8d %9d %6d %10.1f %10d" % (
+            name, result['wall'], result['calls'], result['throttled'], result['polls'], result['slept'], result['peak_kb']))
+
+    problems = []
+    if args.check:
+        with open(BASELINE) as f:
+            baseline = json.load(f)
+        for name, result in results.items():
+            if name in baseline['scenarios']:
+                problems += compare(name, result, baseline['scenarios'][name], args.tolerance)
+        for problem in problems:
+            print("REGRESSION %s" % problem)
+
+    if args.save:
+        with open(BASELINE, 'w') as f:
+            json.dump({
+                'latency': args.latency,
+                'throttle': args.throttle,
+                'concurrency': args.concurrency,
+                'scenarios': results
+            }, f, indent=2, sort_keys=True)
+            f.write('\n')
+
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == '__main__':
+    main()
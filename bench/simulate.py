@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Scale benchmark and fuzzer for ebs-pin against the in-process EC2 simulator
+
+Builds a random history of volumes and snapshots for --uuids UUIDs spread
+across AZs, then attaches --attach of them to one instance and cleans up,
+for each of --seeds seeds. Reports wall time, API calls per operation,
+simulated seconds (time EC2 would have taken, including waits) and
+throttling, and checks that every attached UUID ends with exactly one
+volume, attached here, and no snapshots.
+
+    python3 bench/simulate.py [--uuids 100] [--snapshots 100] [--attach 10] [--throttle 0.05] [--seeds 3]
+"""
+
+import argparse
+import logging
+import os
+import sys
+import time
+from unittest.mock import patch
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from ebspin import base, defaults, ec2, simulator  # noqa: E402
+
+METADATA = {'region': 'ap-southeast-2', 'availabilityZone': 'ap-southeast-2a', 'instanceId': 'i-bench'}
+
+
+def options(args):
+    return defaults.options(device=None, concurrency=args.concurrency, cleanup_log=os.devnull)
+
+
+def problems(sim, uuid, volume_id):
+    """Ways the end state for uuid is wrong, as messages"""
+
+    tag = {'Key': 'UUID', 'Value': uuid}
+    volumes = [x for x in sim.volumes.values() if tag in x['Tags']]
+    snapshots = [x for x in sim.snapshots.values() if tag in x['Tags']]
+    found = []
+    if [x['VolumeId'] for x in volumes] != [volume_id]:
+        found.append("%s has volumes %s, attached %s" % (uuid, [x['VolumeId'] for x in volumes], volume_id))
+    elif [x['InstanceId'] for x in volumes[0]['Attachments']] != [METADATA['instanceId']]:
+        found.append("%s volume %s is not attached here" % (uuid, volume_id))
+    if snapshots:
+        found.append("%s has %s snapshots left" % (uuid, len(snapshots)))
+    return found
+
+
+def run(seed, args):
+    sim = simulator.Simulator(
+        latency=args.latency, throttle=args.throttle, seed=seed,
+        throttle_operations=('DeleteSnapshot', 'DeleteVolume'), visibility_delay=args.visibility_delay
+    )
+    sim.add_instance(METADATA['instanceId'], METADATA['availabilityZone'], name='bench')
+    uuids = ['uuid-%04d' % x for x in range(args.uuids)]
+    sim.populate(uuids, volumes=args.volumes, snapshots=args.snapshots)
+
+    b = base.Base(options(args), METADATA)
+    b.ec2 = ec2.Ec2(sim, args.concurrency, timer=b.timer)
+    found = []
+    started = time.perf_counter()
+    with patch('time.sleep', sim.sleep):
+        for index, uuid in enumerate(uuids[:args.attach]):
+            volume_options = base.VolumeOptions(b.options, uuid=uuid, device='/dev/xvd%s' % chr(ord('f') + index % 20))
+            volume_id = b.attach(volume_options)
+            # let the deletes EC2 is still working through finish
+            sim.sleep(sim.delete_delay)
+            found += problems(sim, uuid, volume_id)
+    return {
+        'wall': time.perf_counter() - started,
+        'simulated': sim.now,
+        'calls': dict(sorted(sim.calls.items())),
+        'throttled': sim.throttled,
+        'problems': found
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--uuids', default=100, type=int)
+    parser.add_argument('--volumes', default=2, type=int, help='Detached volumes per UUID, default=2')
+    parser.add_argument('--snapshots', default=100, type=int, help='Snapshots per UUID, default=100')
+    parser.add_argument('--attach', default=10, type=int, help='UUIDs to attach, default=10')
+    parser.add_argument('--concurrency', default=4, type=int)
+    parser.add_argument('--latency', default=0.05, type=float, help='Simulated seconds per EC2 call, default=0.05')
+    parser.add_argument('--throttle', default=0.0, type=float, help='Share of deletes throttled, default=0')
+    parser.add_argument('--visibility-delay', default=1, type=float, help='Simulated seconds before new resources can be described, default=1')
+    parser.add_argument('--seeds', default=1, type=int)
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    failed = False
+    print("%-6s %10s %12s %8s %9s  %s" % ('seed', 'wall s', 'simulated s', 'calls', 'throttled', 'calls by operation'))
+    for seed in range(args.seeds):
+        result = run(seed, args)
+        print("%-6d %10.3f %12.1f %8d %9d  %s" % (
+            seed, result['wall'], result['simulated'], sum(result['calls'].values()), result['throttled'],
+            ' '.join('%s=%s' % x for x in result['calls'].items())))
+        for problem in result['problems']:
+            failed = True
+            print("PROBLEM seed %s: %s" % (seed, problem))
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
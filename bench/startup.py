@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Startup benchmark for the ebs-pin CLI
+
+Runs each subcommand in a fresh interpreter, with and without --fast-start:
+imports, cached metadata, EC2 client creation and then the subcommand itself
+(attach, snapshot --no-wait or gc). The real client validates and serialises
+every call, which is then answered by the in-process simulator instead of
+EC2. Reports import time, client creation time, command time, wall time and
+peak RSS. The metadata cache is pre-populated with a fake identity document,
+so no IMDS or EC2 calls are made.
+
+    python3 bench/startup.py [--runs 5]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Run in its own interpreter so this process stays small: Linux carries the
+# parent's peak RSS over fork into the children being measured
+PREPARE = """
+import sys
+from ebspin import configuration
+c = configuration.Configuration(sys.argv[1])
+c._write_cache('identity.json', {'document': {'region': 'ap-southeast-2', 'availabilityZone': 'ap-southeast-2a', 'instanceId': 'i-bench'}})
+c.model_path()
+"""
+
+CHILD = """
+import os, sys, time, json, threading
+started = time.perf_counter()
+from ebspin import base, configuration, defaults
+imported = time.perf_counter()
+c = configuration.Configuration(sys.argv[1])
+metadata = c.metadata()
+options = defaults.options(uuid='bench', cleanup_log=os.devnull, no_wait=True)
+b = base.Base(options, metadata, c.model_path() if sys.argv[2] == 'fast' else None)
+created = time.perf_counter()
+
+from unittest.mock import patch
+from botocore import xform_name
+from botocore.awsrequest import AWSResponse
+from ebspin import simulator
+
+sim = simulator.Simulator()
+sim.add_instance(metadata['instanceId'], metadata['availabilityZone'], name='bench')
+tags = [{'Key': 'Name', 'Value': 'bench-/dev/xvdf'}, {'Key': 'UUID', 'Value': 'bench'}]
+volume_id = sim.add_volume(tags=tags, instance_id=metadata['instanceId'] if sys.argv[3] == 'snapshot' else None)
+for x in range(10):
+    sim.add_snapshot(volume_id=volume_id, tags=tags, started=-3600 * (x + 1))
+
+# the client validates and serialises each call, then the simulator answers it in place of EC2
+calls = threading.local()
+b.ec2.client.meta.events.register_first('before-parameter-build.ec2.*', lambda params, **kwargs: setattr(calls, 'params', params))
+b.ec2.client.meta.events.register('before-call.ec2.*', lambda model, **kwargs: (
+    AWSResponse(None, 200, {}, None), getattr(sim, xform_name(model.name))(**calls.params)))
+with patch('time.sleep', sim.sleep):
+    {'attach': b.attach, 'snapshot': b.snapshot, 'gc': b.gc}[sys.argv[3]]()
+finished = time.perf_counter()
+print(json.dumps({'import': imported - started, 'client': created - imported, 'command': finished - created}))
+"""
+
+SUBCOMMANDS = ['attach', 'snapshot', 'gc']
+
+
+def run(command):
+    """Run command, returning its stdout, wall time and peak RSS in MB"""
+
+    started = time.perf_counter()
+    process = subprocess.Popen(command, cwd=ROOT, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    output = process.stdout.read()
+    _, status, rusage = os.wait4(process.pid, 0)
+    wall = time.perf_counter() - started
+    if status != 0:
+        raise RuntimeError("%s failed" % command)
+    return output, wall, rusage.ru_maxrss / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', default=5, type=int)
+    args = parser.parse_args()
+
+    cache_dir = tempfile.mkdtemp(prefix='ebs-pin-bench')
+    subprocess.check_call([sys.executable, '-c', PREPARE, cache_dir], cwd=ROOT)
+
+    rows = []
+    walls, rss = [], []
+    for x in range(args.runs):
+        _, wall, peak = run([sys.executable, 'ebs-pin', 'attach', '--help'])
+        walls.append(wall)
+        rss.append(peak)
+    rows.append(('--help', '', None, None, None, statistics.median(walls), max(rss)))
+
+    for subcommand in SUBCOMMANDS:
+        for mode in ('full', 'fast'):
+            imports, clients, commands, walls, rss = [], [], [], [], []
+            for x in range(args.runs):
+                output, wall, peak = run([sys.executable, '-c', CHILD, cache_dir, mode, subcommand])
+                result = json.loads(output)
+                imports.append(result['import'])
+                clients.append(result['client'])
+                commands.append(result['command'])
+                walls.append(wall)
+                rss.append(peak)
+            rows.append((subcommand, mode, statistics.median(imports), statistics.median(clients), statistics.median(commands),
+                         statistics.median(walls), max(rss)))
+
+    print("%-10s %-5s %10s %10s %10s %10s %10s" % ('command', 'model', 'import s', 'client s', 'command s', 'wall s', 'rss MB'))
+    for name, mode, imported, client, command, wall, peak in rows:
+        print("%-10s %-5s %10s %10s %10s %10.3f %10.1f" % (
+            name, mode,
+            '-' if imported is None else '%.3f' % imported,
+            '-' if client is None else '%.3f' % client,
+            '-' if command is None else '%.3f' % command,
+            wall, peak))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,93 +1,504 @@
+import os
 import sys
+import time
+import datetime
 import logging
-import boto3
+import subprocess
+import botocore
+from concurrent.futures import ThreadPoolExecutor
 import ebspin.ec2 as ec2
+from ebspin.deleter import DeletionSummary
+from ebspin import client, device, ebs, freeze, ratelimit, status, timing, warm
+
+
+def parse_volume_spec(spec):
+    """Parse uuid:device[:size[:type]] into a dict of attach options"""
+
+    fields = spec.strip().split(':')
+    if len(fields) < 2 or len(fields) > 4 or not fields[0] or not fields[1]:
+        raise ValueError("Volume spec %s is not uuid:device[:size[:type]]" % spec)
+    result = {'uuid': fields[0], 'device': fields[1]}
+    if len(fields) > 2 and fields[2]:
+        result['size'] = int(fields[2])
+    if len(fields) > 3 and fields[3]:
+        result['type'] = fields[3]
+    return result
+
+
+def read_volume_specs(path):
+    """Volume specs from a file, one uuid:device[:size[:type]] per line, # for comments"""
+
+    with open(path) as f:
+        lines = [line.split('#')[0].strip() for line in f]
+    return [parse_volume_spec(line) for line in lines if line]
+
+
+class VolumeOptions:
+    """Options for one volume of a multi-volume attach, falling back to the command line options"""
+
+    def __init__(self, options, **overrides):
+        self.__dict__.update(overrides)
+        self._options = options
+
+    def __getattr__(self, name):
+        return getattr(self._options, name)
 
 
 class Base:
     options = None
     metadata = None
+    configuration = None
     session = None
+    stats = None
+    timer = None
     ec2 = None
+    ebs = None
+    devices = None
+    changes = None
+    frozen = None
+    # called with (volume_id, path) as soon as an attached volume's block device is usable
+    on_device = None
 
-    def __init__(self, options, metadata):
+    def __init__(self, options, metadata, data_path=None, timer=None, configuration=None):
         self.options = options
         self.metadata = metadata
-        self.session = boto3.Session(region_name=metadata['region'])
-        self.ec2 = ec2.Ec2(self.session.client('ec2'))
+        self.configuration = configuration
+        self.devices = {}
+        self.changes = {}
+        self.stats = client.ClientStats()
+        self.timer = timer or timing.Timer()
+        with self.timer.span('startup.client'):
+            self.session = client.make_session(metadata['region'], data_path)
+            self.ec2 = ec2.Ec2(self.make_client('ec2'), options.concurrency, timer=self.timer)
 
-    def attach(self):
-        name = self.ec2.get_instance_name(self.metadata['instanceId']) or self.metadata['instanceId']
-        volume_name = "%s-%s" % (name, self.options.device)
+    def make_client(self, service):
+        """A client built from the command line's concurrency, retry and timeout settings"""
+
+        return client.make_client(
+            self.session,
+            service,
+            concurrency=self.options.concurrency,
+            retry_mode=self.options.retry_mode,
+            connect_timeout=self.options.connect_timeout,
+            read_timeout=self.options.read_timeout,
+            stats=self.stats
+        )
+
+    def instance_name(self):
+        """This instance's Name tag, from IMDS instance tags when they're enabled, otherwise describe_tags"""
+
+        instance_id = self.metadata['instanceId']
+        if instance_id not in self.ec2.instance_names and self.configuration:
+            tags = self.configuration.instance_tags(['Name'])
+            if tags is not None:
+                self.ec2.instance_names[instance_id] = tags.get('Name')
+        return self.ec2.get_instance_name(instance_id)
+
+    def attach(self, options=None):
+        options = options or self.options
+        with self.timer.span('attach', uuid=options.uuid, device=options.device):
+            return self._attach(options)
+
+    def _attach(self, options):
+        with self.timer.span('attach.instance_name'):
+            name = self.instance_name() or self.metadata['instanceId']
+        volume_name = "%s-%s" % (name, options.device)
         logging.info("Volume name: %s" % volume_name)
 
         logging.info("Finding volume...")
 
-        volume_id = self.ec2.get_latest_volume_id_available(self.options.uuid)
-        if volume_id:
-            logging.info("Volume found: %s" % volume_id)
-            logging.info("Checking volume is in same availability zone as instance...")
-            if self.ec2.get_volume_region(volume_id) != self.metadata['availabilityZone']:
-                logging.info("Volume in another availability zone, snapshot required.")
-                snapshot_id = self.ec2.create_snapshot(volume_id)
+        with self.timer.span('attach.find_volume'):
+            volume_id = self.ec2.get_latest_volume_id_available(options.uuid)
+            if volume_id:
+                logging.info("Volume found: %s" % volume_id)
+                logging.info("Checking volume is in same availability zone as instance...")
+                other_az = self.ec2.get_volume_region(volume_id) != self.metadata['availabilityZone']
+            else:
+                snapshot_id = self.ec2.get_latest_snapshot_id(options.uuid)
                 if snapshot_id:
-                    logging.info("Snapshot created: %s" % snapshot_id)
-                    volume_id = None
-        else:
-            snapshot_id = self.ec2.get_latest_snapshot_id(self.options.uuid)
+                    logging.info("Snapshot found: %s" % snapshot_id)
+                else:
+                    logging.info("No snapshot found. An empty #%s volume will be created of #%s GB." % (options.type, options.size))
+
+        if volume_id and other_az:
+            logging.info("Volume in another availability zone, snapshot required.")
+            with self.timer.span('attach.cross_az_snapshot'):
+                snapshot_id = self.move_snapshot(volume_id, options)
             if snapshot_id:
-                logging.info("Snapshot found: %s" % snapshot_id)
-            else:
-                logging.info("No snapshot found. An empty #%s volume will be created of #%s GB." % (self.options.type, self.options.size))
+                volume_id = None
+
+        # volumes restored from a snapshot load their blocks lazily, unless fast snapshot restore is fully enabled;
+        # while it is still optimizing only some of them are already there
+        lazy = False
+        if not volume_id and snapshot_id:
+            lazy = True
+            if options.fast_restore:
+                with self.timer.span('attach.fast_restore', snapshot_id=snapshot_id):
+                    lazy = self.fast_restore(snapshot_id, options) != 'enabled'
 
         if not volume_id:
             logging.info("Creating volume...")
-            volume_id = self.ec2.create_volume(self.options.size, self.options.type, self.metadata['availabilityZone'], snapshot_id)
-            if volume_id:
-                logging.info("Created volume: %s" % volume_id)
-
-                logging.info("Tagging volume...")
-                self.ec2.tag_volume(volume_id, volume_name, self.options)
-                logging.info("Volume tagged.")
-            else:
+            with self.timer.span('attach.create_volume'):
+                tags = self.ec2.volume_tags(volume_name, options)
+                volume_id = self.ec2.create_volume(options.size, options.type, self.metadata['availabilityZone'], snapshot_id, tags)
+                if volume_id:
+                    logging.info("Created volume: %s" % volume_id)
+            if not volume_id:
                 logging.error("Volume failed creation.")
                 sys.exit(1)
 
         if volume_id:
             logging.info("Attaching volume...")
-            if self.ec2.attach_volume(volume_id, self.metadata['instanceId'], self.options.device):
+            with self.timer.span('attach.attach_volume'):
+                attached = self.ec2.attach_volume(volume_id, self.metadata['instanceId'], options.device)
+            if attached:
                 logging.info('Volume attached to instance.')
             else:
                 logging.info('Volume attachment failed.')
                 sys.exit(1)
 
-        self.ec2.clean_old_volumes(self.options.uuid, volume_id)
-        self.ec2.clean_snapshots(self.options.uuid, self.options.tags)
+        path = options.device
+        if options.wait_device or options.symlink or (options.warm and lazy):
+            with self.timer.span('attach.wait_device', device=options.device):
+                path = self.wait_device(volume_id, options)
 
-    def snapshot(self):
-        logging.info("Finding volumes...")
-        volumes = self.ec2.get_volume_id(self.metadata['instanceId'], self.options.uuid)
+        with self.timer.span('attach.cleanup', background=bool(options.background_cleanup)):
+            if options.background_cleanup:
+                self.spawn_gc(volume_id, options)
+            else:
+                self.gc(volume_id, options)
 
-        if len(volumes) > 0:
-            for volume_id in volumes:
-                logging.info("Creating snapshot for volume %s" % volume_id)
-                if self.ec2.create_snapshot(volume_id, self.options.tags):
-                    logging.info("Volume %s snapshot created." % volume_id)
-                else:
-                    logging.error("Volume %s snapshot failed." % volume_id)
+        if options.warm and lazy:
+            with self.timer.span('attach.warm', device=options.device):
+                try:
+                    self.warm(path, options)
+                except OSError as e:
+                    logging.error("Warming %s failed: %s" % (path, e))
+        logging.info("Describe calls saved by the inventory cache: %s" % self.ec2.calls_saved())
+        logging.info("EC2 API calls: %(calls)s, retries: %(retries)s, throttled: %(throttles)s" % self.stats.as_dict())
+        return volume_id
+
+    def move_snapshot(self, volume_id, options=None):
+        """Snapshot to restore volume_id from in this AZ, reusing one if --reuse-snapshot allows"""
+
+        options = options or self.options
+        snapshot_id = None
+        if options.reuse_snapshot:
+            snapshot = self.ec2.find_reusable_snapshot(options.uuid, volume_id)
+            if snapshot and snapshot['State'] == 'pending':
+                logging.info("Snapshot %s already in progress, waiting for it..." % snapshot['SnapshotId'])
+                self.ec2.wait_for_snapshot(snapshot['SnapshotId'])
+                snapshot_id = snapshot['SnapshotId']
+            elif snapshot:
+                logging.info("Reusing snapshot %s taken since the volume was detached." % snapshot['SnapshotId'])
+                snapshot_id = snapshot['SnapshotId']
+        if not snapshot_id:
+            snapshot_id = self.ec2.create_snapshot(volume_id, move=True)
+            if snapshot_id:
+                logging.info("Snapshot created: %s" % snapshot_id)
+        return snapshot_id
+
+    def fast_restore(self, snapshot_id, options=None):
+        """Enable fast snapshot restore of snapshot_id in this AZ, waiting up to --fast-restore-wait seconds for it.
+
+        Returns its state once it is optimizing or enabled. Volumes created
+        from the snapshot while it is optimizing get some of the benefit, and
+        only those created once it is enabled are fully initialised. Otherwise
+        fast snapshot restore is disabled again, None is returned and the
+        volume is restored as usual, loading blocks from S3 as they're read.
+        """
+
+        options = options or self.options
+        availability_zone = self.metadata['availabilityZone']
+        logging.info("Enabling fast snapshot restore of %s in %s..." % (snapshot_id, availability_zone))
+        try:
+            self.ec2.enable_fast_snapshot_restore(snapshot_id, availability_zone)
+            self.ec2.wait_for_fast_snapshot_restore(snapshot_id, availability_zone, options.fast_restore_wait)
+        except (botocore.exceptions.ClientError, botocore.exceptions.WaiterError) as e:
+            logging.warning("Fast snapshot restore not ready, restoring %s normally: %s" % (snapshot_id, e))
+            try:
+                self.ec2.disable_fast_snapshot_restore(snapshot_id, [availability_zone])
+            except botocore.exceptions.ClientError as e:
+                logging.debug("Fast snapshot restore of %s was not enabled: %s" % (snapshot_id, e))
+            return None
+        state = self.ec2.fast_restores.get((snapshot_id, availability_zone))
+        logging.info("Fast snapshot restore of %s is %s." % (snapshot_id, state))
+        return state
+
+    def wait_device(self, volume_id, options=None):
+        """Wait for volume_id to appear as a local block device, linking --symlink to it, and return its path"""
+
+        options = options or self.options
+        path = device.DeviceWaiter().wait(volume_id, options.device, options.device_timeout)
+        if not path:
+            logging.error("Volume %s did not appear as a device within %ss." % (volume_id, options.device_timeout))
+            sys.exit(1)
+        logging.info("Volume %s is %s" % (volume_id, path))
+        if options.symlink:
+            link = device.symlink(path, options.symlink.format(uuid=options.uuid))
+            logging.info("Linked %s to %s" % (link, path))
+        self.devices[volume_id] = path
+        if self.on_device:
+            self.on_device(volume_id, path)
+        return path
+
+    def warm(self, path=None, options=None):
+        """Read every block of the attached device once, at up to --warm-rate MiB/s"""
+
+        options = options or self.options
+        bucket = ratelimit.TokenBucket(options.warm_rate * warm.MIB) if options.warm_rate else None
+        return warm.Warmer(path or options.device, options.warm_workers, bucket=bucket).run()
+
+    def counters(self):
+        """API calls, retries, waiter polls and cache hits so far this run"""
+
+        return {
+            'api': self.stats.as_dict(),
+            'polls': dict(self.ec2.poller.polls),
+            'calls_saved': self.ec2.calls_saved()
+        }
+
+    def write_timings(self, path, command):
+        """Write span timings and counters as JSON, to stdout if path is -"""
+
+        self.timer.write(path, command=command, **self.counters())
+
+    def attach_many(self, specs):
+        """Attach several volumes at once, one pipeline per spec, sharing this session and client.
+
+        Each spec is a dict overriding uuid/device/size/type of the command line
+        options. Returns a result per volume; a failed volume does not stop the
+        others.
+        """
+
+        started = time.time()
+
+        def run(spec):
+            options = VolumeOptions(self.options, **spec)
+            result = {'uuid': options.uuid, 'device': options.device, 'volume_id': None, 'path': None}
+            volume_started = time.time()
+            try:
+                result['volume_id'] = self.attach(options)
+                result['path'] = self.devices.get(result['volume_id'])
+                result['status'] = 'attached'
+            except (Exception, SystemExit) as e:
+                logging.error("Volume %s on %s failed: %s" % (options.uuid, options.device, e))
+                result['status'] = 'failed'
+                result['error'] = str(e)
+            result['seconds'] = round(time.time() - volume_started, 3)
+            return result
+
+        with ThreadPoolExecutor(max_workers=max(1, len(specs))) as executor:
+            results = list(executor.map(run, specs))
+
+        for result in results:
+            logging.info("%(uuid)s %(device)s %(volume_id)s %(status)s in %(seconds)ss" % result)
+        logging.info("Attached %s of %s volumes in %.3fs" % (
+            len([x for x in results if x['status'] == 'attached']), len(results), time.time() - started))
+        return results
+
+
+    def gc(self, volume_id=None, options=None):
+        """Delete the UUID's old volumes and snapshots, keeping volume_id (default: the latest volume)"""
+
+        options = options or self.options
+        started = time.time()
+        volume_id = volume_id or self.ec2.get_latest_volume_id_available(options.uuid)
+        with self.timer.span('gc.volumes', uuid=options.uuid):
+            volumes = self.ec2.clean_old_volumes(options.uuid, volume_id)
+        if volume_id:
+            with self.timer.span('gc.snapshots', uuid=options.uuid):
+                snapshots = self.ec2.clean_snapshots(options.uuid, options.tags, options.fast_restore)
         else:
+            # with no volume left the snapshots may be the only copy of the data
+            logging.warning("No volume found for %s, leaving its snapshots alone" % options.uuid)
+            snapshots = DeletionSummary()
+        if options.status_file:
+            status.write(options.status_file.format(uuid=options.uuid), {
+                'uuid': options.uuid,
+                'volume_id': volume_id,
+                'started': started,
+                'finished': time.time(),
+                'volumes': volumes.as_dict(),
+                'snapshots': snapshots.as_dict()
+            })
+        return volumes, snapshots
+
+    def spawn_gc(self, volume_id, options=None):
+        """Run `ebs-pin gc` for this UUID in a detached process so attach can return straight away"""
+
+        options = options or self.options
+        # global options go before the subcommand, so gc talks to IMDS and EC2 the way this run does
+        command = [sys.executable, os.path.abspath(sys.argv[0])]
+        if options.no_cache:
+            command += ['--no-cache']
+        elif options.cache_dir:
+            command += ['--cache-dir', options.cache_dir]
+        if options.fast_start:
+            command += ['--fast-start']
+        command += [
+            '--retry-mode', options.retry_mode,
+            '--connect-timeout', str(options.connect_timeout),
+            '--read-timeout', str(options.read_timeout),
+            'gc',
+            '--uuid', options.uuid,
+            '--volume-id', volume_id,
+            '--concurrency', str(options.concurrency)
+        ]
+        if options.tags:
+            command += ['--tags'] + ["%s=%s" % (key, value) for key, value in options.tags.items()]
+        if options.status_file:
+            command += ['--status-file', options.status_file]
+        if options.fast_restore:
+            command += ['--fast-restore']
+
+        # the volume is already attached, so an unwritable log mustn't fail the attach
+        try:
+            log = open(options.cleanup_log, 'a')
+            logging.info("Cleaning up in the background, logging to %s" % options.cleanup_log)
+        except OSError as e:
+            logging.warning("Cleaning up in the background without a log, can't open %s: %s" % (options.cleanup_log, e))
+            log = subprocess.DEVNULL
+        try:
+            process = subprocess.Popen(
+                command,
+                stdin=subprocess.DEVNULL,
+                stdout=log,
+                stderr=subprocess.STDOUT,
+                start_new_session=True
+            )
+        finally:
+            if log is not subprocess.DEVNULL:
+                log.close()
+        return process.pid
+
+    def snapshot(self, options=None):
+        options = options or self.options
+        logging.info("Finding volumes...")
+        with self.timer.span('snapshot.find_volumes'):
+            volumes = self.ec2.get_volumes(self.metadata['instanceId'], options.uuid)
+
+        if len(volumes) == 0:
             logging.info("No volumes found")
+            return {}
+
+        if options.skip_unchanged is not None:
+            if options.multi_volume:
+                # one decision for the whole set, so a striped or LVM set is never restored from snapshots of different moments
+                if not any(self.changed(x, options) for x in volumes):
+                    volumes = []
+            else:
+                volumes = [x for x in volumes if self.changed(x, options)]
+            if not volumes:
+                logging.info("No volumes changed enough to snapshot")
+                return {}
+
+        def create(volume):
+            logging.info("Creating snapshot for volume %s" % volume['VolumeId'])
+            try:
+                return self.ec2.create_snapshot(volume['VolumeId'], options.tags, wait=False, tags=volume.get('Tags', []))
+            except botocore.exceptions.ClientError as e:
+                logging.error("Volume %s snapshot failed: %s" % (volume['VolumeId'], e))
+                return None
+
+        def create_each():
+            with ThreadPoolExecutor(max_workers=max(1, min(options.concurrency, len(volumes)))) as executor:
+                return dict(zip([x['VolumeId'] for x in volumes], executor.map(create, volumes)))
+
+        def create_together():
+            # one call, so the volumes of a striped or LVM set are captured at the same moment
+            logging.info("Creating snapshots of %s together" % ", ".join(x['VolumeId'] for x in volumes))
+            snapshots = dict.fromkeys([x['VolumeId'] for x in volumes])
+            try:
+                snapshots.update(self.ec2.create_snapshots(self.metadata['instanceId'], volumes, options.tags, wait=False, specification=specification))
+            except botocore.exceptions.ClientError as e:
+                logging.error("Multi-volume snapshot failed: %s" % e)
+            return snapshots
+
+        create_all = create_each
+        if options.multi_volume:
+            create_all = create_together
+            with self.timer.span('snapshot.find_instance_volumes'):
+                specification = self.ec2.instance_specification(self.metadata['instanceId'], [x['VolumeId'] for x in volumes])
+
+        # writes are only held until EC2 has started the snapshots; their point in time is fixed from then on
+        freezer = freeze.Freezer(options.freeze, options.pre_hook, options.post_hook)
+        with self.timer.span('snapshot.create', volumes=len(volumes)) as span:
+            if freezer:
+                with freezer:
+                    snapshots = create_all()
+                self.frozen = span['frozen_seconds'] = round(freezer.seconds, 6)
+                logging.info("Writes were frozen for %.3fs" % freezer.seconds)
+            else:
+                snapshots = create_all()
+
+        created = [x for x in snapshots.values() if x]
+        for volume_id, snapshot_id in snapshots.items():
+            if snapshot_id:
+                logging.info("Volume %s snapshot %s started." % (volume_id, snapshot_id))
+            else:
+                logging.error("Volume %s snapshot failed." % volume_id)
+
+        if created and not options.no_wait:
+            with self.timer.span('snapshot.wait', snapshots=len(created)):
+                self.ec2.wait_for_snapshots(created)
+            logging.info("Snapshots completed: %s" % ", ".join(created))
+        return snapshots
+
+    def changed(self, volume, options=None):
+        """Whether a volume has changed enough since its last snapshots to be worth another.
+
+        EC2 can't say what changed since the latest snapshot without taking a
+        new one, so the EBS direct API's changed blocks between the latest
+        snapshot and the one before it stand in for the volume's write rate.
+        Below --skip-unchanged blocks the snapshot is skipped, unless the
+        latest snapshot is older than --max-age seconds or there is nothing to
+        compare.
+        """
+
+        options = options or self.options
+        volume_id = volume['VolumeId']
+        uuid = next((x['Value'] for x in volume.get('Tags', []) if x['Key'] == 'UUID'), options.uuid)
+        with self.timer.span('snapshot.changes', volume_id=volume_id) as span:
+            snapshots = self.ec2.get_latest_snapshots(uuid, volume_id)
+            if len(snapshots) < 2:
+                logging.info("Volume %s has %s completed snapshots, nothing to compare" % (volume_id, len(snapshots)))
+                return True
+            age = (datetime.datetime.now(datetime.timezone.utc) - snapshots[0]['StartTime']).total_seconds()
+            if age >= options.max_age:
+                logging.info("Volume %s was last snapshotted %.0fs ago, snapshotting regardless of changes" % (volume_id, age))
+                return True
+
+            if self.ebs is None:
+                self.ebs = ebs.Ebs(self.make_client('ebs'), self.timer)
+            try:
+                changes = self.ebs.changed_blocks(snapshots[1]['SnapshotId'], snapshots[0]['SnapshotId'], limit=options.skip_unchanged)
+            except botocore.exceptions.ClientError as e:
+                logging.warning("Could not list changed blocks of volume %s, snapshotting: %s" % (volume_id, e))
+                return True
+            span.update(changes)
+            self.changes[volume_id] = changes
+
+        changed = changes['blocks'] >= options.skip_unchanged
+        logging.info("Volume %s: %s%s blocks (%s bytes) changed between %s and %s, %s" % (
+            volume_id, changes['blocks'], '+' if changes['truncated'] else '', changes['bytes'],
+            changes['first_snapshot_id'], changes['second_snapshot_id'], 'snapshotting' if changed else 'skipping'))
+        return changed
 
-    # TODO test this method - should work?
     def tag(self):
         logging.info("Finding volumes...")
-        volumes = self.ec2.get_volume_id(self.metadata['instanceId'], self.options.uuid)
+        instance_id = self.metadata['instanceId']
+        volumes = self.ec2.get_volumes(instance_id, self.options.uuid)
 
         if len(volumes) > 0:
-            for volume_id in volumes:
-                if self.ec2.tag_volume(volume_id, self.ec2.get_volume_name(volume_id), self.options):
-                    logging.info("Volume %s tagged." % volume_id)
+            # named from this instance's Name tag and the attachments already described, like attach does
+            name = self.instance_name() or instance_id
+            for volume in volumes:
+                attachment = next(x for x in volume['Attachments'] if x['InstanceId'] == instance_id)
+                volume_name = "%s-%s" % (name, attachment['Device'])
+                if self.ec2.tag_volume(volume['VolumeId'], volume_name, self.options):
+                    logging.info("Volume %s tagged." % volume['VolumeId'])
                 else:
-                    logging.error("Volume %s failed tagging." % volume_id)
+                    logging.error("Volume %s failed tagging." % volume['VolumeId'])
         else:
             logging.info("No volumes found")
@@ -0,0 +1,77 @@
+import os
+import threading
+from ebspin.deleter import THROTTLE_CODES
+
+
+class ClientStats:
+    """API calls, retries and throttling seen by the clients make_client built"""
+
+    def __init__(self):
+        self.calls = 0
+        self.retries = 0
+        self.throttles = 0
+        self._lock = threading.Lock()
+
+    def as_dict(self):
+        with self._lock:
+            return {'calls': self.calls, 'retries': self.retries, 'throttles': self.throttles}
+
+    def _count_call(self, **kwargs):
+        with self._lock:
+            self.calls += 1
+
+    def _count_retries(self, parsed=None, exception=None, **kwargs):
+        response = parsed if parsed is not None else getattr(exception, 'response', None) or {}
+        with self._lock:
+            self.retries += response.get('ResponseMetadata', {}).get('RetryAttempts', 0)
+
+    def _count_throttle(self, response=None, **kwargs):
+        if not response or not isinstance(response[1], dict):
+            return None
+        if response[1].get('Error', {}).get('Code') in THROTTLE_CODES:
+            with self._lock:
+                self.throttles += 1
+        return None
+
+    def register(self, client):
+        service = client.meta.service_model.service_id.hyphenize()
+        events = client.meta.events
+        events.register('before-parameter-build.%s' % service, self._count_call)
+        events.register('after-call.%s' % service, self._count_retries)
+        events.register('after-call-error.%s' % service, self._count_retries)
+        events.register('needs-retry.%s' % service, self._count_throttle)
+
+
+def make_session(region, data_path=None):
+    """A boto3 session for region, optionally searching data_path for service models first"""
+
+    import boto3
+    import botocore.session
+
+    botocore_session = botocore.session.get_session()
+    if data_path:
+        search_paths = [data_path, botocore_session.get_config_variable('data_path')]
+        botocore_session.set_config_variable('data_path', os.pathsep.join([x for x in search_paths if x]))
+    return boto3.Session(botocore_session=botocore_session, region_name=region)
+
+
+def make_client(session, service='ec2', concurrency=1, retry_mode='adaptive', max_attempts=10,
+                connect_timeout=5, read_timeout=30, stats=None):
+    """The one way ebs-pin builds clients: a connection pool big enough for `concurrency`
+    threads, botocore's standard or adaptive (client-side rate limited) retries, and
+    keep-alive connections.
+    """
+
+    from botocore.config import Config
+
+    config = Config(
+        max_pool_connections=max(10, concurrency + 2),
+        retries={'mode': retry_mode, 'max_attempts': max_attempts},
+        connect_timeout=connect_timeout,
+        read_timeout=read_timeout,
+        tcp_keepalive=True
+    )
+    client = session.client(service, config=config)
+    if stats is not None:
+        stats.register(client)
+    return client
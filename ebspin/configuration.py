@@ -1,33 +1,203 @@
-import requests, json, logging
+import json, logging, os, stat, time
+from ebspin import model, status
+
+IMDS = "http://169.254.169.254"
+TOKEN_TTL = 21600
+# Refresh a cached token this long before IMDS would expire it
+TOKEN_MARGIN = 300
+
+
+def boot_id():
+    """Changes on every boot, so a cache baked into an AMI or carried over a reboot is never trusted"""
+
+    try:
+        with open('/proc/sys/kernel/random/boot_id') as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def default_cache_dir():
+    if os.environ.get('EBS_PIN_CACHE_DIR'):
+        return os.environ['EBS_PIN_CACHE_DIR']
+    if os.geteuid() == 0:
+        return '/var/cache/ebs-pin'
+    return os.path.join(os.path.expanduser('~'), '.cache', 'ebs-pin')
+
+
+def _client_error(e):
+    """4xx responses other than throttling won't succeed on a retry"""
+
+    response = getattr(e, 'response', None)
+    return response is not None and 400 <= response.status_code < 500 and response.status_code != 429
+
+
+def _request(method, path, headers=None, retry_timeouts=True):
+    """Send an IMDS request, retrying failures; without retry_timeouts a timeout fails straight away, unlogged"""
+
+    # requests and backoff are only imported when the cache can't answer
+    import backoff
+    import requests
+
+    def giveup(e):
+        return _client_error(e) or (not retry_timeouts and isinstance(e, requests.exceptions.Timeout))
+
+    @backoff.on_exception(backoff.expo, requests.exceptions.RequestException, max_tries=3, max_time=10, giveup=giveup,
+                          logger='backoff' if retry_timeouts else None)
+    def send():
+        r = requests.request(method, IMDS + path, headers=headers or {}, timeout=1)
+        r.raise_for_status()
+        return r
+
+    return send()
 
 
 class Configuration:
-    def metadata(self):
-        headers = {}
+    cache_dir = None
+
+    def __init__(self, cache_dir=None):
+        """cache_dir=False disables the on-disk cache"""
+
+        self.cache_dir = default_cache_dir() if cache_dir is None else cache_dir
+        self._token = None
+        self._token_failed = False
+        self._tags = None
+
+    def _cache_path(self, name):
+        """Path of a cache file, or None if the cache directory can't be kept private"""
+
+        if not self.cache_dir or boot_id() is None:
+            return None
         try:
-            r = requests.get(
-                "http://169.254.169.254/latest/api/token",
-                headers={"X-aws-ec2-metadata-token-ttl-seconds": "21600"},
-                timeout=1,
-            )
-            token = r.text
-            headers = {"X-aws-ec2-metadata-token": token}
-            r.raise_for_status()
+            os.makedirs(self.cache_dir, mode=0o700, exist_ok=True)
+            st = os.stat(self.cache_dir)
+        except OSError as e:
+            logging.debug("Metadata cache unavailable: %s" % e)
+            return None
+        if st.st_uid != os.geteuid() or st.st_mode & (stat.S_IWGRP | stat.S_IWOTH | stat.S_IRWXO):
+            logging.warning("Not caching metadata in %s, it is not private to this user" % self.cache_dir)
+            return None
+        return os.path.join(self.cache_dir, name)
+
+    def _read_cache(self, name):
+        path = self._cache_path(name)
+        if not path:
+            return None
+        try:
+            st = os.stat(path)
+            if st.st_uid != os.geteuid() or st.st_mode & 0o077:
+                return None
+            with open(path) as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if cached.get('bootId') != boot_id():
+            return None
+        return cached
+
+    def _write_cache(self, name, data):
+        path = self._cache_path(name)
+        if not path:
+            return
+        try:
+            status.write(path, dict(data, bootId=boot_id()))
+        except OSError as e:
+            logging.debug("Couldn't write metadata cache %s: %s" % (path, e))
+
+    def token(self, refresh=False):
+        """IMDSv2 session token, reused from the cache until shortly before it expires.
+
+        If IMDS won't give one, e.g. because the PUT's hop limit doesn't reach
+        a container, that is remembered and None is returned for the rest of
+        the run rather than waiting on the PUT again.
+        """
+
+        if self._token_failed:
+            return None
+        if not refresh:
+            if self._token:
+                return self._token
+            cached = self._read_cache('token.json')
+            if cached and cached['expires'] > time.time() + TOKEN_MARGIN:
+                self._token = cached['token']
+                return self._token
+
+        try:
+            # a PUT that times out won't get through on a retry either
+            r = _request('PUT', "/latest/api/token", headers={"X-aws-ec2-metadata-token-ttl-seconds": str(TOKEN_TTL)}, retry_timeouts=False)
         except Exception:
             logging.warning(
                 "Couldn't get IMDSv2 token, attempting to get instance ID without it..."
             )
-            pass
+            self._token_failed = True
+            return None
+        self._token = r.text
+        self._write_cache('token.json', {'token': self._token, 'expires': time.time() + TOKEN_TTL})
+        return self._token
+
+    def get(self, path):
+        """GET an IMDS path with the session token, refreshing the token once if IMDS rejects it"""
+
+        import requests
 
+        token = self.token()
+        headers = {"X-aws-ec2-metadata-token": token} if token else {}
+        try:
+            return _request('GET', path, headers=headers)
+        except requests.exceptions.HTTPError as e:
+            if e.response is None or e.response.status_code != 401 or not token:
+                raise
+        token = self.token(refresh=True)
+        headers = {"X-aws-ec2-metadata-token": token} if token else {}
+        return _request('GET', path, headers=headers)
+
+    def metadata(self):
+        """The instance identity document, which can't change until the next boot, so is cached on disk"""
+
+        cached = self._read_cache('identity.json')
+        if cached:
+            return cached['document']
+
+        r = self.get("/latest/dynamic/instance-identity/document")
         try:
-            r = requests.get(
-                "http://169.254.169.254/latest/dynamic/instance-identity/document",
-                headers=headers,
-                timeout=1,
-            )
-            r.raise_for_status()
             metadata = r.json()
-            return metadata
         except json.decoder.JSONDecodeError as e:
             logging.error("Error decoding metadata: %s" % r.text)
             raise e
+        self._write_cache('identity.json', {'document': metadata})
+        return metadata
+
+    def instance_tags(self, keys=None):
+        """The instance's tags from IMDS, only those named in `keys` if given, or None if instance metadata tags aren't enabled.
+
+        The tag keys are listed once, and each value is fetched the first time it's asked for.
+        """
+
+        import requests
+
+        try:
+            if self._tags is None:
+                self._tags = dict.fromkeys(self.get("/latest/meta-data/tags/instance").text.split())
+            if self._tags is False:
+                return None
+            wanted = [key for key in self._tags if keys is None or key in keys]
+            for key in wanted:
+                if self._tags[key] is None:
+                    self._tags[key] = self.get("/latest/meta-data/tags/instance/%s" % key).text
+        except requests.exceptions.RequestException as e:
+            logging.debug("Instance tags unavailable from IMDS: %s" % e)
+            self._tags = False
+            return None
+        return {key: self._tags[key] for key in wanted}
+
+    def model_path(self):
+        """botocore data path with a trimmed EC2 model for faster client creation, or None to use the full model"""
+
+        path = self._cache_path('models')
+        if not path:
+            return None
+        try:
+            return model.trimmed_data_path(path)
+        except Exception as e:
+            logging.warning("Couldn't build trimmed EC2 model, using the full one: %s" % e)
+            return None
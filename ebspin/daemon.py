@@ -0,0 +1,106 @@
+import time
+import random
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from ebspin import status
+from ebspin.base import VolumeOptions
+
+# Spans kept for --timings, as the daemon records some with every run; totals still cover them all
+MAX_SPANS = 10000
+
+
+class Daemon:
+    """Snapshot each UUID every `interval` seconds from one long-running process.
+
+    The session, client and instance metadata of `base` are reused for every
+    run. Each UUID has its own lock, so a snapshot that is still waiting when
+    its next run comes due makes that run skip rather than overlap it. After
+    each snapshot all but the `keep` newest completed snapshots of each volume are pruned,
+    and the state of every UUID is written to `status_file`.
+    """
+
+    base = None
+    uuids = None
+    interval = None
+    jitter = None
+    keep = None
+    status_file = None
+
+    def __init__(self, base, uuids, interval=3600, jitter=0.1, keep=7, status_file=None):
+        self.base = base
+        self.base.timer.limit(MAX_SPANS)
+        self.uuids = list(uuids)
+        self.interval = interval
+        self.jitter = jitter
+        self.keep = keep
+        self.status_file = status_file
+        self.stop = threading.Event()
+        self.state = {uuid: {'runs': 0, 'skipped': 0} for uuid in self.uuids}
+        self._locks = {uuid: threading.Lock() for uuid in self.uuids}
+        self._status_lock = threading.Lock()
+
+    def delay(self):
+        """Seconds until the next run, jittered so instances started together drift apart"""
+
+        return self.interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def run_once(self, uuid):
+        """Snapshot and prune one UUID, or skip if its previous run hasn't finished"""
+
+        lock = self._locks[uuid]
+        if not lock.acquire(blocking=False):
+            logging.warning("Previous run for %s is still going, skipping this one" % uuid)
+            self._update(uuid, skipped=self.state[uuid]['skipped'] + 1)
+            return None
+
+        options = VolumeOptions(self.base.options, uuid=uuid)
+        started = time.time()
+        self._update(uuid, running=True, last_started=started)
+        result = {'running': False, 'last_started': started, 'error': None}
+        try:
+            with self.base.timer.span('daemon.run', uuid=uuid):
+                self.base.ec2.reset_inventory(uuid)
+                result['snapshots'] = self.base.snapshot(options)
+                if self.keep is not None:
+                    result['pruned'] = self.base.ec2.prune_snapshots(uuid, self.keep, options.tags).as_dict()
+            result['status'] = 'ok'
+        except Exception as e:
+            logging.exception("Snapshot run for %s failed" % uuid)
+            result['status'] = 'failed'
+            result['error'] = str(e)
+        finally:
+            result['last_finished'] = time.time()
+            result['seconds'] = round(result['last_finished'] - started, 3)
+            result['runs'] = self.state[uuid]['runs'] + 1
+            lock.release()
+            self._update(uuid, **result)
+        return result
+
+    def _update(self, uuid, **fields):
+        with self._status_lock:
+            self.state[uuid].update(fields)
+            if self.status_file:
+                status.write(self.status_file, {
+                    'started': self.base.timer.started,
+                    'updated': time.time(),
+                    'interval': self.interval,
+                    'uuids': self.state,
+                    'api': self.base.stats.as_dict()
+                })
+
+    def run(self):
+        """Run until stop is set, letting runs in progress finish"""
+
+        # spread the first runs over the jitter window rather than all starting at once
+        now = time.monotonic()
+        due = {uuid: now + random.uniform(0, self.interval * self.jitter) for uuid in self.uuids}
+        with ThreadPoolExecutor(max_workers=max(1, len(self.uuids))) as executor:
+            while not self.stop.is_set():
+                uuid = min(due, key=due.get)
+                if self.stop.wait(max(0, due[uuid] - time.monotonic())):
+                    break
+                due[uuid] = time.monotonic() + self.delay()
+                self._update(uuid, next_run=time.time() + due[uuid] - time.monotonic())
+                executor.submit(self.run_once, uuid)
+        logging.info("Daemon stopped")
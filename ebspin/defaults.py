@@ -0,0 +1,47 @@
+import copy
+import argparse
+
+# Option defaults, used by the ebs-pin parser and for building Base without the command line.
+# Imports nothing heavy so ebs-pin can read it before parsing.
+DEFAULTS = {
+    'uuid': None,
+    'device': '/dev/xvdf',
+    'size': 10,
+    'type': 'gp2',
+    'tags': {},
+    'concurrency': 4,
+    'cache_dir': None,
+    'no_cache': False,
+    'fast_start': False,
+    'retry_mode': 'adaptive',
+    'connect_timeout': 5,
+    'read_timeout': 30,
+    'reuse_snapshot': False,
+    'background_cleanup': False,
+    'cleanup_log': '/var/log/ebs-pin-gc.log',
+    'status_file': None,
+    'no_wait': False,
+    'fast_restore': False,
+    'fast_restore_wait': 600,
+    'wait_device': False,
+    'device_timeout': 60,
+    'symlink': None,
+    'warm': False,
+    'warm_workers': 16,
+    'warm_rate': None,
+    'skip_unchanged': None,
+    'max_age': 86400,
+    'multi_volume': False,
+    'freeze': [],
+    'pre_hook': None,
+    'post_hook': None
+}
+
+
+def options(**overrides):
+    """A namespace of the DEFAULTS with `overrides` applied, as if parsed from the command line"""
+
+    result = argparse.Namespace(**copy.deepcopy(DEFAULTS))
+    for key, value in overrides.items():
+        setattr(result, key, value)
+    return result
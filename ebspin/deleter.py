@@ -0,0 +1,98 @@
+import logging
+import threading
+import botocore
+from concurrent.futures import ThreadPoolExecutor
+
+THROTTLE_CODES = ('RequestLimitExceeded', 'Throttling', 'ThrottlingException')
+
+
+def is_throttled(e):
+    """True if a ClientError is EC2 asking us to slow down"""
+
+    return isinstance(e, botocore.exceptions.ClientError) and e.response.get('Error', {}).get('Code') in THROTTLE_CODES
+
+
+class DeletionSummary:
+    """What happened to each resource handed to a Deleter"""
+
+    def __init__(self):
+        self.deleted = []
+        self.skipped = {}
+        self.failed = {}
+        self._lock = threading.Lock()
+
+    def delete(self, resource_id):
+        with self._lock:
+            self.deleted.append(resource_id)
+
+    def skip(self, resource_id, reason):
+        with self._lock:
+            self.skipped[resource_id] = reason
+
+    def fail(self, resource_id, reason):
+        with self._lock:
+            self.failed[resource_id] = reason
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                'deleted': list(self.deleted),
+                'skipped': dict(self.skipped),
+                'failed': dict(self.failed)
+            }
+
+
+class Deleter:
+    """Deletes resources through a bounded thread pool, backing off per call when throttled"""
+
+    concurrency = 1
+    max_tries = 5
+
+    def __init__(self, concurrency=1, max_tries=5):
+        self.concurrency = max(1, concurrency)
+        self.max_tries = max_tries
+
+    def run(self, resource_ids, delete, summary=None):
+        """Call delete(resource_id) for each id, with at most `concurrency` calls in flight.
+
+        resource_ids may be a generator; it is consumed as workers free up so a
+        long listing never has to be held in memory.
+        """
+
+        import backoff
+
+        summary = summary or DeletionSummary()
+        call = backoff.on_exception(
+            backoff.expo,
+            botocore.exceptions.ClientError,
+            max_tries=self.max_tries,
+            giveup=lambda e: not is_throttled(e)
+        )(delete)
+
+        def work(resource_id):
+            try:
+                call(resource_id)
+                summary.delete(resource_id)
+            except botocore.exceptions.ClientError as e:
+                logging.critical('Failed to delete {}, error: {}'.format(resource_id, e.response))
+                summary.fail(resource_id, e.response.get('Error', {}).get('Code', str(e)))
+
+        if self.concurrency == 1:
+            for resource_id in resource_ids:
+                work(resource_id)
+            return summary
+
+        slots = threading.BoundedSemaphore(self.concurrency * 2)
+
+        def done(resource_id, future):
+            if future.exception() is not None:
+                logging.critical('Failed to delete {}, error: {}'.format(resource_id, future.exception()))
+                summary.fail(resource_id, str(future.exception()))
+            slots.release()
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            for resource_id in resource_ids:
+                slots.acquire()
+                future = executor.submit(work, resource_id)
+                future.add_done_callback(lambda f, resource_id=resource_id: done(resource_id, f))
+        return summary
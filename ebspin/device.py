@@ -0,0 +1,126 @@
+import os
+import time
+import select
+import socket
+import logging
+
+SYS_BLOCK = '/sys/block'
+DEV = '/dev'
+# netlink protocol the kernel sends device add/remove events on
+NETLINK_KOBJECT_UEVENT = 15
+
+
+def uevents():
+    """A socket that becomes readable on every kernel uevent, or None where there are none (not Linux, no permission)"""
+
+    try:
+        events = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_KOBJECT_UEVENT)
+        events.bind((0, 1))
+    except (AttributeError, OSError) as e:
+        logging.debug("No uevents, polling for devices instead: %s" % e)
+        return None
+    return events
+
+
+def symlink(path, link):
+    """Point link at path, replacing whatever link pointed at before in one step"""
+
+    directory = os.path.dirname(link)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temporary = "%s.%s.tmp" % (link, os.getpid())
+    os.symlink(path, temporary)
+    os.replace(temporary, link)
+    return link
+
+
+class DeviceWaiter:
+    """Find the local block device an attached EBS volume shows up as, waiting for it to appear.
+
+    On Nitro instances every EBS volume is an NVMe namespace whose controller
+    serial is the volume id without its dash, whatever device name it was
+    attached as. On Xen instances the volume appears under the requested
+    name, with /dev/sdX showing up as /dev/xvdX. Rather than sleeping between
+    checks, wait() blocks on kernel uevents (`events`, any object with
+    fileno()) and looks again whenever one arrives.
+    """
+
+    sys_block = None
+    dev = None
+    events = None
+
+    def __init__(self, sys_block=None, dev=None, events=None):
+        self.sys_block = sys_block or SYS_BLOCK
+        self.dev = dev or DEV
+        self.events = events
+
+    def _read(self, *path):
+        try:
+            with open(os.path.join(self.sys_block, *path)) as f:
+                return f.read().strip()
+        except OSError:
+            return None
+
+    def candidates(self, device):
+        """Kernel names a volume attached as `device` may have on a Xen instance"""
+
+        name = os.path.basename(device)
+        names = [name]
+        if name.startswith('sd'):
+            names.append('xvd' + name[2:])
+        return names
+
+    def find(self, volume_id, device):
+        """Path of the block device for volume_id, attached as `device`, or None if it isn't there yet"""
+
+        serial = volume_id.replace('-', '')
+        try:
+            names = sorted(os.listdir(self.sys_block))
+        except OSError:
+            names = []
+        for name in names:
+            if name.startswith('nvme') and self._read(name, 'device', 'serial') == serial:
+                return os.path.join(self.dev, name)
+        for name in self.candidates(device):
+            if name in names:
+                return os.path.join(self.dev, name)
+        return None
+
+    def usable(self, path):
+        """True once the device node exists and the kernel knows its size"""
+
+        size = self._read(os.path.basename(path), 'size')
+        return os.path.exists(path) and bool(size) and int(size) > 0
+
+    def _drain(self, events):
+        fd = events.fileno()
+        os.set_blocking(fd, False)
+        try:
+            while os.read(fd, 65536):
+                pass
+        except BlockingIOError:
+            pass
+
+    def wait(self, volume_id, device, timeout=60):
+        """Path of volume_id's block device as soon as it is usable, or None after `timeout` seconds"""
+
+        events = self.events if self.events is not None else uevents()
+        deadline = time.monotonic() + timeout
+        try:
+            while True:
+                path = self.find(volume_id, device)
+                if path and self.usable(path):
+                    return path
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                if events is None:
+                    time.sleep(min(remaining, 0.5))
+                    continue
+                # look again every few seconds as well, in case an event was missed
+                readable, _, _ = select.select([events], [], [], min(remaining, 5))
+                if readable:
+                    self._drain(events)
+        finally:
+            if events is not None and self.events is None:
+                events.close()
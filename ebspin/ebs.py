@@ -0,0 +1,43 @@
+import logging
+from ebspin.timing import Timer, timed
+
+
+class Ebs:
+    """Changed-block tracking between snapshots through the EBS direct APIs"""
+
+    client = None
+    timer = None
+
+    def __init__(self, client, timer=None):
+        self.client = client
+        self.timer = timer or Timer()
+
+    @timed
+    def changed_blocks(self, first_snapshot_id, second_snapshot_id, limit=None):
+        """Number and size of the blocks that differ between two snapshots of the same volume.
+
+        With a `limit`, paging stops as soon as that many changed blocks have
+        been seen, and the result is marked as truncated.
+        """
+
+        kwargs = {'FirstSnapshotId': first_snapshot_id, 'SecondSnapshotId': second_snapshot_id, 'MaxResults': 10000}
+        blocks = 0
+        block_size = 0
+        pages = 0
+        while True:
+            response = self.client.list_changed_blocks(**kwargs)
+            pages += 1
+            blocks += len(response.get('ChangedBlocks', []))
+            block_size = response.get('BlockSize', block_size)
+            truncated = bool(response.get('NextToken')) and limit is not None and blocks >= limit
+            if truncated or not response.get('NextToken'):
+                break
+            kwargs['NextToken'] = response['NextToken']
+        logging.debug("ListChangedBlocks {}..{}: {} blocks in {} pages".format(first_snapshot_id, second_snapshot_id, blocks, pages))
+        return {
+            'first_snapshot_id': first_snapshot_id,
+            'second_snapshot_id': second_snapshot_id,
+            'blocks': blocks,
+            'bytes': blocks * block_size,
+            'truncated': truncated
+        }
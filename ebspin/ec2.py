@@ -1,126 +1,424 @@
+import fnmatch
 import logging
-import backoff
+import threading
 import botocore
 from typing import List
+from ebspin import inventory
+from ebspin.deleter import Deleter, DeletionSummary
+from ebspin.waiter import Poller
+from ebspin.timing import Timer, timed
+
+# Description given to snapshots taken of a detached volume to move it to another AZ
+MOVE_SNAPSHOT_DESCRIPTION = "ebs-pin: copy of detached volume %s"
 
 
 class Ec2:
     session = None
     client = None
+    deleter = None
+    inventories = None
+    poller = None
+    timer = None
 
-    def __init__(self, client):
+    def __init__(self, client, concurrency=1, poller=None, timer=None):
         self.client = client
-
+        self.deleter = Deleter(concurrency)
+        self.poller = poller or Poller()
+        self.timer = timer or Timer()
+        self.inventories = {}
+        self.created_volumes = {}
+        self.instance_names = {}
+        self.fast_restores = {}
+        self._lock = threading.Lock()
+
+    def inventory(self, uuid):
+        """The per-run Inventory of volumes and snapshots for a UUID"""
+
+        with self._lock:
+            if uuid not in self.inventories:
+                self.inventories[uuid] = inventory.Inventory(self.client, uuid)
+            return self.inventories[uuid]
+
+    def reset_inventory(self, uuid):
+        """Forget what was described for a UUID, or every UUID matching a pattern like db-*, so a long-running process sees changes made since"""
+
+        with self._lock:
+            for key in [x for x in self.inventories if x == uuid or fnmatch.fnmatchcase(x, uuid)]:
+                del self.inventories[key]
+
+    def calls_saved(self):
+        """Number of describe calls answered from the inventories this run"""
+
+        return sum(x.saved for x in list(self.inventories.values()))
+
+    def _cached_volume(self, volume_id):
+        for uuid_inventory in list(self.inventories.values()):
+            volume = uuid_inventory.volume(volume_id)
+            if volume is not None:
+                return uuid_inventory, volume
+        return None, None
+
+    @timed
+    def describe_volume(self, volume_id):
+        """Describe a single volume, from an inventory if one already holds it"""
+
+        uuid_inventory, volume = self._cached_volume(volume_id)
+        if volume is not None:
+            uuid_inventory.hit()
+            return volume
+        return self.client.describe_volumes(VolumeIds=[volume_id])['Volumes'][0]
+
+    @timed
     def get_latest_volume_id_available(self, uuid):
-        filters = [
-                {"Name": 'tag-key',   "Values": ['UUID']},
-                {"Name": 'tag-value', "Values": [uuid]}
-            ]
-        volumes = self.client.describe_volumes(Filters=filters)['Volumes']
-        volumes = sorted(volumes, key=lambda ss: ss['CreateTime'])
-        if len(volumes) == 0:
+        volume = inventory.latest(self.inventory(uuid).volumes(), 'CreateTime')
+        if volume is None:
             logging.info("No volume found")
             return None
-        volume = volumes.pop()
         logging.info("Volume state is {}".format(volume['State']))
         return volume['VolumeId']
 
+    @timed
     def get_latest_snapshot_id(self, uuid):
+        uuid_inventory = self.inventory(uuid)
+        if uuid_inventory.has_snapshots():
+            snapshots = [x for x in uuid_inventory.snapshots() if x['State'] == 'completed']
+            snapshot = inventory.latest(snapshots, 'StartTime')
+            return snapshot['SnapshotId'] if snapshot else None
+
         filters = [
-                {'Name': 'tag-key',   'Values': ['UUID']},
-                {'Name': 'tag-value', 'Values': [uuid]},
-                {'Name': 'status',    'Values': ['completed']}
+                {'Name': 'tag:UUID', 'Values': [uuid]},
+                {'Name': 'status',   'Values': ['completed']}
             ]
 
-        snapshots = self.client.describe_snapshots(Filters=filters)['Snapshots']
-        if len(snapshots) == 0:
+        snapshot = inventory.latest(inventory.snapshots(self.client, Filters=filters), 'StartTime')
+        if snapshot is None:
             return None
-        snapshot = sorted(snapshots, key=lambda ss: ss['StartTime']).pop()
         return snapshot['SnapshotId']
 
+    @timed
+    def get_latest_snapshots(self, uuid, volume_id, count=2):
+        """The `count` newest completed snapshots of volume_id with the UUID tag, newest first"""
+
+        snapshots = [x for x in self.inventory(uuid).snapshots() if x['VolumeId'] == volume_id and x['State'] == 'completed']
+        return sorted(snapshots, key=lambda x: x['StartTime'], reverse=True)[:count]
+
+    @timed
     def get_instance_name(self, instance_id):
+        """Name tag of an instance, looked up once per run"""
+
+        if instance_id in self.instance_names:
+            return self.instance_names[instance_id]
+
         filters = [
-                {"Name": 'resource-id', "Values": [instance_id]},
-                {"Name": 'key',         "Values": ['Name']}
+                {"Name": 'resource-type', "Values": ['instance']},
+                {"Name": 'resource-id',   "Values": [instance_id]},
+                {"Name": 'key',           "Values": ['Name']}
             ]
 
         try:
             result = self.client.describe_tags(Filters=filters)['Tags'][0]['Value']
-            return result
         except IndexError:
-            return None
+            result = None
+        self.instance_names[instance_id] = result
+        return result
+
+    @timed
+    def get_volumes(self, instance_id, uuid):
+        """Volumes with the UUID tag attached to instance_id"""
 
-    def get_volume_id(self, instance_id, uuid):
         filters = [
                 {'Name': 'attachment.instance-id', 'Values': [instance_id]},
                 {'Name': 'tag:UUID', 'Values': [uuid]},
             ]
 
-        result = self.client.describe_volumes(Filters=filters)
+        return list(inventory.volumes(self.client, Filters=filters))
+
+    @timed
+    def get_volume_id(self, instance_id, uuid):
         # return a list of volume_ids
-        volumes = [v['VolumeId'] for v in result['Volumes']]
-        if len(volumes) == 0:
-            return None
+        return [v['VolumeId'] for v in self.get_volumes(instance_id, uuid)]
+
+    @timed
+    def discover_volumes(self):
+        """Every volume in the region with a UUID tag, grouped by UUID, with each UUID's inventory seeded from them"""
 
+        filters = [
+                {'Name': 'tag-key', 'Values': ['UUID']},
+                {'Name': 'status',  'Values': inventory.VOLUME_STATES}
+            ]
+        volumes = {}
+        for volume in inventory.volumes(self.client, Filters=filters):
+            uuid = next(x['Value'] for x in volume['Tags'] if x['Key'] == 'UUID')
+            volumes.setdefault(uuid, []).append(volume)
+        for uuid, uuid_volumes in volumes.items():
+            self.inventory(uuid).seed_volumes(uuid_volumes)
+        return volumes
+
+    @timed
     def get_volume_name(self, volume_id):
-        attachment = self.client.describe_volumes(VolumeIds=[volume_id])['Volumes'][0]['Attachments'][0]
+        attachment = self.describe_volume(volume_id)['Attachments'][0]
         instance_name = self.get_instance_name(attachment['InstanceId'])
 
         return "%s-%s" % (instance_name, attachment['Device'])
 
+    @timed
     def get_volume_region(self, volume_id):
         try:
-            return self.client.describe_volumes(VolumeIds=[volume_id])['Volumes'][0]['AvailabilityZone']
+            return self.describe_volume(volume_id)['AvailabilityZone']
         except (KeyError, IndexError):
             return None
 
-    def create_volume(self, size, volume_type, availability_zone, snapshot_id=None):
+    @timed
+    def create_volume(self, size, volume_type, availability_zone, snapshot_id=None, tags=None):
+        """Create a volume, tagged with `tags` in the same call so it is never seen untagged"""
+
+        kwargs = {}
         if snapshot_id:
-            response = self.client.create_volume(
-                Size=size,
-                SnapshotId=snapshot_id,
-                AvailabilityZone=availability_zone,
-                VolumeType=volume_type
-            )
-        else:
-            response = self.client.create_volume(
-                Size=size,
-                AvailabilityZone=availability_zone,
-                VolumeType=volume_type
-            )
+            kwargs['SnapshotId'] = snapshot_id
+        if tags:
+            kwargs['TagSpecifications'] = [{'ResourceType': 'volume', 'Tags': tags}]
+        response = self.client.create_volume(
+            Size=size,
+            AvailabilityZone=availability_zone,
+            VolumeType=volume_type,
+            **kwargs
+        )
         volume_id = response['VolumeId']
+        self.created_volumes[volume_id] = response
+        uuid = next((x['Value'] for x in tags or [] if x['Key'] == 'UUID'), None)
+        if uuid:
+            self.inventory(uuid).add_volume(dict(response, Tags=tags))
 
-        waiter = self.client.get_waiter('volume_available')
-        waiter.wait(
-            VolumeIds=[volume_id]
-        )
+        self.wait_for_volume_available(volume_id)
         return response['VolumeId']
 
-    def create_snapshot(self, volume_id, extra_tags=None):
-        snapshot_id = self.client.create_snapshot(VolumeId=volume_id)['SnapshotId']
-        tags = self.client.describe_volumes(VolumeIds=[volume_id])['Volumes'][0]['Tags']
+    @timed
+    def find_reusable_snapshot(self, uuid, volume_id):
+        """Newest pending or completed snapshot ebs-pin took of volume_id after it was detached, or None
+
+        EC2 does not report when a volume was detached, so only snapshots that
+        create_snapshot(move=True) marked as taken of the detached volume qualify,
+        and only while the volume is still detached. Any later attach by ebs-pin
+        cleans those snapshots up, so a marked snapshot is never older than the
+        volume's last write.
+        """
+
+        volume = self.describe_volume(volume_id)
+        if volume['State'] != 'available' or volume.get('Attachments'):
+            logging.info("Volume {} is {}, not reusing snapshots.".format(volume_id, volume['State']))
+            return None
+
+        filters = [
+                {'Name': 'tag:UUID',    'Values': [uuid]},
+                {'Name': 'volume-id',   'Values': [volume_id]},
+                {'Name': 'description', 'Values': [MOVE_SNAPSHOT_DESCRIPTION % volume_id]},
+                {'Name': 'status',      'Values': ['pending', 'completed']}
+            ]
+        return inventory.latest(inventory.snapshots(self.client, Filters=filters), 'StartTime')
+
+    @timed
+    def create_snapshot(self, volume_id, extra_tags=None, move=False, wait=True, tags=None):
+        """Snapshot a volume with its tags (`tags`, or described if not given) plus extra_tags, in one call"""
+
+        volume = None
+        if tags is None or move:
+            volume = self.describe_volume(volume_id)
+        tags = list(volume.get('Tags', []) if tags is None else tags)
 
         if extra_tags:
             for key, value in extra_tags.items():
                 tags.append({'Key': key, 'Value': value})
 
-        self.tag_snapshot(snapshot_id, tags)
-
-        waiter = self.client.get_waiter('snapshot_completed')
-        waiter.wait(
-            Filters=[
-                {
-                    'Name': 'status',
-                    'Values': [
-                        'completed'
-                    ]
-                }
-            ],
-            SnapshotIds=[snapshot_id]
+        kwargs = {}
+        if move and volume['State'] == 'available':
+            kwargs['Description'] = MOVE_SNAPSHOT_DESCRIPTION % volume_id
+        if tags:
+            kwargs['TagSpecifications'] = [{'ResourceType': 'snapshot', 'Tags': tags}]
+        response = self.client.create_snapshot(VolumeId=volume_id, **kwargs)
+        snapshot_id = response['SnapshotId']
+
+        uuid = next((x['Value'] for x in tags if x['Key'] == 'UUID'), None)
+        if uuid in self.inventories:
+            self.inventories[uuid].add_snapshot(dict(response, Tags=tags))
+
+        if wait:
+            self.wait_for_snapshot(snapshot_id)
+        return snapshot_id
+
+    @timed
+    def instance_specification(self, instance_id, volume_ids):
+        """CreateSnapshots InstanceSpecification for just volume_ids of instance_id, excluding its boot and other volumes"""
+
+        instance = self.client.describe_instances(InstanceIds=[instance_id])['Reservations'][0]['Instances'][0]
+        root_volume_id = None
+        others = []
+        for mapping in instance.get('BlockDeviceMappings', []):
+            volume_id = mapping.get('Ebs', {}).get('VolumeId')
+            if mapping['DeviceName'] == instance.get('RootDeviceName'):
+                root_volume_id = volume_id
+            elif volume_id and volume_id not in volume_ids:
+                others.append(volume_id)
+
+        specification = {'InstanceId': instance_id, 'ExcludeBootVolume': root_volume_id not in volume_ids}
+        if others:
+            specification['ExcludeDataVolumeIds'] = others
+        return specification
+
+    @timed
+    def create_snapshots(self, instance_id, volumes, extra_tags=None, wait=True, specification=None):
+        """Snapshot `volumes` attached to instance_id at the same moment in one CreateSnapshots call, returning {volume_id: snapshot_id}
+
+        CreateSnapshots takes every volume on the instance unless told
+        otherwise, so `specification` (instance_specification() if not given)
+        excludes the rest. Each snapshot gets its volume's tags plus
+        extra_tags.
+        """
+
+        wanted = [x['VolumeId'] for x in volumes]
+        specification = specification or self.instance_specification(instance_id, wanted)
+        kwargs = {}
+        tags = [{'Key': key, 'Value': value} for key, value in (extra_tags or {}).items()]
+        if tags:
+            kwargs['TagSpecifications'] = [{'ResourceType': 'snapshot', 'Tags': tags}]
+        response = self.client.create_snapshots(InstanceSpecification=specification, CopyTagsFromSource='volume', **kwargs)
+
+        snapshots = {}
+        for snapshot in response['Snapshots']:
+            if snapshot['VolumeId'] not in wanted:
+                # attached since describe_instances; left for whoever attached it
+                logging.warning("Volume {} was also snapshotted as {}".format(snapshot['VolumeId'], snapshot['SnapshotId']))
+                continue
+            snapshots[snapshot['VolumeId']] = snapshot['SnapshotId']
+            volume = next(x for x in volumes if x['VolumeId'] == snapshot['VolumeId'])
+            snapshot_tags = volume.get('Tags', []) + tags
+            uuid = next((x['Value'] for x in snapshot_tags if x['Key'] == 'UUID'), None)
+            if uuid in self.inventories:
+                self.inventories[uuid].add_snapshot(dict(snapshot, Tags=snapshot_tags))
+
+        if wait:
+            self.wait_for_snapshots(list(snapshots.values()))
+        return snapshots
+
+    @timed
+    def wait_for_snapshot(self, snapshot_id):
+        self.wait_for_snapshots([snapshot_id])
+        return snapshot_id
+
+    @timed
+    def wait_for_snapshots(self, snapshot_ids):
+        """Wait for all of snapshot_ids to complete, polling them together in one describe call"""
+
+        pending = set(snapshot_ids)
+
+        def completed():
+            snapshots = self.client.describe_snapshots(SnapshotIds=sorted(pending))['Snapshots']
+            failed = [x['SnapshotId'] for x in snapshots if x['State'] == 'error']
+            if failed:
+                raise botocore.exceptions.WaiterError('snapshot_completed', 'Snapshots {} failed'.format(failed), {})
+            pending.difference_update(x['SnapshotId'] for x in snapshots if x['State'] == 'completed')
+            if pending and len(snapshot_ids) > 1:
+                logging.info("Waiting for {} of {} snapshots...".format(len(pending), len(snapshot_ids)))
+            return not pending
+
+        self.poller.wait('snapshot_completed', completed)
+        return snapshot_ids
+
+    @timed
+    def wait_for_volume_available(self, volume_id):
+        def available():
+            states = [x['State'] for x in self.client.describe_volumes(VolumeIds=[volume_id])['Volumes']]
+            if 'deleted' in states or 'error' in states:
+                raise botocore.exceptions.WaiterError('volume_available', 'Volume {} is {}'.format(volume_id, states), {})
+            return len(states) > 0 and all(x == 'available' for x in states)
+
+        self.poller.wait('volume_available', available)
+        return volume_id
+
+    @timed
+    def wait_for_volume_in_use(self, volume_id, instance_id):
+        filters = [
+                {'Name': 'attachment.status',      'Values': ['attached']},
+                {'Name': 'attachment.instance-id', 'Values': [instance_id]}
+            ]
+
+        def in_use():
+            states = [x['State'] for x in self.client.describe_volumes(Filters=filters, VolumeIds=[volume_id])['Volumes']]
+            if 'deleted' in states:
+                raise botocore.exceptions.WaiterError('volume_in_use', 'Volume {} was deleted'.format(volume_id), {})
+            return len(states) > 0 and all(x == 'in-use' for x in states)
+
+        self.poller.wait('volume_in_use', in_use)
+        return volume_id
+
+    @timed
+    def enable_fast_snapshot_restore(self, snapshot_id, availability_zone):
+        """Start enabling fast snapshot restore of snapshot_id in one AZ, returning its state"""
+
+        response = self.client.enable_fast_snapshot_restores(
+            AvailabilityZones=[availability_zone],
+            SourceSnapshotIds=[snapshot_id]
         )
+        for failure in response.get('Unsuccessful', []):
+            for error in failure.get('FastSnapshotRestoreStateErrors', []):
+                raise botocore.exceptions.ClientError({'Error': error['Error']}, 'EnableFastSnapshotRestores')
+        state = response['Successful'][0]['State']
+        self.fast_restores[(snapshot_id, availability_zone)] = state
+        return state
+
+    @timed
+    def wait_for_fast_snapshot_restore(self, snapshot_id, availability_zone, timeout=None):
+        """Wait until fast snapshot restore of snapshot_id in the AZ is optimizing or enabled.
+
+        Volumes created while it is optimizing get some of the benefit; only enabled promises fully initialised volumes.
+        """
+
+        filters = [
+                {'Name': 'snapshot-id',       'Values': [snapshot_id]},
+                {'Name': 'availability-zone', 'Values': [availability_zone]}
+            ]
+
+        def ready():
+            states = [x['State'] for x in self.client.describe_fast_snapshot_restores(Filters=filters)['FastSnapshotRestores']]
+            if states:
+                self.fast_restores[(snapshot_id, availability_zone)] = states[0]
+            if not states or 'disabling' in states or 'disabled' in states:
+                raise botocore.exceptions.WaiterError('fast_restore_enabled', 'Fast snapshot restore of {} is {}'.format(snapshot_id, states or 'disabled'), {})
+            return all(x in ('optimizing', 'enabled') for x in states)
+
+        self.poller.wait('fast_restore_enabled', ready, timeout)
         return snapshot_id
 
-    def tag_volume(self, volume_id, volume_name, options):
+    @timed
+    def disable_fast_snapshot_restore(self, snapshot_id, availability_zones):
+        """Stop paying for fast snapshot restore of snapshot_id in availability_zones"""
+
+        logging.info("Disabling fast snapshot restore of {} in {}...".format(snapshot_id, ", ".join(availability_zones)))
+        response = self.client.disable_fast_snapshot_restores(
+            AvailabilityZones=list(availability_zones),
+            SourceSnapshotIds=[snapshot_id]
+        )
+        for availability_zone in availability_zones:
+            self.fast_restores.pop((snapshot_id, availability_zone), None)
+        return response
+
+    @timed
+    def get_fast_snapshot_restores(self):
+        """AZs each of this account's snapshots has fast snapshot restore enabled, or being enabled, in"""
+
+        filters = [{'Name': 'state', 'Values': ['enabling', 'optimizing', 'enabled']}]
+        restores = {}
+        try:
+            for restore in inventory.paginate(self.client, 'describe_fast_snapshot_restores', 'FastSnapshotRestores', Filters=filters):
+                restores.setdefault(restore['SnapshotId'], []).append(restore['AvailabilityZone'])
+                self.fast_restores[(restore['SnapshotId'], restore['AvailabilityZone'])] = restore['State']
+        except botocore.exceptions.ClientError as e:
+            logging.warning("Could not list fast snapshot restores, snapshots will be deleted without disabling it: {}".format(e))
+        return restores
+
+    @timed
+    def volume_tags(self, volume_name, options):
+        """The Name, UUID and command line tags ebs-pin gives its volumes"""
+
         tags = [
                 {'Key': 'Name',         'Value': volume_name},
                 {'Key': 'UUID',         'Value': options.uuid}
@@ -131,23 +429,22 @@ class Ec2:
         # Add the tags provided from the command line
         for key, value in options.tags.items():
             tags.append({'Key': key, 'Value': value})
+        return tags
 
-        return self.client.create_tags(
+    @timed
+    def tag_volume(self, volume_id, volume_name, options):
+        tags = self.volume_tags(volume_name, options)
+        response = self.client.create_tags(
                 Resources=[volume_id],
                 Tags=tags
             )
+        volume = dict(self.created_volumes.get(volume_id, {}), VolumeId=volume_id, Tags=tags)
+        self.inventory(options.uuid).add_volume(volume)
+        return response
 
-    def tag_snapshot(self, snapshot_id, tags):
-        return self.client.create_tags(
-            Resources=[snapshot_id],
-            Tags=tags
-        )
-
+    @timed
     def attach_volume(self, volume_id, instance_id, device):
-        waiter = self.client.get_waiter('volume_available')
-        waiter.wait(
-            VolumeIds=[volume_id]
-        )
+        self.wait_for_volume_available(volume_id)
 
         logging.info('Volume is ready, attaching...')
         self.client.attach_volume(
@@ -156,76 +453,112 @@ class Ec2:
             Device=device
         )
 
-        waiter = self.client.get_waiter('volume_in_use')
-        waiter.wait(
-            Filters=[
-                {
-                    'Name': 'attachment.status',
-                    'Values': [
-                        'attached'
-                    ]
-                },
-                {
-                    'Name': 'attachment.instance-id',
-                    'Values': [
-                        instance_id
-                    ]
-                }
-            ],
-            VolumeIds=[volume_id]
-        )
+        self.wait_for_volume_in_use(volume_id, instance_id)
+
+        uuid_inventory, volume = self._cached_volume(volume_id)
+        if uuid_inventory:
+            uuid_inventory.add_volume({
+                'VolumeId': volume_id,
+                'State': 'in-use',
+                'Attachments': [{'VolumeId': volume_id, 'InstanceId': instance_id, 'Device': device, 'State': 'attached'}]
+            })
         return volume_id
 
-    @backoff.on_exception(backoff.expo, Exception, max_tries=3)
+    @timed
     def clean_old_volumes(self, uuid, volume_id):
         """Delete all volumes matching UUID, except the one currently attached"""
 
         logging.info("Deleting old volumes...")
-        filters = [
-                {"Name": 'tag-key',   "Values": ['UUID']},
-                {"Name": 'tag-value', "Values": [uuid]}
-            ]
-        volumes = self.client.describe_volumes(Filters=filters)['Volumes']
-        old_volumes = [x for x in volumes if x['VolumeId'] != volume_id]
-        if len(old_volumes) > 0:
-            for volume in old_volumes:
-                logging.info("Deleting volume {}...".format(volume['VolumeId']))
-                try:
-                    self.client.delete_volume(VolumeId=volume['VolumeId'])
-                except botocore.exceptions.ClientError as e:
-                    logging.critical('Failed to delete volume {}, error: {}'.format(volume['VolumeId'], e.response))
-            logging.info("Old volumes deleted.")
+        uuid_inventory = self.inventory(uuid)
+        summary = DeletionSummary()
+
+        def old_volumes():
+            for volume in uuid_inventory.volumes():
+                if volume['VolumeId'] == volume_id:
+                    summary.skip(volume['VolumeId'], 'current volume')
+                    continue
+                yield volume['VolumeId']
+
+        def delete(old_volume_id):
+            logging.info("Deleting volume {}...".format(old_volume_id))
+            self.client.delete_volume(VolumeId=old_volume_id)
+            uuid_inventory.remove_volume(old_volume_id)
+
+        self.deleter.run(old_volumes(), delete, summary)
+        if summary.deleted or summary.failed:
+            logging.info("Old volumes deleted: {}, failed: {}.".format(len(summary.deleted), len(summary.failed)))
         else:
             logging.info("No old volumes detected.")
+        return summary
 
-    @backoff.on_exception(backoff.expo, Exception, max_tries=3)
-    def clean_snapshots(self, uuid, extra_tags={}):
-        """Delete all snapshots matching UUID"""
+    @timed
+    def clean_snapshots(self, uuid, extra_tags={}, fast_restore=False):
+        """Delete all snapshots matching UUID, disabling fast snapshot restore on them first if fast_restore"""
 
         logging.info("Deleting snapshots...")
-        filters = [
-            {'Name': 'tag-key',   'Values': ['UUID']},
-            {'Name': 'tag-value', 'Values': [uuid]}
-        ]
-        snapshots = self.client.describe_snapshots(Filters=filters)['Snapshots']
-        if len(snapshots) > 0:
-            for snapshot in snapshots:
-                snapshot_tags = set([x["Key"] for x in snapshot['Tags']])
-                cli_tags = set(["UUID", "Name"] + [x for x in extra_tags])
-                if can_delete_snapshot(snapshot_tags=snapshot_tags, cli_tags=cli_tags):
-                    logging.info("Deleting snapshot {}...".format(snapshot['SnapshotId']))
-                    try:
-                        self.client.delete_snapshot(
-                            SnapshotId=snapshot['SnapshotId']
-                        )
-                    except botocore.exceptions.ClientError as e:
-                        logging.critical('Failed to delete snapshot {}, error: {}'.format(snapshot['SnapshotId'], e.response))
-                else:
-                    unexpected_tags = snapshot_tags.symmetric_difference(cli_tags)
-                    logging.info("Snapshot {} had different tags ({}), skipping.".format(snapshot['SnapshotId'], unexpected_tags))
-            logging.info("Snapshots deleted.")
+        uuid_inventory = self.inventory(uuid)
+        summary = DeletionSummary()
+        restores = self.get_fast_snapshot_restores() if fast_restore else {}
+
+        def deletable_snapshots():
+            for snapshot in self._deletable_snapshots(uuid_inventory.snapshots(keep=False), extra_tags, summary):
+                yield snapshot['SnapshotId']
+
+        self.deleter.run(deletable_snapshots(), self._snapshot_deleter(uuid_inventory, restores), summary)
+        if summary.deleted or summary.failed or summary.skipped:
+            logging.info("Snapshots deleted: {}, skipped: {}, failed: {}.".format(len(summary.deleted), len(summary.skipped), len(summary.failed)))
         else:
             logging.info("No snapshots detected.")
+        return summary
+
+    @timed
+    def prune_snapshots(self, uuid, keep, extra_tags={}):
+        """Delete all but the `keep` newest completed snapshots of each volume matching UUID; pending ones are left alone.
+
+        Counting per volume means a UUID pattern covering a multi-volume set keeps
+        `keep` whole sets, rather than the newest snapshots of some of its volumes.
+        """
+
+        logging.info("Pruning snapshots to the newest {} per volume...".format(keep))
+        uuid_inventory = self.inventory(uuid)
+        summary = DeletionSummary()
+
+        completed = [x for x in uuid_inventory.snapshots(keep=False) if x['State'] == 'completed']
+        by_volume = {}
+        for snapshot in self._deletable_snapshots(completed, extra_tags, summary):
+            by_volume.setdefault(snapshot['VolumeId'], []).append(snapshot)
+        old = []
+        for snapshots in by_volume.values():
+            snapshots.sort(key=lambda x: x['StartTime'], reverse=True)
+            for snapshot in snapshots[:keep]:
+                summary.skip(snapshot['SnapshotId'], 'retained')
+            old += snapshots[keep:]
+
+        self.deleter.run([x['SnapshotId'] for x in old], self._snapshot_deleter(uuid_inventory), summary)
+        logging.info("Snapshots pruned: {}, kept: {}, failed: {}.".format(len(summary.deleted), len(summary.skipped), len(summary.failed)))
+        return summary
+
+    def _deletable_snapshots(self, snapshots, extra_tags, summary):
+        """Snapshots whose tags show ebs-pin took them with these tags, recording the rest as skipped"""
+
+        cli_tags = set(["UUID", "Name"] + [x for x in extra_tags])
+        for snapshot in snapshots:
+            snapshot_tags = set([x["Key"] for x in snapshot['Tags']])
+            if can_delete_snapshot(snapshot_tags=snapshot_tags, cli_tags=cli_tags):
+                yield snapshot
+            else:
+                unexpected_tags = snapshot_tags.symmetric_difference(cli_tags)
+                logging.info("Snapshot {} had different tags ({}), skipping.".format(snapshot['SnapshotId'], unexpected_tags))
+                summary.skip(snapshot['SnapshotId'], 'different tags')
+
+    def _snapshot_deleter(self, uuid_inventory, restores=None):
+        def delete(snapshot_id):
+            if restores and snapshot_id in restores:
+                self.disable_fast_snapshot_restore(snapshot_id, restores[snapshot_id])
+            logging.info("Deleting snapshot {}...".format(snapshot_id))
+            self.client.delete_snapshot(SnapshotId=snapshot_id)
+            uuid_inventory.remove_snapshot(snapshot_id)
+        return delete
 
 
 def can_delete_snapshot(snapshot_tags: List[str], cli_tags: List[str]) -> bool:
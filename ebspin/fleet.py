@@ -0,0 +1,105 @@
+import time
+import fnmatch
+import logging
+import botocore
+from concurrent.futures import ThreadPoolExecutor
+
+# Snapshot ids per wait_for_snapshots call when waiting for a whole fleet
+WAIT_BATCH = 200
+
+
+class Fleet:
+    """Snapshot every attached UUID-tagged volume in a region from one control host.
+
+    Snapshots start from at most `concurrency` threads, paced by `bucket` (a
+    ratelimit.TokenBucket, one token per snapshot), so a whole fleet doesn't
+    hit CreateSnapshot in the same second the way per-instance cron jobs do.
+    """
+
+    ec2 = None
+    bucket = None
+
+    def __init__(self, ec2, concurrency=20, bucket=None, tags=None, uuids=None):
+        self.ec2 = ec2
+        self.concurrency = concurrency
+        self.bucket = bucket
+        self.tags = tags or {}
+        self.uuids = uuids
+
+    def discover(self):
+        """Attached volumes whose UUID matches one of the `uuids` patterns (all UUIDs by default)"""
+
+        volumes = []
+        for uuid, uuid_volumes in sorted(self.ec2.discover_volumes().items()):
+            if self.uuids and not any(fnmatch.fnmatchcase(uuid, x) for x in self.uuids):
+                continue
+            volumes += [dict(x, UUID=uuid) for x in uuid_volumes if x['State'] == 'in-use']
+        return volumes
+
+    def _snapshot(self, volume):
+        attachments = volume.get('Attachments') or [{}]
+        result = {
+            'uuid': volume['UUID'],
+            'volume_id': volume['VolumeId'],
+            'instance_id': attachments[0].get('InstanceId'),
+            'snapshot_id': None,
+            'error': None
+        }
+        result['paced'] = round(self.bucket.acquire(), 3) if self.bucket else 0
+        started = time.time()
+        try:
+            result['snapshot_id'] = self.ec2.create_snapshot(volume['VolumeId'], self.tags, wait=False, tags=volume['Tags'])
+            result['status'] = 'started'
+        except botocore.exceptions.ClientError as e:
+            logging.error("Volume %s snapshot failed: %s" % (volume['VolumeId'], e))
+            result['status'] = 'failed'
+            result['error'] = str(e)
+        result['seconds'] = round(time.time() - started, 3)
+        return result
+
+    def _wait(self, results):
+        started = [x for x in results if x['snapshot_id']]
+        for index in range(0, len(started), WAIT_BATCH):
+            batch = started[index:index + WAIT_BATCH]
+            try:
+                self.ec2.wait_for_snapshots([x['snapshot_id'] for x in batch])
+                for result in batch:
+                    result['status'] = 'completed'
+            except botocore.exceptions.WaiterError as e:
+                for result in batch:
+                    result['status'] = 'failed'
+                    result['error'] = str(e)
+
+    def run(self, wait=False):
+        """Discover and snapshot the fleet, returning throughput and a result per volume"""
+
+        started = time.time()
+        with self.ec2.timer.span('fleet.discover'):
+            volumes = self.discover()
+        discovered = time.time()
+        logging.info("Snapshotting %s volumes..." % len(volumes))
+
+        # throughput is of starting snapshots, not of paging through the region's volumes
+        with self.ec2.timer.span('fleet.snapshot', volumes=len(volumes)):
+            with ThreadPoolExecutor(max_workers=max(1, self.concurrency)) as executor:
+                results = list(executor.map(self._snapshot, volumes))
+        snapshotted = time.time() - discovered
+
+        if wait:
+            with self.ec2.timer.span('fleet.wait'):
+                self._wait(results)
+
+        failed = [x for x in results if x['status'] == 'failed']
+        report = {
+            'volumes': len(volumes),
+            'started': len(results) - len(failed),
+            'failed': len(failed),
+            'seconds': round(time.time() - started, 3),
+            'discover_seconds': round(discovered - started, 3),
+            'snapshot_seconds': round(snapshotted, 3),
+            'snapshots_per_second': round(len(results) / snapshotted, 3) if snapshotted else None,
+            'paced_seconds': round(self.bucket.waited, 3) if self.bucket else 0,
+            'results': results
+        }
+        logging.info("Started %(started)s of %(volumes)s snapshots in %(snapshot_seconds)ss (%(snapshots_per_second)s/s), %(failed)s failed" % report)
+        return report
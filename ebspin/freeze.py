@@ -0,0 +1,86 @@
+import time
+import logging
+import threading
+import subprocess
+
+# fsfreeze refuses to freeze a frozen filesystem, so freezes in one process take turns
+_lock = threading.Lock()
+
+
+def run(command):
+    """Run a command, raising CalledProcessError if it fails"""
+
+    logging.info("Running %s" % " ".join(command))
+    subprocess.run(command, check=True, stdin=subprocess.DEVNULL)
+
+
+class Freezer:
+    """Stop writes to the volumes for as short a time as possible while their snapshots start.
+
+    Entering runs `pre_hook` (a shell command, e.g. to flush a database) and
+    freezes each of `mountpoints` with fsfreeze; leaving thaws them in
+    reverse order and runs `post_hook`, even if starting the snapshots
+    failed. Commands go through `runner` (a function taking an argv list,
+    `run` by default) so tests can stand in for fsfreeze. `seconds` is how
+    long writes were held.
+    """
+
+    mountpoints = None
+    pre_hook = None
+    post_hook = None
+    seconds = None
+
+    def __init__(self, mountpoints=None, pre_hook=None, post_hook=None, runner=None):
+        self.mountpoints = list(mountpoints or [])
+        self.pre_hook = pre_hook
+        self.post_hook = post_hook
+        self.runner = runner or run
+        self.frozen = []
+        self._started = None
+
+    def __bool__(self):
+        return bool(self.mountpoints or self.pre_hook or self.post_hook)
+
+    def freeze(self):
+        _lock.acquire()
+        self._started = time.monotonic()
+        try:
+            if self.pre_hook:
+                self.runner(['/bin/sh', '-c', self.pre_hook])
+            for mountpoint in self.mountpoints:
+                self.runner(['fsfreeze', '--freeze', mountpoint])
+                self.frozen.append(mountpoint)
+        except Exception:
+            self.thaw()
+            raise
+
+    def thaw(self):
+        """Thaw every frozen mountpoint and run the post hook, then raise the first failure if any"""
+
+        errors = []
+        while self.frozen:
+            mountpoint = self.frozen.pop()
+            try:
+                self.runner(['fsfreeze', '--unfreeze', mountpoint])
+            except Exception as e:
+                logging.error("Could not thaw %s: %s" % (mountpoint, e))
+                errors.append(e)
+        if self.post_hook:
+            try:
+                self.runner(['/bin/sh', '-c', self.post_hook])
+            except Exception as e:
+                logging.error("Post-snapshot hook failed: %s" % e)
+                errors.append(e)
+        self.seconds = time.monotonic() - self._started
+        _lock.release()
+        if errors:
+            raise errors[0]
+        return self.seconds
+
+    def __enter__(self):
+        self.freeze()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.thaw()
+        return False
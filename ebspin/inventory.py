@@ -0,0 +1,131 @@
+import logging
+import threading
+
+# Volumes in any other state are already being deleted, so are neither attached nor cleaned up
+VOLUME_STATES = ['creating', 'available', 'in-use', 'error']
+
+
+def paginate(client, operation, key, on_page=None, **kwargs):
+    """Yield every item under `key` across all pages of a describe call, one page at a time"""
+
+    paginator = client.get_paginator(operation)
+    for page in paginator.paginate(**kwargs):
+        logging.debug("{} page with {} {}".format(operation, len(page.get(key, [])), key))
+        if on_page:
+            on_page(page)
+        for item in page.get(key, []):
+            yield item
+
+
+def volumes(client, **kwargs):
+    return paginate(client, 'describe_volumes', 'Volumes', **kwargs)
+
+
+def snapshots(client, **kwargs):
+    # without an owner EC2 also lists every public and shared snapshot that matches
+    kwargs.setdefault('OwnerIds', ['self'])
+    return paginate(client, 'describe_snapshots', 'Snapshots', **kwargs)
+
+
+def latest(items, key):
+    """Return the item with the greatest `key` in a single pass, or None if there are no items"""
+
+    return max(items, key=lambda x: x[key], default=None)
+
+
+class Inventory:
+    """Volumes and snapshots tagged with one UUID, described at most once per run.
+
+    ebs-pin records the volumes and snapshots it creates or deletes here so the
+    cached view stays accurate without going back to EC2.
+    """
+
+    client = None
+    uuid = None
+
+    def __init__(self, client, uuid):
+        self.client = client
+        self.uuid = uuid
+        self.calls = 0
+        self.saved = 0
+        self._volumes = None
+        self._snapshots = None
+        self._lock = threading.RLock()
+
+    def filters(self):
+        return [{'Name': 'tag:UUID', 'Values': [self.uuid]}]
+
+    def volume_filters(self):
+        return self.filters() + [{'Name': 'status', 'Values': VOLUME_STATES}]
+
+    def _count_call(self, page):
+        with self._lock:
+            self.calls += 1
+
+    def hit(self):
+        """Record a describe call that was answered from the cache"""
+
+        with self._lock:
+            self.saved += 1
+
+    def volumes(self):
+        with self._lock:
+            if self._volumes is None:
+                self._volumes = {}
+                for volume in volumes(self.client, on_page=self._count_call, Filters=self.volume_filters()):
+                    self._volumes[volume['VolumeId']] = volume
+            else:
+                self.hit()
+            return list(self._volumes.values())
+
+    def snapshots(self, keep=True):
+        """Snapshots for the UUID; with keep=False an uncached listing is streamed rather than stored"""
+
+        with self._lock:
+            if self._snapshots is not None:
+                self.hit()
+                return iter(list(self._snapshots.values()))
+            if not keep:
+                return snapshots(self.client, on_page=self._count_call, Filters=self.filters())
+            self._snapshots = {}
+            for snapshot in snapshots(self.client, on_page=self._count_call, Filters=self.filters()):
+                self._snapshots[snapshot['SnapshotId']] = snapshot
+            return iter(list(self._snapshots.values()))
+
+    def seed_volumes(self, volumes):
+        """Take every volume with this UUID from a listing made elsewhere, as if volumes() had described them"""
+
+        with self._lock:
+            self._volumes = {x['VolumeId']: x for x in volumes}
+
+    def has_snapshots(self):
+        return self._snapshots is not None
+
+    def volume(self, volume_id):
+        """The cached volume, or None if it has not been described (does not call EC2)"""
+
+        with self._lock:
+            if self._volumes is None:
+                return None
+            return self._volumes.get(volume_id)
+
+    def add_volume(self, volume):
+        with self._lock:
+            if self._volumes is not None:
+                cached = self._volumes.get(volume['VolumeId'], {})
+                self._volumes[volume['VolumeId']] = dict(cached, **volume)
+
+    def remove_volume(self, volume_id):
+        with self._lock:
+            if self._volumes is not None:
+                self._volumes.pop(volume_id, None)
+
+    def add_snapshot(self, snapshot):
+        with self._lock:
+            if self._snapshots is not None:
+                self._snapshots[snapshot['SnapshotId']] = snapshot
+
+    def remove_snapshot(self, snapshot_id):
+        with self._lock:
+            if self._snapshots is not None:
+                self._snapshots.pop(snapshot_id, None)
@@ -0,0 +1,86 @@
+import glob
+import hashlib
+import logging
+import os
+from ebspin import status
+
+# The EC2 operations ebs-pin calls; everything else is left out of the trimmed model
+OPERATIONS = [
+    'AttachVolume',
+    'CreateSnapshot',
+    'CreateSnapshots',
+    'CreateTags',
+    'CreateVolume',
+    'DeleteSnapshot',
+    'DeleteVolume',
+    'DescribeFastSnapshotRestores',
+    'DescribeInstances',
+    'DescribeSnapshots',
+    'DescribeTags',
+    'DescribeVolumes',
+    'DisableFastSnapshotRestores',
+    'EnableFastSnapshotRestores',
+]
+
+
+def _strip_documentation(data):
+    if isinstance(data, dict):
+        return {k: _strip_documentation(v) for k, v in data.items() if k != 'documentation'}
+    if isinstance(data, list):
+        return [_strip_documentation(x) for x in data]
+    return data
+
+
+def trim(model, operations):
+    """Cut a botocore service model down to `operations` and the shapes they reach"""
+
+    shapes = set()
+
+    def walk(name):
+        if name in shapes:
+            return
+        shapes.add(name)
+        shape = model['shapes'][name]
+        for member in shape.get('members', {}).values():
+            walk(member['shape'])
+        for key in ('member', 'key', 'value'):
+            if key in shape:
+                walk(shape[key]['shape'])
+
+    trimmed = {'version': model.get('version'), 'metadata': model['metadata'], 'operations': {}}
+    for name in operations:
+        operation = model['operations'][name]
+        trimmed['operations'][name] = _strip_documentation(operation)
+        for key in ('input', 'output'):
+            if key in operation:
+                walk(operation[key]['shape'])
+        for error in operation.get('errors', []):
+            walk(error['shape'])
+    trimmed['shapes'] = {name: _strip_documentation(model['shapes'][name]) for name in shapes}
+    return trimmed
+
+
+def trimmed_data_path(cache_dir):
+    """A botocore data path whose EC2 model only has OPERATIONS, built on first use.
+
+    Parsing the full EC2 model dominates client creation. The trimmed copy is
+    keyed on the botocore version and OPERATIONS, so upgrading either builds a
+    fresh one; every other data file still comes from botocore itself.
+    """
+
+    import botocore
+    import botocore.session
+
+    key = hashlib.sha1(("%s %s" % (botocore.__version__, ' '.join(sorted(OPERATIONS)))).encode()).hexdigest()[:12]
+    data_path = os.path.join(cache_dir, key)
+    if glob.glob(os.path.join(data_path, 'ec2', '*', 'service-2.json')):
+        return data_path
+
+    logging.info("Building trimmed EC2 model in %s..." % data_path)
+    loader = botocore.session.get_session().get_component('data_loader')
+    api_version = loader.determine_latest_version('ec2', 'service-2')
+    model = loader.load_service_model('ec2', 'service-2', api_version)
+    directory = os.path.join(data_path, 'ec2', api_version)
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    status.write(os.path.join(directory, 'service-2.json'), trim(model, OPERATIONS))
+    return data_path
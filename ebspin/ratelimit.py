@@ -0,0 +1,38 @@
+import time
+import threading
+
+
+class TokenBucket:
+    """Hand out `rate` tokens a second, letting up to `burst` build up while idle.
+
+    A caller asking for more tokens than are left takes them anyway and sleeps
+    until the bucket would have refilled, so concurrent callers queue in the
+    order they asked and a request bigger than `burst` still goes through.
+    """
+
+    rate = None
+    burst = None
+
+    def __init__(self, rate, burst=None):
+        if rate <= 0:
+            raise ValueError("Rate must be positive, not %s" % rate)
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else rate)
+        self.tokens = self.burst
+        self.waited = 0
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        """Take `tokens`, sleeping as long as needed to stay under the rate; returns the seconds slept"""
+
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self.tokens -= tokens
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+            self.waited += wait
+        if wait:
+            time.sleep(wait)
+        return wait
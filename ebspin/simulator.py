@@ -0,0 +1,527 @@
+import fnmatch
+import datetime
+import heapq
+import itertools
+import json
+import random
+import threading
+import botocore.exceptions
+
+EPOCH = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+ACCOUNT_ID = '123456789012'
+
+
+def _client_error(operation_name, code, message, status=400):
+    return botocore.exceptions.ClientError(
+        {'Error': {'Code': code, 'Message': message}, 'ResponseMetadata': {'HTTPStatusCode': status}},
+        operation_name
+    )
+
+
+def _tags_from_specifications(specifications, resource_type):
+    tags = []
+    for specification in specifications or []:
+        if specification.get('ResourceType') == resource_type:
+            tags += specification.get('Tags', [])
+    return tags
+
+
+class _Paginator:
+    def __init__(self, method):
+        self.method = method
+
+    def paginate(self, PaginationConfig=None, **kwargs):
+        config = PaginationConfig or {}
+        if config.get('PageSize'):
+            kwargs['MaxResults'] = config['PageSize']
+        while True:
+            page = self.method(**kwargs)
+            yield page
+            if not page.get('NextToken'):
+                return
+            kwargs['NextToken'] = page['NextToken']
+
+
+class Simulator:
+    """In-process stand-in for the boto3 EC2 client, for testing ebs-pin at scale without AWS.
+
+    Volumes and snapshots move through their lifecycles on a virtual clock:
+    volumes are `creating` for `volume_delay` seconds, `attaching` for
+    `attach_delay` and `deleting` for `delete_delay`; snapshots are `pending`
+    for `snapshot_delay`. Fast snapshot restore is `enabling` for
+    `restore_delay` seconds and `optimizing` for as long again before it is
+    `enabled`. New resources only show up in describe calls after
+    `visibility_delay`, as EC2's eventual consistency allows. The clock moves
+    by `latency` on every call and by whatever is passed to sleep(), so patch
+    time.sleep with it to let waiters make progress. A `throttle` share of
+    calls, optionally only `throttle_operations`, fail with
+    RequestLimitExceeded.
+    """
+
+    def __init__(self, volume_delay=5, attach_delay=3, delete_delay=2, snapshot_delay=60,
+                 restore_delay=60, visibility_delay=0, latency=0, page_size=1000, throttle=0.0,
+                 throttle_operations=None, seed=0):
+        self.volume_delay = volume_delay
+        self.attach_delay = attach_delay
+        self.delete_delay = delete_delay
+        self.snapshot_delay = snapshot_delay
+        self.restore_delay = restore_delay
+        self.visibility_delay = visibility_delay
+        self.latency = latency
+        self.page_size = page_size
+        self.throttle = throttle
+        self.throttle_operations = throttle_operations
+        self.random = random.Random(seed)
+        self.now = 0.0
+        self.calls = {}
+        self.throttled = 0
+        self.volumes = {}
+        self.snapshots = {}
+        self.instances = {}
+        self.fast_restores = {}
+        self._transitions = []
+        self._ids = itertools.count(1)
+        self._lock = threading.RLock()
+
+    # clock and bookkeeping
+
+    def sleep(self, seconds):
+        with self._lock:
+            self.now += seconds
+            self._advance()
+
+    def timestamp(self, seconds=None):
+        return EPOCH + datetime.timedelta(seconds=self.now if seconds is None else seconds)
+
+    def _new_id(self, prefix):
+        return '%s-%017x' % (prefix, next(self._ids))
+
+    def _schedule(self, delay, action):
+        heapq.heappush(self._transitions, (self.now + delay, next(self._ids), action))
+
+    def _advance(self):
+        while self._transitions and self._transitions[0][0] <= self.now:
+            _, _, action = heapq.heappop(self._transitions)
+            action()
+
+    def _call(self, operation_name):
+        with self._lock:
+            self.calls[operation_name] = self.calls.get(operation_name, 0) + 1
+            self.now += self.latency
+            self._advance()
+            if self.throttle and (self.throttle_operations is None or operation_name in self.throttle_operations):
+                if self.random.random() < self.throttle:
+                    self.throttled += 1
+                    raise _client_error(operation_name, 'RequestLimitExceeded', 'Request limit exceeded.', 503)
+
+    def _visible(self, record):
+        return record['_visible'] <= self.now
+
+    # seeding state
+
+    def add_instance(self, instance_id=None, availability_zone='ap-southeast-2a', name=None, tags=None, root_device='/dev/xvda'):
+        instance_id = instance_id or self._new_id('i')
+        tags = list(tags or [])
+        if name is not None:
+            tags.append({'Key': 'Name', 'Value': name})
+        with self._lock:
+            self.instances[instance_id] = {'InstanceId': instance_id, 'AvailabilityZone': availability_zone, 'Tags': tags, 'RootDeviceName': root_device, '_visible': self.now}
+        return instance_id
+
+    def add_volume(self, volume_id=None, availability_zone='ap-southeast-2a', size=10, volume_type='gp2',
+                   state='available', tags=None, snapshot_id='', created=None, instance_id=None, device=None):
+        """Add an existing volume, visible straight away"""
+
+        volume_id = volume_id or self._new_id('vol')
+        with self._lock:
+            self.volumes[volume_id] = {
+                'VolumeId': volume_id,
+                'Size': size,
+                'SnapshotId': snapshot_id,
+                'AvailabilityZone': availability_zone,
+                'State': 'in-use' if instance_id else state,
+                'CreateTime': self.timestamp(self.now if created is None else created),
+                'VolumeType': volume_type,
+                'Attachments': [],
+                'Tags': list(tags or []),
+                '_visible': self.now
+            }
+            if instance_id:
+                self.volumes[volume_id]['Attachments'] = [self._attachment(volume_id, instance_id, device or '/dev/xvdf', 'attached')]
+        return volume_id
+
+    def add_snapshot(self, snapshot_id=None, volume_id='vol-ffffffff', size=10, state='completed', tags=None,
+                     description='', started=None, owner_id=ACCOUNT_ID):
+        """Add an existing snapshot, visible straight away; another owner's snapshots are public"""
+
+        snapshot_id = snapshot_id or self._new_id('snap')
+        with self._lock:
+            self.snapshots[snapshot_id] = {
+                'SnapshotId': snapshot_id,
+                'VolumeId': volume_id,
+                'VolumeSize': size,
+                'State': state,
+                'Progress': '100%' if state == 'completed' else '0%',
+                'StartTime': self.timestamp(self.now if started is None else started),
+                'Description': description,
+                'OwnerId': owner_id,
+                'Encrypted': False,
+                'Tags': list(tags or []),
+                '_visible': self.now
+            }
+        return snapshot_id
+
+    def populate(self, uuids, volumes=2, snapshots=10, availability_zones=('ap-southeast-2a', 'ap-southeast-2b', 'ap-southeast-2c')):
+        """A history for each UUID: `volumes` detached volumes and `snapshots` snapshots spread across AZs and time"""
+
+        for uuid in uuids:
+            tags = [{'Key': 'Name', 'Value': 'instance-%s' % uuid}, {'Key': 'UUID', 'Value': uuid}]
+            volume_id = 'vol-ffffffff'
+            for x in range(volumes):
+                volume_id = self.add_volume(
+                    availability_zone=self.random.choice(availability_zones),
+                    tags=tags,
+                    created=-self.random.randint(60, 30 * 86400)
+                )
+            for x in range(snapshots):
+                self.add_snapshot(volume_id=volume_id, tags=tags, started=-self.random.randint(60, 30 * 86400))
+
+    # filters and pagination
+
+    def _tag_values(self, record, key):
+        return [x['Value'] for x in record.get('Tags', []) if x['Key'] == key]
+
+    def _field(self, record, name):
+        """Values a filter name matches against for a volume or snapshot"""
+
+        if name == 'tag-key':
+            return [x['Key'] for x in record.get('Tags', [])]
+        if name == 'tag-value':
+            return [x['Value'] for x in record.get('Tags', [])]
+        if name.startswith('tag:'):
+            return self._tag_values(record, name[4:])
+        if name.startswith('attachment.'):
+            field = {'instance-id': 'InstanceId', 'status': 'State', 'device': 'Device'}[name[11:]]
+            return [x[field] for x in record.get('Attachments', [])]
+        field = {
+            'volume-id': 'VolumeId',
+            'snapshot-id': 'SnapshotId',
+            'status': 'State',
+            'description': 'Description',
+            'availability-zone': 'AvailabilityZone',
+            'owner-id': 'OwnerId',
+            'volume-type': 'VolumeType',
+        }.get(name)
+        if field is None:
+            raise _client_error('Describe', 'InvalidParameterValue', 'The filter %s is invalid' % name)
+        return [record[field]] if field in record else []
+
+    def _matches(self, record, filters):
+        for f in filters or []:
+            values = self._field(record, f['Name'])
+            if not any(fnmatch.fnmatchcase(str(value), pattern) for value in values for pattern in f['Values']):
+                return False
+        return True
+
+    def _page(self, key, records, cursor, MaxResults=None, NextToken=None):
+        """One page of records, ordered by cursor(record).
+
+        NextToken is the cursor of the last record returned rather than an
+        offset, so, as with EC2, deleting records already listed doesn't
+        make the next page skip any.
+        """
+
+        records = sorted(records, key=cursor)
+        if NextToken:
+            records = [x for x in records if cursor(x) > tuple(json.loads(NextToken))]
+        sizes = [x for x in (MaxResults, self.page_size) if x]
+        size = min(sizes) if sizes else len(records)
+        response = {key: records[:size], 'ResponseMetadata': {'HTTPStatusCode': 200, 'RetryAttempts': 0}}
+        if len(records) > size:
+            response['NextToken'] = json.dumps(cursor(records[size - 1]))
+        return response
+
+    def _view(self, record):
+        view = {k: (list(v) if isinstance(v, list) else v) for k, v in record.items() if not k.startswith('_')}
+        if not view.get('Tags'):
+            view.pop('Tags', None)
+        return view
+
+    def _by_id(self, operation_name, records, ids, code):
+        found = []
+        for resource_id in ids:
+            record = records.get(resource_id)
+            if record is None or not self._visible(record):
+                raise _client_error(operation_name, code, "The ID '%s' does not exist" % resource_id)
+            found.append(record)
+        return found
+
+    def _lookup(self, operation_name, records, resource_id, code):
+        return self._by_id(operation_name, records, [resource_id], code)[0]
+
+    # the EC2 client API ebs-pin uses
+
+    def get_paginator(self, operation_name):
+        return _Paginator(getattr(self, operation_name))
+
+    def describe_volumes(self, VolumeIds=None, Filters=None, MaxResults=None, NextToken=None):
+        self._call('DescribeVolumes')
+        with self._lock:
+            if VolumeIds:
+                records = self._by_id('DescribeVolumes', self.volumes, VolumeIds, 'InvalidVolume.NotFound')
+                return {'Volumes': [self._view(x) for x in records if self._matches(x, Filters)]}
+            records = [x for x in self.volumes.values() if self._visible(x) and self._matches(x, Filters)]
+            response = self._page('Volumes', records, lambda x: (x['VolumeId'],), MaxResults, NextToken)
+            response['Volumes'] = [self._view(x) for x in response['Volumes']]
+            return response
+
+    def describe_snapshots(self, SnapshotIds=None, Filters=None, OwnerIds=None, MaxResults=None, NextToken=None):
+        self._call('DescribeSnapshots')
+        owners = [ACCOUNT_ID if x == 'self' else x for x in OwnerIds or []]
+        with self._lock:
+            if SnapshotIds:
+                records = self._by_id('DescribeSnapshots', self.snapshots, SnapshotIds, 'InvalidSnapshot.NotFound')
+            else:
+                records = [x for x in self.snapshots.values() if self._visible(x)]
+            records = [x for x in records if self._matches(x, Filters) and (not owners or x['OwnerId'] in owners)]
+            if SnapshotIds:
+                return {'Snapshots': [self._view(x) for x in records]}
+            response = self._page('Snapshots', records, lambda x: (x['SnapshotId'],), MaxResults, NextToken)
+            response['Snapshots'] = [self._view(x) for x in response['Snapshots']]
+            return response
+
+    def describe_tags(self, Filters=None, MaxResults=None, NextToken=None):
+        self._call('DescribeTags')
+        with self._lock:
+            tags = []
+            resources = [(x['InstanceId'], 'instance', x) for x in self.instances.values()]
+            resources += [(x['VolumeId'], 'volume', x) for x in self.volumes.values() if self._visible(x)]
+            resources += [(x['SnapshotId'], 'snapshot', x) for x in self.snapshots.values() if self._visible(x)]
+            for resource_id, resource_type, record in resources:
+                for tag in record.get('Tags', []):
+                    tags.append({'Key': tag['Key'], 'Value': tag['Value'], 'ResourceId': resource_id, 'ResourceType': resource_type})
+            fields = {'resource-id': 'ResourceId', 'resource-type': 'ResourceType', 'key': 'Key', 'value': 'Value'}
+            for f in Filters or []:
+                tags = [x for x in tags if any(fnmatch.fnmatchcase(x[fields[f['Name']]], p) for p in f['Values'])]
+            return self._page('Tags', tags, lambda x: (x['ResourceId'], x['Key']), MaxResults, NextToken)
+
+    def create_volume(self, AvailabilityZone, Size=None, SnapshotId=None, VolumeType='gp2', TagSpecifications=None, **kwargs):
+        self._call('CreateVolume')
+        with self._lock:
+            if SnapshotId:
+                snapshot = self._lookup('CreateVolume', self.snapshots, SnapshotId, 'InvalidSnapshot.NotFound')
+                if snapshot['State'] != 'completed':
+                    raise _client_error('CreateVolume', 'IncorrectState', "Snapshot '%s' is not 'completed'." % SnapshotId)
+                Size = Size or snapshot['VolumeSize']
+            volume_id = self.add_volume(
+                availability_zone=AvailabilityZone,
+                size=Size,
+                volume_type=VolumeType,
+                state='creating',
+                tags=_tags_from_specifications(TagSpecifications, 'volume'),
+                snapshot_id=SnapshotId or ''
+            )
+            volume = self.volumes[volume_id]
+            volume['_visible'] = self.now + self.visibility_delay
+            self._schedule(self.volume_delay, lambda: volume.update(State='available') if volume['State'] == 'creating' else None)
+            return self._view(volume)
+
+    def create_snapshot(self, VolumeId, Description='', TagSpecifications=None, **kwargs):
+        self._call('CreateSnapshot')
+        with self._lock:
+            volume = self._lookup('CreateSnapshot', self.volumes, VolumeId, 'InvalidVolume.NotFound')
+            snapshot_id = self.add_snapshot(
+                volume_id=VolumeId,
+                size=volume['Size'],
+                state='pending',
+                tags=_tags_from_specifications(TagSpecifications, 'snapshot'),
+                description=Description
+            )
+            snapshot = self.snapshots[snapshot_id]
+            snapshot['_visible'] = self.now + self.visibility_delay
+            self._schedule(self.snapshot_delay, lambda: snapshot.update(State='completed', Progress='100%'))
+            return self._view(snapshot)
+
+    def _attached(self, instance_id):
+        return [x for x in self.volumes.values() if any(a['InstanceId'] == instance_id for a in x['Attachments'])]
+
+    def describe_instances(self, InstanceIds=None, **kwargs):
+        self._call('DescribeInstances')
+        with self._lock:
+            instances = []
+            for instance in self._by_id('DescribeInstances', self.instances, InstanceIds or list(self.instances), 'InvalidInstanceID.NotFound'):
+                mappings = [{
+                    'DeviceName': x['Attachments'][0]['Device'],
+                    'Ebs': {'VolumeId': x['VolumeId'], 'Status': x['Attachments'][0]['State'], 'DeleteOnTermination': False}
+                } for x in self._attached(instance['InstanceId'])]
+                view = self._view(instance)
+                view['Placement'] = {'AvailabilityZone': view.pop('AvailabilityZone')}
+                view['BlockDeviceMappings'] = mappings
+                instances.append(view)
+            return {'Reservations': [{'Instances': instances}]}
+
+    def create_snapshots(self, InstanceSpecification, TagSpecifications=None, CopyTagsFromSource=None, Description='', **kwargs):
+        self._call('CreateSnapshots')
+        with self._lock:
+            instance = self._lookup('CreateSnapshots', self.instances, InstanceSpecification['InstanceId'], 'InvalidInstanceID.NotFound')
+            root_device = instance['RootDeviceName']
+            excluded = InstanceSpecification.get('ExcludeDataVolumeIds', [])
+            volumes = self._attached(instance['InstanceId'])
+            for volume_id in excluded:
+                volume = next((x for x in volumes if x['VolumeId'] == volume_id), None)
+                if volume is None or volume['Attachments'][0]['Device'] == root_device:
+                    raise _client_error('CreateSnapshots', 'InvalidParameterValue', "Volume '%s' is not a data volume of the instance" % volume_id)
+            snapshots = []
+            for volume in sorted(volumes, key=lambda x: x['VolumeId']):
+                if volume['VolumeId'] in excluded:
+                    continue
+                if InstanceSpecification.get('ExcludeBootVolume') and volume['Attachments'][0]['Device'] == root_device:
+                    continue
+                tags = list(volume['Tags']) if CopyTagsFromSource == 'volume' else []
+                snapshot_id = self.add_snapshot(
+                    volume_id=volume['VolumeId'],
+                    size=volume['Size'],
+                    state='pending',
+                    tags=tags + _tags_from_specifications(TagSpecifications, 'snapshot'),
+                    description=Description
+                )
+                snapshot = self.snapshots[snapshot_id]
+                snapshot['_visible'] = self.now + self.visibility_delay
+                self._schedule(self.snapshot_delay, lambda x=snapshot: x.update(State='completed', Progress='100%'))
+                snapshots.append(self._view(snapshot))
+            return {'Snapshots': snapshots}
+
+    def create_tags(self, Resources, Tags):
+        self._call('CreateTags')
+        with self._lock:
+            for resource_id in Resources:
+                record = self.volumes.get(resource_id) or self.snapshots.get(resource_id) or self.instances.get(resource_id)
+                if record is None:
+                    raise _client_error('CreateTags', 'InvalidID', "The ID '%s' is not valid" % resource_id)
+                keys = set(x['Key'] for x in Tags)
+                record['Tags'] = [x for x in record.get('Tags', []) if x['Key'] not in keys] + [dict(x) for x in Tags]
+            return {'ResponseMetadata': {'HTTPStatusCode': 200, 'RetryAttempts': 0}}
+
+    def _attachment(self, volume_id, instance_id, device, state):
+        return {
+            'AttachTime': self.timestamp(),
+            'Device': device,
+            'InstanceId': instance_id,
+            'State': state,
+            'VolumeId': volume_id,
+            'DeleteOnTermination': False
+        }
+
+    def attach_volume(self, VolumeId, InstanceId, Device):
+        self._call('AttachVolume')
+        with self._lock:
+            volume = self._lookup('AttachVolume', self.volumes, VolumeId, 'InvalidVolume.NotFound')
+            instance = self.instances.get(InstanceId)
+            if volume['State'] != 'available':
+                raise _client_error('AttachVolume', 'IncorrectState', "vol '%s' is not 'available'." % VolumeId)
+            if instance and instance['AvailabilityZone'] != volume['AvailabilityZone']:
+                raise _client_error('AttachVolume', 'InvalidVolume.ZoneMismatch', "The volume '%s' is not in the same availability zone as instance '%s'" % (VolumeId, InstanceId))
+            attachment = self._attachment(VolumeId, InstanceId, Device, 'attaching')
+            volume['State'] = 'in-use'
+            volume['Attachments'] = [attachment]
+            self._schedule(self.attach_delay, lambda: attachment.update(State='attached'))
+            return dict(attachment)
+
+    def detach_volume(self, VolumeId, **kwargs):
+        self._call('DetachVolume')
+        with self._lock:
+            volume = self._lookup('DetachVolume', self.volumes, VolumeId, 'InvalidVolume.NotFound')
+            if not volume['Attachments']:
+                raise _client_error('DetachVolume', 'IncorrectState', "Volume '%s' is in the 'available' state." % VolumeId)
+            attachment = volume['Attachments'][0]
+            attachment['State'] = 'detaching'
+
+            def detached():
+                volume['Attachments'] = []
+                volume['State'] = 'available'
+
+            self._schedule(self.attach_delay, detached)
+            return dict(attachment)
+
+    def delete_volume(self, VolumeId):
+        self._call('DeleteVolume')
+        with self._lock:
+            volume = self._lookup('DeleteVolume', self.volumes, VolumeId, 'InvalidVolume.NotFound')
+            if volume['Attachments']:
+                raise _client_error('DeleteVolume', 'VolumeInUse', "Volume %s is currently attached to %s" % (VolumeId, volume['Attachments'][0]['InstanceId']))
+            if volume['State'] not in ('available', 'error'):
+                raise _client_error('DeleteVolume', 'IncorrectState', "The volume '%s' is '%s'" % (VolumeId, volume['State']))
+            volume['State'] = 'deleting'
+            self._schedule(self.delete_delay, lambda: self.volumes.pop(VolumeId, None))
+            return {'ResponseMetadata': {'HTTPStatusCode': 200, 'RetryAttempts': 0}}
+
+    def delete_snapshot(self, SnapshotId):
+        self._call('DeleteSnapshot')
+        with self._lock:
+            self._lookup('DeleteSnapshot', self.snapshots, SnapshotId, 'InvalidSnapshot.NotFound')
+            del self.snapshots[SnapshotId]
+            # as with EC2, deleting a snapshot turns off its fast snapshot restore
+            for key in [x for x in self.fast_restores if x[0] == SnapshotId]:
+                del self.fast_restores[key]
+            return {'ResponseMetadata': {'HTTPStatusCode': 200, 'RetryAttempts': 0}}
+
+    def _restore_view(self, record):
+        return {k: v for k, v in record.items() if not k.startswith('_')}
+
+    def _restore_state(self, record, previous, state):
+        if record['State'] == previous and self.fast_restores.get(record['_key']) is record:
+            record['State'] = state
+
+    def enable_fast_snapshot_restores(self, AvailabilityZones, SourceSnapshotIds, **kwargs):
+        self._call('EnableFastSnapshotRestores')
+        successful, unsuccessful = [], []
+        with self._lock:
+            for snapshot_id in SourceSnapshotIds:
+                snapshot = self.snapshots.get(snapshot_id)
+                if snapshot is None or snapshot['State'] != 'completed':
+                    code = 'InvalidSnapshot.NotFound' if snapshot is None else 'IncorrectState'
+                    unsuccessful.append({'SnapshotId': snapshot_id, 'FastSnapshotRestoreStateErrors': [
+                        {'AvailabilityZone': x, 'Error': {'Code': code, 'Message': "Snapshot '%s' can't be restored fast" % snapshot_id}}
+                        for x in AvailabilityZones]})
+                    continue
+                for availability_zone in AvailabilityZones:
+                    key = (snapshot_id, availability_zone)
+                    record = self.fast_restores.get(key)
+                    if record is None or record['State'] == 'disabling':
+                        record = {'SnapshotId': snapshot_id, 'AvailabilityZone': availability_zone, 'State': 'enabling',
+                                  'OwnerId': snapshot['OwnerId'], 'EnablingTime': self.timestamp(), '_key': key}
+                        self.fast_restores[key] = record
+                        self._schedule(self.restore_delay, lambda r=record: self._restore_state(r, 'enabling', 'optimizing'))
+                        self._schedule(2 * self.restore_delay, lambda r=record: self._restore_state(r, 'optimizing', 'enabled'))
+                    successful.append(self._restore_view(record))
+            return {'Successful': successful, 'Unsuccessful': unsuccessful}
+
+    def disable_fast_snapshot_restores(self, AvailabilityZones, SourceSnapshotIds, **kwargs):
+        self._call('DisableFastSnapshotRestores')
+        successful, unsuccessful = [], []
+        with self._lock:
+            for snapshot_id in SourceSnapshotIds:
+                for availability_zone in AvailabilityZones:
+                    key = (snapshot_id, availability_zone)
+                    record = self.fast_restores.get(key)
+                    if record is None:
+                        unsuccessful.append({'SnapshotId': snapshot_id, 'FastSnapshotRestoreStateErrors': [
+                            {'AvailabilityZone': availability_zone, 'Error': {'Code': 'IncorrectState', 'Message': 'Fast snapshot restore is not enabled'}}]})
+                        continue
+                    record['State'] = 'disabling'
+                    self._schedule(self.delete_delay, lambda k=key, r=record: self.fast_restores.pop(k) if self.fast_restores.get(k) is r else None)
+                    successful.append(self._restore_view(record))
+            return {'Successful': successful, 'Unsuccessful': unsuccessful}
+
+    def describe_fast_snapshot_restores(self, Filters=None, MaxResults=None, NextToken=None, **kwargs):
+        self._call('DescribeFastSnapshotRestores')
+        with self._lock:
+            records = list(self.fast_restores.values())
+            fields = {'snapshot-id': 'SnapshotId', 'availability-zone': 'AvailabilityZone', 'state': 'State', 'owner-id': 'OwnerId'}
+            for f in Filters or []:
+                if f['Name'] not in fields:
+                    raise _client_error('DescribeFastSnapshotRestores', 'InvalidParameterValue', 'The filter %s is invalid' % f['Name'])
+                records = [x for x in records if any(fnmatch.fnmatchcase(x[fields[f['Name']]], p) for p in f['Values'])]
+            response = self._page('FastSnapshotRestores', records, lambda x: x['_key'], MaxResults, NextToken)
+            response['FastSnapshotRestores'] = [self._restore_view(x) for x in response['FastSnapshotRestores']]
+            return response
@@ -0,0 +1,17 @@
+import json
+import os
+import tempfile
+
+
+def write(path, status):
+    """Atomically replace the JSON status file at path"""
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix='.ebs-pin-status')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(status, f, indent=2, sort_keys=True, default=str)
+        os.replace(tmp, path)
+    except Exception:
+        os.unlink(tmp)
+        raise
@@ -0,0 +1,83 @@
+import sys
+import json
+import time
+import functools
+import collections
+import threading
+from contextlib import contextmanager
+from ebspin import status
+
+
+class Timer:
+    """Records named, possibly nested, spans of a run for a machine-readable summary"""
+
+    def __init__(self):
+        self.started = time.time()
+        self.spans = []
+        self._totals = {}
+        self._origin = time.perf_counter()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name, **fields):
+        stack = self._local.__dict__.setdefault('stack', [])
+        record = dict(fields, name=name, parent=stack[-1] if stack else None)
+        stack.append(name)
+        started = time.perf_counter()
+        try:
+            yield record
+        except BaseException as e:
+            record['error'] = type(e).__name__
+            raise
+        finally:
+            stack.pop()
+            record['start'] = round(started - self._origin, 6)
+            record['seconds'] = round(time.perf_counter() - started, 6)
+            with self._lock:
+                self.spans.append(record)
+                total = self._totals.setdefault(name, {'count': 0, 'seconds': 0})
+                total['count'] += 1
+                total['seconds'] = round(total['seconds'] + record['seconds'], 6)
+
+    def limit(self, max_spans):
+        """Keep only the newest max_spans spans from now on, so a long-running process doesn't grow; totals still count every span"""
+
+        with self._lock:
+            self.spans = collections.deque(self.spans, maxlen=max_spans)
+
+    def totals(self):
+        """Total seconds and count per span name"""
+
+        with self._lock:
+            return {name: dict(total) for name, total in self._totals.items()}
+
+    def summary(self, **extra):
+        with self._lock:
+            spans = sorted(self.spans, key=lambda x: x['start'])
+        return dict(
+            extra,
+            started=self.started,
+            seconds=round(time.perf_counter() - self._origin, 6),
+            totals=self.totals(),
+            spans=spans
+        )
+
+    def write(self, path, **extra):
+        """Write the summary as JSON to path, or to stdout if path is -"""
+
+        if path == '-':
+            json.dump(self.summary(**extra), sys.stdout, indent=2, sort_keys=True, default=str)
+            sys.stdout.write('\n')
+        else:
+            status.write(path, self.summary(**extra))
+
+
+def timed(method):
+    """Record every call of an Ec2 (or Ebs) method as an ec2.<method> (or ebs.<method>) span on self.timer"""
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.timer.span('%s.%s' % (type(self).__name__.lower(), method.__name__)):
+            return method(self, *args, **kwargs)
+    return wrapper
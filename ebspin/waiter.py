@@ -0,0 +1,85 @@
+import time
+import random
+import logging
+import threading
+import botocore
+from ebspin.deleter import is_throttled
+
+# Resource ids EC2 may not know about yet straight after they were created
+NOT_FOUND_CODES = ('InvalidVolume.NotFound', 'InvalidSnapshot.NotFound')
+
+
+class Schedule:
+    """Poll after `delay` seconds, growing by `multiplier` up to `max_delay`, jittered by +/- `jitter`, for up to `timeout` seconds"""
+
+    def __init__(self, delay=1, max_delay=5, multiplier=1.5, jitter=0.2, timeout=300):
+        self.delay = delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+        self.jitter = jitter
+        self.timeout = timeout
+
+    def delays(self):
+        delay = self.delay
+        while True:
+            yield delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+            delay = min(delay * self.multiplier, self.max_delay)
+
+
+# Volumes are usually available or attached within seconds
+FAST = Schedule(delay=1, max_delay=5, timeout=300)
+# Snapshots take minutes to hours, so there is nothing to gain from polling them quickly
+SLOW = Schedule(delay=5, max_delay=30, timeout=6 * 3600)
+# Fast snapshot restore takes minutes per TiB to get to optimizing; callers give their own budget
+RESTORE = Schedule(delay=5, max_delay=15, timeout=600)
+
+SCHEDULES = {
+    'volume_available': FAST,
+    'volume_in_use': FAST,
+    'snapshot_completed': SLOW,
+    'fast_restore_enabled': RESTORE,
+}
+
+
+class Poller:
+    """Replacement for boto3's fixed 15 second waiters, counting how many polls each phase took"""
+
+    def __init__(self, schedules=None):
+        self.schedules = dict(SCHEDULES, **(schedules or {}))
+        self.polls = {}
+        self._lock = threading.Lock()
+
+    def _count(self, phase):
+        with self._lock:
+            self.polls[phase] = self.polls.get(phase, 0) + 1
+
+    def wait(self, phase, check, timeout=None):
+        """Call check() until it returns True, sleeping according to the phase's Schedule.
+
+        check() returns False to keep polling and raises WaiterError if the
+        resource can never get there. Throttling and not-yet-visible resources
+        are polled through; any other ClientError raises WaiterError, as the
+        boto3 waiters did. `timeout` overrides the Schedule's.
+        """
+
+        schedule = self.schedules.get(phase, FAST)
+        timeout = schedule.timeout if timeout is None else timeout
+        started = time.monotonic()
+        slept = 0
+        last_response = {}
+        for delay in schedule.delays():
+            self._count(phase)
+            try:
+                if check():
+                    return
+            except botocore.exceptions.ClientError as e:
+                last_response = e.response
+                code = e.response.get('Error', {}).get('Code')
+                if not is_throttled(e) and code not in NOT_FOUND_CODES:
+                    raise botocore.exceptions.WaiterError(phase, 'Unexpected error encountered', last_response)
+                logging.debug("{} poll got {}, retrying".format(phase, code))
+
+            if max(time.monotonic() - started, slept) + delay > timeout:
+                raise botocore.exceptions.WaiterError(phase, 'Timed out after {} polls'.format(self.polls[phase]), last_response)
+            time.sleep(delay)
+            slept += delay
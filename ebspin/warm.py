@@ -0,0 +1,87 @@
+import os
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+MIB = 1024 * 1024
+
+
+class Warmer:
+    """Read every block of a device once, so a volume restored from a snapshot pulls it all from S3 up front.
+
+    `workers` threads each read every `workers`-th chunk with os.pread, so
+    reads are spread across the device and many are in flight at once. A
+    `bucket` (a ratelimit.TokenBucket, one token per byte) caps the
+    bandwidth, and progress is logged every `interval` seconds. Chunks are
+    dropped from the page cache once read, so warming a large volume doesn't
+    push everything else out of memory.
+    """
+
+    path = None
+    bucket = None
+
+    def __init__(self, path, workers=16, chunk_size=MIB, bucket=None, interval=10):
+        self.path = path
+        self.workers = max(1, workers)
+        self.chunk_size = chunk_size
+        self.bucket = bucket
+        self.interval = interval
+        self.size = 0
+        self.done = 0
+        self._lock = threading.Lock()
+        self._started = None
+        self._logged = None
+
+    def _read(self, fd, worker):
+        read = 0
+        for offset in range(worker * self.chunk_size, self.size, self.workers * self.chunk_size):
+            length = min(self.chunk_size, self.size - offset)
+            if self.bucket:
+                self.bucket.acquire(length)
+            data = os.pread(fd, length, offset)
+            if hasattr(os, 'posix_fadvise'):
+                os.posix_fadvise(fd, offset, length, os.POSIX_FADV_DONTNEED)
+            read += len(data)
+            self._progress(len(data))
+            if len(data) < length:
+                break
+        return read
+
+    def _progress(self, length):
+        with self._lock:
+            self.done += length
+            now = time.monotonic()
+            if now - self._logged < self.interval:
+                return
+            self._logged = now
+            seconds = now - self._started
+            logging.info("Warmed %.0f of %.0f MiB (%.1f%%) at %.1f MiB/s" % (
+                self.done / MIB, self.size / MIB, 100.0 * self.done / self.size, self.done / MIB / seconds if seconds else 0))
+
+    def run(self):
+        """Read the whole device, returning bytes read, time taken and throughput"""
+
+        fd = os.open(self.path, os.O_RDONLY)
+        try:
+            self.size = os.lseek(fd, 0, os.SEEK_END)
+            self.done = 0
+            self._started = self._logged = time.monotonic()
+            logging.info("Warming %s, %.0f MiB with %s workers..." % (self.path, self.size / MIB, self.workers))
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                read = sum(executor.map(lambda worker: self._read(fd, worker), range(self.workers)))
+        finally:
+            os.close(fd)
+
+        seconds = time.monotonic() - self._started
+        report = {
+            'path': self.path,
+            'bytes': read,
+            'workers': self.workers,
+            'chunk_size': self.chunk_size,
+            'seconds': round(seconds, 3),
+            'mib_per_second': round(read / MIB / seconds, 1) if seconds else None,
+            'paced_seconds': round(self.bucket.waited, 3) if self.bucket else 0
+        }
+        logging.info("Warmed %s: %.0f MiB in %ss (%s MiB/s)" % (self.path, read / MIB, report['seconds'], report['mib_per_second']))
+        return report
@@ -1,6 +1,22 @@
 #!/usr/bin/env python3
 from ebspin import ec2
 from ebspin import base
+from ebspin import defaults
+from ebspin import deleter
+from ebspin import waiter
+from ebspin import configuration
+from ebspin import model
+from ebspin import client as ebspin_client
+from ebspin import timing
+from ebspin import simulator
+from ebspin import daemon
+from ebspin import fleet
+from ebspin import ratelimit
+from ebspin import warm
+from ebspin import device
+from ebspin import freeze
+from ebspin import ebs
+import requests
 import boto3
 from botocore.stub import Stubber, ANY
 import botocore.exceptions
@@ -8,6 +24,23 @@ import unittest
 from unittest.mock import Mock, patch
 import logging
 import datetime
+import sys
+import json
+import os
+import tempfile
+import threading
+import subprocess
+
+
+def attach_options(**kwargs):
+    """Options as the ebs-pin attach subcommand would parse them"""
+
+    return defaults.options(**dict({
+        'uuid': "01c6b711-a7d4-4bdf-bb2b-10b4b60594bc",
+        'concurrency': 1,
+        'cleanup_log': os.devnull
+    }, **kwargs))
+
 
 class get_latest_volume_id_available_test(unittest.TestCase):
 
@@ -87,6 +120,39 @@ class get_latest_snapshot_id_test(unittest.TestCase):
             ebspin_ec2.get_latest_snapshot_id("foobar")
 
 
+    def test_filters_on_uuid_tag_and_owner(self):
+        client = boto3.client('ec2')
+        stubber = Stubber(client)
+        stubber.add_response('describe_snapshots', {"Snapshots": []}, {
+            'Filters': [{'Name': 'tag:UUID', 'Values': ['foobar']}, {'Name': 'status', 'Values': ['completed']}],
+            'OwnerIds': ['self']
+        })
+        stubber.add_response('describe_volumes', {"Volumes": []}, {
+            'Filters': [{'Name': 'tag:UUID', 'Values': ['foobar']}, {'Name': 'status', 'Values': ['creating', 'available', 'in-use', 'error']}]
+        })
+        stubber.activate()
+        ebspin_ec2 = ec2.Ec2(client)
+        self.assertIsNone(ebspin_ec2.get_latest_snapshot_id("foobar"))
+        self.assertIsNone(ebspin_ec2.get_latest_volume_id_available("foobar"))
+        stubber.assert_no_pending_responses()
+
+    def test_can_get_latest_snapshot_across_pages(self):
+        client = boto3.client('ec2')
+        stubber = Stubber(client)
+        stubber.add_response('describe_snapshots', {"NextToken": "page2", "Snapshots": [
+            {"StartTime": datetime.datetime.now() + datetime.timedelta(days=1), "State": "completed", "SnapshotId": "new"},
+        ]})
+        stubber.add_response('describe_snapshots', {"Snapshots": [
+            {"StartTime": datetime.datetime.now() + datetime.timedelta(days=2), "State": "completed", "SnapshotId": "newest"},
+            {"StartTime": datetime.datetime.now(), "State": "completed", "SnapshotId": "old"},
+        ]}, {'Filters': ANY, 'OwnerIds': ['self'], 'NextToken': 'page2'})
+        stubber.activate()
+        ebspin_ec2 = ec2.Ec2(client)
+        response = ebspin_ec2.get_latest_snapshot_id("foobar")
+        self.assertEqual(response, "newest")
+        stubber.assert_no_pending_responses()
+
+
 class attach_volume_test(unittest.TestCase):
 
     @patch('time.sleep')
@@ -125,15 +191,57 @@ class attach_volume_test(unittest.TestCase):
         self.assertEqual(response, "foo")
 
 
+class waiter_test(unittest.TestCase):
+
+    def test_schedule_grows_to_max_delay(self):
+        schedule = waiter.Schedule(delay=1, max_delay=4, multiplier=2, jitter=0)
+        delays = schedule.delays()
+        self.assertEqual([next(delays) for x in range(5)], [1, 2, 4, 4, 4])
+
+    @patch('time.sleep')
+    def test_counts_polls_and_retries_throttling(self, mock_sleep):
+        client = boto3.client('ec2')
+        stubber = Stubber(client)
+        stubber.add_client_error('describe_volumes', service_error_code='RequestLimitExceeded')
+        stubber.add_response('describe_volumes', {"Volumes": [{"State": "creating"}]})
+        stubber.add_response('describe_volumes', {"Volumes": [{"State": "available"}]})
+        stubber.activate()
+        ebspin_ec2 = ec2.Ec2(client)
+        ebspin_ec2.wait_for_volume_available("foo")
+        self.assertEqual(ebspin_ec2.poller.polls, {"volume_available": 3})
+        self.assertEqual(mock_sleep.call_count, 2)
+        self.assertLess(mock_sleep.call_args_list[0][0][0], 15)
+
+    @patch('time.sleep')
+    def test_times_out(self, mock_sleep):
+        poller = waiter.Poller({"volume_available": waiter.Schedule(delay=1, max_delay=1, jitter=0, timeout=3)})
+        with self.assertRaises(botocore.exceptions.WaiterError):
+            poller.wait("volume_available", lambda: False)
+        self.assertEqual(poller.polls, {"volume_available": 4})
+
+    @patch('time.sleep')
+    def test_fails_on_snapshot_error(self, mock_sleep):
+        client = boto3.client('ec2')
+        stubber = Stubber(client)
+        stubber.add_response('describe_snapshots', {"Snapshots": [{"SnapshotId": "foo", "State": "error"}]})
+        stubber.activate()
+        ebspin_ec2 = ec2.Ec2(client)
+        with self.assertRaises(botocore.exceptions.WaiterError):
+            ebspin_ec2.wait_for_snapshot("foo")
+
+
 class create_snapshot_test(unittest.TestCase):
 
     @patch('time.sleep')
     def test_can_create_snapshot(self, mock_sleep):
         client = boto3.client('ec2')
         stubber = Stubber(client)
-        stubber.add_response('create_snapshot', {"SnapshotId": "foo"})
-        stubber.add_response('describe_volumes', {"Volumes": [{"Tags": [{"Key": "Name", "Value": "bar-/dev/xvda"}, {"Key": "UUID", "Value": "01c6b711-a7d4-4bdf-bb2b-10b4b60594bc"}]}]})
-        stubber.add_response('create_tags', {})
+        tags = [{"Key": "Name", "Value": "bar-/dev/xvda"}, {"Key": "UUID", "Value": "01c6b711-a7d4-4bdf-bb2b-10b4b60594bc"}]
+        stubber.add_response('describe_volumes', {"Volumes": [{"Tags": tags}]})
+        stubber.add_response('create_snapshot', {"SnapshotId": "foo"}, {
+            "VolumeId": "foo",
+            "TagSpecifications": [{"ResourceType": "snapshot", "Tags": tags + [{"Key": "extra", "Value": "tag"}]}]
+        })
         stubber.add_response('describe_snapshots', {"Snapshots": []})
         stubber.add_response('describe_snapshots', {"Snapshots": [{"SnapshotId": "foo", "State": "completed"}]})
         stubber.activate()
@@ -141,6 +249,86 @@ class create_snapshot_test(unittest.TestCase):
         response = ebspin_ec2.create_snapshot("foo", {"extra": "tag"})
         self.assertEqual(response, "foo")
 
+    def test_can_create_snapshot_without_waiting(self):
+        client = boto3.client('ec2')
+        stubber = Stubber(client)
+        tags = [{"Key": "UUID", "Value": "01c6b711-a7d4-4bdf-bb2b-10b4b60594bc"}]
+        stubber.add_response('create_snapshot', {"SnapshotId": "foo"}, {
+            "VolumeId": "foo",
+            "TagSpecifications": [{"ResourceType": "snapshot", "Tags": tags}]
+        })
+        stubber.activate()
+        ebspin_ec2 = ec2.Ec2(client)
+        self.assertEqual(ebspin_ec2.create_snapshot("foo", wait=False, tags=tags), "foo")
+        stubber.assert_no_pending_responses()
+
+    @patch('time.sleep')
+    def test_waits_for_snapshots_together(self, mock_sleep):
+        client = boto3.client('ec2')
+        stubber = Stubber(client)
+        stubber.add_response('describe_snapshots', {"Snapshots": [
+            {"SnapshotId": "a", "State": "completed"}, {"SnapshotId": "b", "State": "pending"}
+        ]}, {"SnapshotIds": ["a", "b"]})
+        stubber.add_response('describe_snapshots', {"Snapshots": [{"SnapshotId": "b", "State": "completed"}]}, {"SnapshotIds": ["b"]})
+        stubber.activate()
+        ebspin_ec2 = ec2.Ec2(client)
+        ebspin_ec2.wait_for_snapshots(["a", "b"])
+        stubber.assert_no_pending_responses()
+        self.assertEqual(ebspin_ec2.poller.polls, {"snapshot_completed": 2})
+
+
+class get_volume_id_test(unittest.TestCase):
+
+    def test_returns_list_of_volume_ids(self):
+        client = boto3.client('ec2')
+        stubber = Stubber(client)
+        stubber.add_response('describe_volumes', {"Volumes": [{"VolumeId": "a"}, {"VolumeId": "b"}]})
+        stubber.activate()
+        self.assertEqual(ec2.Ec2(client).get_volume_id("bar", "foobar"), ["a", "b"])
+
+    def test_returns_empty_list(self):
+        client = boto3.client('ec2')
+        stubber = Stubber(client)
+        stubber.add_response('describe_volumes', {"Volumes": []})
+        stubber.activate()
+        self.assertEqual(ec2.Ec2(client).get_volume_id("bar", "foobar"), [])
+
+
+class find_reusable_snapshot_test(unittest.TestCase):
+
+    def test_finds_in_flight_snapshot_of_detached_volume(self):
+        client = boto3.client('ec2')
+        stubber = Stubber(client)
+        stubber.add_response('describe_volumes', {"Volumes": [{"VolumeId": "foo", "State": "available", "Attachments": []}]})
+        stubber.add_response('describe_snapshots', {"Snapshots": [
+            {"SnapshotId": "done", "VolumeId": "foo", "State": "completed", "StartTime": datetime.datetime.now()},
+            {"SnapshotId": "in-flight", "VolumeId": "foo", "State": "pending", "StartTime": datetime.datetime.now() + datetime.timedelta(minutes=5)},
+        ]})
+        stubber.activate()
+        ebspin_ec2 = ec2.Ec2(client)
+        snapshot = ebspin_ec2.find_reusable_snapshot("foobar", "foo")
+        self.assertEqual(snapshot['SnapshotId'], "in-flight")
+
+    def test_ignores_snapshots_of_attached_volume(self):
+        client = boto3.client('ec2')
+        stubber = Stubber(client)
+        stubber.add_response('describe_volumes', {"Volumes": [{"VolumeId": "foo", "State": "in-use", "Attachments": [{"InstanceId": "bar"}]}]})
+        stubber.activate()
+        ebspin_ec2 = ec2.Ec2(client)
+        self.assertEqual(ebspin_ec2.find_reusable_snapshot("foobar", "foo"), None)
+        stubber.assert_no_pending_responses()
+
+    def test_marks_snapshots_of_detached_volumes(self):
+        client = boto3.client('ec2')
+        stubber = Stubber(client)
+        stubber.add_response('describe_volumes', {"Volumes": [{"VolumeId": "foo", "State": "available", "Tags": []}]})
+        stubber.add_response('create_snapshot', {"SnapshotId": "snap"}, {"VolumeId": "foo", "Description": ec2.MOVE_SNAPSHOT_DESCRIPTION % "foo"})
+        stubber.add_response('describe_snapshots', {"Snapshots": [{"SnapshotId": "snap", "State": "completed"}]})
+        stubber.activate()
+        ebspin_ec2 = ec2.Ec2(client)
+        self.assertEqual(ebspin_ec2.create_snapshot("foo", move=True), "snap")
+        stubber.assert_no_pending_responses()
+
 
 class create_volume_test(unittest.TestCase):
 
@@ -334,6 +522,27 @@ class clean_snapshots_test(unittest.TestCase):
         ebspin_ec2.clean_snapshots("01c6b711-a7d4-4bdf-bb2b-10b4b60594bc", extra_tags={"Team": "DevOps"})
         stubber.assert_no_pending_responses()
 
+    @patch('time.sleep')
+    def test_can_clean_snapshots_across_pages(self, mock_sleep):
+        client = boto3.client('ec2')
+        stubber = Stubber(client)
+        tags = [
+            {"Key": "UUID", "Value": "01c6b711-a7d4-4bdf-bb2b-10b4b60594bc"},
+            {"Key": "Name", "Value": "myvolume"},
+        ]
+        stubber.add_response('describe_snapshots', {"NextToken": "page2", "Snapshots": [
+            {"StartTime": datetime.datetime.now(), "State": "completed", "SnapshotId": "first", "Tags": tags},
+        ]})
+        stubber.add_response('delete_snapshot', [], {"SnapshotId": "first"})
+        stubber.add_response('describe_snapshots', {"Snapshots": [
+            {"StartTime": datetime.datetime.now(), "State": "completed", "SnapshotId": "second", "Tags": tags},
+        ]}, {'Filters': ANY, 'OwnerIds': ['self'], 'NextToken': 'page2'})
+        stubber.add_response('delete_snapshot', [], {"SnapshotId": "second"})
+        stubber.activate()
+        ebspin_ec2 = ec2.Ec2(client)
+        ebspin_ec2.clean_snapshots("01c6b711-a7d4-4bdf-bb2b-10b4b60594bc")
+        stubber.assert_no_pending_responses()
+
     def test_can_delete_snapshot(self):
                                        # tags on snapshot                   # tags known by CLI (ebs-pin)
         assert ec2.can_delete_snapshot(["Team"],                            ["Name", "UUID", "Team"])   == False    # not ebs-pin, can't delete
@@ -354,13 +563,394 @@ class clean_snapshots_test(unittest.TestCase):
         ebspin_ec2 = ec2.Ec2(client)
         ebspin_ec2.clean_snapshots("01c6b711-a7d4-4bdf-bb2b-10b4b60594bc")
 
+class fast_restore_test(unittest.TestCase):
+
+    metadata = {"region": "ap-southeast-2", "availabilityZone": "ap-southeast-2a", "instanceId": "i-bar"}
+    restore_params = {"AvailabilityZones": ["ap-southeast-2a"], "SourceSnapshotIds": ["snap-foo"]}
+
+    def restore(self, state):
+        return {"SnapshotId": "snap-foo", "AvailabilityZone": "ap-southeast-2a", "State": state}
+
+    def base(self, client, **kwargs):
+        ebspin_base = base.Base(attach_options(fast_restore=True, **kwargs), metadata=self.metadata)
+        ebspin_base.ec2 = ec2.Ec2(client, timer=ebspin_base.timer)
+        return ebspin_base
+
+    @patch('time.sleep')
+    def test_waits_for_optimizing(self, mock_sleep):
+        client = boto3.client('ec2')
+        stubber = Stubber(client)
+        stubber.add_response('enable_fast_snapshot_restores', {"Successful": [self.restore("enabling")], "Unsuccessful": []}, self.restore_params)
+        stubber.add_response('describe_fast_snapshot_restores', {"FastSnapshotRestores": [self.restore("enabling")]})
+        stubber.add_response('describe_fast_snapshot_restores', {"FastSnapshotRestores": [self.restore("optimizing")]})
+        stubber.activate()
+        ebspin_base = self.base(client)
+        self.assertEqual(ebspin_base.fast_restore("snap-foo"), "optimizing")
+        self.assertEqual(ebspin_base.ec2.fast_restores, {("snap-foo", "ap-southeast-2a"): "optimizing"})
+        self.assertEqual(ebspin_base.ec2.poller.polls["fast_restore_enabled"], 2)
+        stubber.assert_no_pending_responses()
+
+    @patch('time.sleep')
+    def test_falls_back_when_enable_fails(self, mock_sleep):
+        client = boto3.client('ec2')
+        stubber = Stubber(client)
+        stubber.add_response('enable_fast_snapshot_restores', {"Successful": [], "Unsuccessful": [{"SnapshotId": "snap-foo", "FastSnapshotRestoreStateErrors": [
+            {"AvailabilityZone": "ap-southeast-2a", "Error": {"Code": "FastSnapshotRestoreLimitExceeded", "Message": "Limit exceeded"}}
+        ]}]})
+        stubber.add_client_error('disable_fast_snapshot_restores', 'IncorrectState', expected_params=self.restore_params)
+        stubber.activate()
+        ebspin_base = self.base(client)
+        self.assertIsNone(ebspin_base.fast_restore("snap-foo"))
+        self.assertEqual(ebspin_base.ec2.fast_restores, {})
+        stubber.assert_no_pending_responses()
+
+    def test_falls_back_and_disables_when_over_budget(self):
+        sim = simulator.Simulator(restore_delay=300)
+        snapshot_id = sim.add_snapshot()
+        ebspin_base = self.base(sim, fast_restore_wait=60)
+        with patch('time.sleep', sim.sleep):
+            self.assertIsNone(ebspin_base.fast_restore(snapshot_id))
+        self.assertLess(sim.now, 120)
+        self.assertEqual(sim.fast_restores[(snapshot_id, "ap-southeast-2a")]["State"], "disabling")
+        self.assertEqual(ebspin_base.ec2.fast_restores, {})
+
+    @patch('time.sleep')
+    def test_disables_before_deleting_snapshots(self, mock_sleep):
+        client = boto3.client('ec2')
+        stubber = Stubber(client)
+        tags = [{"Key": "UUID", "Value": "foo"}, {"Key": "Name", "Value": "myvolume"}]
+        stubber.add_response('describe_fast_snapshot_restores', {"FastSnapshotRestores": [
+            self.restore("enabled"),
+            dict(self.restore("optimizing"), AvailabilityZone="ap-southeast-2b"),
+        ]}, {"Filters": [{"Name": "state", "Values": ["enabling", "optimizing", "enabled"]}]})
+        stubber.add_response('describe_snapshots', {"Snapshots": [
+            {"StartTime": datetime.datetime.now(), "State": "completed", "SnapshotId": "snap-foo", "Tags": tags},
+            {"StartTime": datetime.datetime.now(), "State": "completed", "SnapshotId": "snap-bar", "Tags": tags},
+        ]})
+        stubber.add_response('disable_fast_snapshot_restores', {"Successful": [self.restore("disabling")], "Unsuccessful": []},
+                             {"AvailabilityZones": ["ap-southeast-2a", "ap-southeast-2b"], "SourceSnapshotIds": ["snap-foo"]})
+        stubber.add_response('delete_snapshot', {}, {"SnapshotId": "snap-foo"})
+        stubber.add_response('delete_snapshot', {}, {"SnapshotId": "snap-bar"})
+        stubber.activate()
+        summary = ec2.Ec2(client).clean_snapshots("foo", fast_restore=True)
+        self.assertEqual(summary.deleted, ["snap-foo", "snap-bar"])
+        stubber.assert_no_pending_responses()
+
+    def test_attach_from_other_az(self):
+        sim = simulator.Simulator(restore_delay=30)
+        sim.add_instance("i-bar", "ap-southeast-2a", name="bar")
+        tags = [{"Key": "Name", "Value": "bar-/dev/xvdf"}, {"Key": "UUID", "Value": "foo"}]
+        sim.add_volume(availability_zone="ap-southeast-2b", tags=tags)
+        ebspin_base = self.base(sim, uuid="foo")
+        with patch('time.sleep', sim.sleep):
+            volume_id = ebspin_base.attach()
+        self.assertEqual(sim.volumes[volume_id]["AvailabilityZone"], "ap-southeast-2a")
+        self.assertEqual(sim.calls["EnableFastSnapshotRestores"], 1)
+        self.assertEqual(sim.calls["DisableFastSnapshotRestores"], 1)
+        self.assertEqual(sim.snapshots, {})
+        self.assertEqual(sim.fast_restores, {})
+
+    def warmed(self, state):
+        """Whether attach from another AZ warms the volume when fast snapshot restore is left in `state`"""
+
+        sim = simulator.Simulator(restore_delay=30)
+        sim.add_instance("i-bar", "ap-southeast-2a", name="bar")
+        tags = [{"Key": "Name", "Value": "bar-/dev/xvdf"}, {"Key": "UUID", "Value": "foo"}]
+        sim.add_volume(availability_zone="ap-southeast-2b", tags=tags)
+        ebspin_base = self.base(sim, uuid="foo", warm=True)
+        with patch('time.sleep', sim.sleep), patch.object(ebspin_base, 'fast_restore', return_value=state), \
+                patch.object(ebspin_base, 'warm') as warm_volume, patch.object(ebspin_base, 'wait_device', return_value="/dev/nvme1n1"):
+            ebspin_base.attach()
+        return warm_volume.called
+
+    def test_warms_while_optimizing(self):
+        self.assertTrue(self.warmed("optimizing"))
+        self.assertTrue(self.warmed(None))
+        self.assertFalse(self.warmed("enabled"))
+
+
+class inventory_test(unittest.TestCase):
+
+    @patch('time.sleep')
+    def test_describes_volumes_once_per_run(self, mock_sleep):
+        client = boto3.client('ec2')
+        stubber = Stubber(client)
+        tags = [{"Key": "Name", "Value": "bar-/dev/xvdf"}, {"Key": "UUID", "Value": "01c6b711-a7d4-4bdf-bb2b-10b4b60594bc"}]
+        stubber.add_response('describe_volumes', {"Volumes": [
+            {"VolumeId": "old", "State": "available", "AvailabilityZone": "ap-southeast-2b", "CreateTime": datetime.datetime.now(), "Tags": tags}
+        ]})
+        stubber.add_response('create_snapshot', {"SnapshotId": "snap", "VolumeId": "old", "State": "pending"})
+        stubber.add_response('describe_snapshots', {"Snapshots": [{"SnapshotId": "snap", "State": "completed"}]})
+        stubber.add_response('delete_volume', {}, {"VolumeId": "old"})
+        stubber.activate()
+        ebspin_ec2 = ec2.Ec2(client)
+        uuid = "01c6b711-a7d4-4bdf-bb2b-10b4b60594bc"
+        self.assertEqual(ebspin_ec2.get_latest_volume_id_available(uuid), "old")
+        self.assertEqual(ebspin_ec2.get_volume_region("old"), "ap-southeast-2b")
+        self.assertEqual(ebspin_ec2.create_snapshot("old"), "snap")
+        summary = ebspin_ec2.clean_old_volumes(uuid, "new")
+        stubber.assert_no_pending_responses()
+        self.assertEqual(summary.deleted, ["old"])
+        self.assertEqual(ebspin_ec2.calls_saved(), 3)
+        self.assertEqual(ebspin_ec2.inventory(uuid).volumes(), [])
+
+    @patch('time.sleep')
+    def test_cleans_snapshots_created_this_run_from_cache(self, mock_sleep):
+        client = boto3.client('ec2')
+        stubber = Stubber(client)
+        tags = [{"Key": "Name", "Value": "bar-/dev/xvdf"}, {"Key": "UUID", "Value": "01c6b711-a7d4-4bdf-bb2b-10b4b60594bc"}]
+        stubber.add_response('describe_snapshots', {"Snapshots": [
+            {"SnapshotId": "existing", "State": "completed", "StartTime": datetime.datetime.now(), "Tags": tags}
+        ]})
+        stubber.add_response('delete_snapshot', {}, {"SnapshotId": "existing"})
+        stubber.activate()
+        ebspin_ec2 = ec2.Ec2(client)
+        uuid = "01c6b711-a7d4-4bdf-bb2b-10b4b60594bc"
+        list(ebspin_ec2.inventory(uuid).snapshots())
+        self.assertEqual(ebspin_ec2.get_latest_snapshot_id(uuid), "existing")
+        ebspin_ec2.clean_snapshots(uuid)
+        stubber.assert_no_pending_responses()
+        self.assertEqual(list(ebspin_ec2.inventory(uuid).snapshots()), [])
+
+
+class deleter_test(unittest.TestCase):
+
+    @patch('time.sleep')
+    def test_backs_off_per_call_when_throttled(self, mock_sleep):
+        client = boto3.client('ec2')
+        stubber = Stubber(client)
+        stubber.add_response('delete_snapshot', {}, {"SnapshotId": "a"})
+        stubber.add_client_error('delete_snapshot', service_error_code='RequestLimitExceeded', expected_params={"SnapshotId": "b"})
+        stubber.add_response('delete_snapshot', {}, {"SnapshotId": "b"})
+        stubber.activate()
+        summary = deleter.Deleter().run(["a", "b"], lambda x: client.delete_snapshot(SnapshotId=x))
+        stubber.assert_no_pending_responses()
+        self.assertEqual(summary.deleted, ["a", "b"])
+        self.assertEqual(mock_sleep.call_count, 1)
+
+    @patch('time.sleep')
+    def test_records_failures_without_retrying(self, mock_sleep):
+        client = boto3.client('ec2')
+        stubber = Stubber(client)
+        stubber.add_client_error('delete_volume', service_error_code='VolumeInUse', expected_params={"VolumeId": "a"})
+        stubber.add_response('delete_volume', {}, {"VolumeId": "b"})
+        stubber.activate()
+        summary = deleter.Deleter().run(["a", "b"], lambda x: client.delete_volume(VolumeId=x))
+        stubber.assert_no_pending_responses()
+        self.assertEqual(summary.as_dict(), {"deleted": ["b"], "skipped": {}, "failed": {"a": "VolumeInUse"}})
+        mock_sleep.assert_not_called()
+
+    def test_runs_concurrently(self):
+        client = Mock()
+        ids = ["snap-%d" % x for x in range(50)]
+        summary = deleter.Deleter(concurrency=8).run(iter(ids), lambda x: client.delete_snapshot(SnapshotId=x))
+        self.assertEqual(sorted(summary.deleted), sorted(ids))
+        self.assertEqual(client.delete_snapshot.call_count, 50)
+
+
+class configuration_test(unittest.TestCase):
+
+    document = {"region": "ap-southeast-2", "availabilityZone": "ap-southeast-2a", "instanceId": "i-123"}
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache_dir = os.path.join(self.directory.name, "ebs-pin")
+        self.boot_id = patch('ebspin.configuration.boot_id', return_value="boot-1")
+        self.boot_id.start()
+
+    def tearDown(self):
+        self.boot_id.stop()
+        self.directory.cleanup()
+
+    def imds(self, method, url, headers, timeout):
+        response = Mock()
+        response.status_code = 200
+        if url.endswith("/latest/api/token"):
+            self.assertEqual(method, "PUT")
+            response.text = "token-%d" % len(self.calls)
+        else:
+            self.assertEqual(headers, {"X-aws-ec2-metadata-token": "token-0"})
+            response.json.return_value = self.document
+        self.calls.append(url)
+        return response
+
+    def test_caches_token_and_identity_document(self):
+        self.calls = []
+        with patch('requests.request', side_effect=self.imds):
+            self.assertEqual(configuration.Configuration(self.cache_dir).metadata(), self.document)
+            self.assertEqual(len(self.calls), 2)
+            self.assertEqual(configuration.Configuration(self.cache_dir).metadata(), self.document)
+            self.assertEqual(len(self.calls), 2)
+        self.assertEqual(os.stat(os.path.join(self.cache_dir, "token.json")).st_mode & 0o777, 0o600)
+        self.assertEqual(os.stat(self.cache_dir).st_mode & 0o777, 0o700)
+
+    def test_refetches_after_reboot(self):
+        self.calls = []
+        with patch('requests.request', side_effect=self.imds):
+            configuration.Configuration(self.cache_dir).metadata()
+            with patch('ebspin.configuration.boot_id', return_value="boot-2"):
+                self.calls = []
+                configuration.Configuration(self.cache_dir).metadata()
+        self.assertEqual(len(self.calls), 2)
+
+    @patch('time.sleep')
+    def test_retries_failed_requests(self, mock_sleep):
+        self.calls = []
+        responses = [requests.exceptions.ConnectTimeout()]
+
+        def flaky(method, *args, **kwargs):
+            if method == "GET" and responses:
+                raise responses.pop()
+            return self.imds(method, *args, **kwargs)
+
+        with patch('requests.request', side_effect=flaky):
+            self.assertEqual(configuration.Configuration(False).metadata(), self.document)
+        self.assertEqual(mock_sleep.call_count, 1)
+        self.assertFalse(os.path.exists(self.cache_dir))
+
+
+    @patch('time.sleep')
+    def test_gives_up_on_token_once(self, mock_sleep):
+        puts = []
+
+        def imds(method, url, headers, timeout):
+            if method == "PUT":
+                puts.append(url)
+                raise requests.exceptions.ReadTimeout()
+            self.assertEqual(headers, {})
+            response = Mock()
+            response.status_code = 200
+            response.text = "Name" if url.endswith("tags/instance") else "bar"
+            response.json.return_value = self.document
+            return response
+
+        c = configuration.Configuration(False)
+        with patch('requests.request', side_effect=imds), self.assertNoLogs("backoff"):
+            self.assertEqual(c.metadata(), self.document)
+            self.assertEqual(c.instance_tags(["Name"]), {"Name": "bar"})
+        self.assertEqual(len(puts), 1)
+        mock_sleep.assert_not_called()
+
+    def tags_imds(self, method, url, headers, timeout):
+        response = Mock()
+        response.status_code = 200
+        response.text = {"tags/instance": "Name\nTeam", "tags/instance/Name": "bar", "tags/instance/Team": "ops"}.get(url.split("meta-data/")[-1], "token")
+        return response
+
+    def test_reads_instance_tags(self):
+        with patch('requests.request', side_effect=self.tags_imds):
+            self.assertEqual(configuration.Configuration(False).instance_tags(), {"Name": "bar", "Team": "ops"})
+
+    def test_reads_only_wanted_tags(self):
+        c = configuration.Configuration(False)
+        with patch('requests.request', side_effect=self.tags_imds) as request:
+            self.assertEqual(c.instance_tags(["Name"]), {"Name": "bar"})
+            self.assertEqual(c.instance_tags(["Name"]), {"Name": "bar"})
+            self.assertEqual(c.instance_tags(["Owner"]), {})
+        self.assertEqual([x[0][1].split("meta-data/")[-1] for x in request.call_args_list[1:]], ["tags/instance", "tags/instance/Name"])
+
+    def test_instance_tags_disabled(self):
+        def imds(method, url, headers, timeout):
+            response = requests.models.Response()
+            response.status_code = 200 if url.endswith("/api/token") else 404
+            response._content = b"token"
+            return response
+
+        c = configuration.Configuration(False)
+        with patch('requests.request', side_effect=imds) as request:
+            self.assertIsNone(c.instance_tags())
+            self.assertIsNone(c.instance_tags())
+        self.assertEqual(request.call_count, 2)
+
+
+class instance_name_test(unittest.TestCase):
+
+    metadata = {"region": "ap-southeast-2", "availabilityZone": "ap-southeast-2a", "instanceId": "i-bar"}
+
+    def test_uses_imds_tags_without_describe_tags(self):
+        c = Mock()
+        c.instance_tags.return_value = {"Name": "bar"}
+        ebspin_base = base.Base(attach_options(), self.metadata, configuration=c)
+        stubber = Stubber(ebspin_base.ec2.client)
+        stubber.activate()
+        self.assertEqual(ebspin_base.instance_name(), "bar")
+        c.instance_tags.assert_called_once_with(["Name"])
+        stubber.assert_no_pending_responses()
+
+    def test_tag_names_volumes_from_their_attachments(self):
+        c = Mock()
+        c.instance_tags.return_value = {"Name": "bar"}
+        options = attach_options()
+        ebspin_base = base.Base(options, self.metadata, configuration=c)
+        stubber = Stubber(ebspin_base.ec2.client)
+        stubber.add_response('describe_volumes', {"Volumes": [{"VolumeId": "vol-1", "Attachments": [{"InstanceId": "i-bar", "Device": "/dev/xvdg"}]}]})
+        stubber.add_response('create_tags', {}, {"Resources": ["vol-1"], "Tags": [
+            {"Key": "Name", "Value": "bar-/dev/xvdg"}, {"Key": "UUID", "Value": options.uuid}]})
+        stubber.activate()
+        ebspin_base.tag()
+        stubber.assert_no_pending_responses()
+
+    def test_falls_back_to_describe_tags_once(self):
+        c = Mock()
+        c.instance_tags.return_value = None
+        ebspin_base = base.Base(attach_options(), self.metadata, configuration=c)
+        stubber = Stubber(ebspin_base.ec2.client)
+        stubber.add_response('describe_tags', {"Tags": [{"Key": "Name", "Value": "bar", "ResourceId": "i-bar", "ResourceType": "instance"}]})
+        stubber.activate()
+        self.assertEqual(ebspin_base.instance_name(), "bar")
+        self.assertEqual(ebspin_base.instance_name(), "bar")
+        stubber.assert_no_pending_responses()
+
+class model_test(unittest.TestCase):
+
+    def test_base_uses_trimmed_model(self):
+        with tempfile.TemporaryDirectory() as directory:
+            data_path = model.trimmed_data_path(directory)
+            self.assertEqual(model.trimmed_data_path(directory), data_path)
+            ebspin_base = base.Base(attach_options(), {"region": "ap-southeast-2"}, data_path)
+            client = ebspin_base.ec2.client
+            self.assertEqual(sorted(client.meta.service_model.operation_names), model.OPERATIONS)
+            stubber = Stubber(client)
+            stubber.add_response('describe_volumes', {"Volumes": [{"VolumeId": "foo", "CreateTime": datetime.datetime.now(), "State": "available"}]})
+            stubber.activate()
+            self.assertEqual(ebspin_base.ec2.get_latest_volume_id_available("foobar"), "foo")
+
+
+class client_test(unittest.TestCase):
+
+    def test_client_is_tuned_for_concurrency(self):
+        session = ebspin_client.make_session("ap-southeast-2")
+        client = ebspin_client.make_client(session, concurrency=32, retry_mode="standard", connect_timeout=2, read_timeout=7)
+        self.assertEqual(client.meta.config.max_pool_connections, 34)
+        self.assertEqual(client.meta.config.retries["mode"], "standard")
+        self.assertEqual(client.meta.config.connect_timeout, 2)
+        self.assertEqual(client.meta.config.read_timeout, 7)
+
+    def test_counts_calls_retries_and_throttles(self):
+        stats = ebspin_client.ClientStats()
+        client = ebspin_client.make_client(ebspin_client.make_session("ap-southeast-2"), stats=stats)
+        stubber = Stubber(client)
+        stubber.add_response('describe_volumes', {"Volumes": [], "ResponseMetadata": {"RetryAttempts": 2}})
+        stubber.add_response('describe_snapshots', {"Snapshots": []})
+        stubber.activate()
+        client.describe_volumes()
+        client.describe_snapshots()
+        stats._count_throttle(response=(None, {"Error": {"Code": "RequestLimitExceeded"}}), attempts=1)
+        stats._count_throttle(response=(None, {"Volumes": []}), attempts=1)
+        self.assertEqual(stats.as_dict(), {"calls": 2, "retries": 2, "throttles": 1})
+
+    def test_base_shares_one_client_factory(self):
+        ebspin_base = base.Base(attach_options(concurrency=16), metadata={"region": "ap-southeast-2"})
+        self.assertEqual(ebspin_base.ec2.client.meta.config.max_pool_connections, 18)
+        self.assertEqual(ebspin_base.ec2.client.meta.config.retries["mode"], "adaptive")
+
+
 class base_attach_test(unittest.TestCase):
 
     @patch('ebspin.ec2.Ec2.get_instance_name', return_value="bar")
     @patch('ebspin.ec2.Ec2.get_latest_volume_id_available', return_value=[])
     @patch('ebspin.ec2.Ec2.get_latest_snapshot_id', return_value=[])
     @patch('ebspin.ec2.Ec2.create_volume', return_value="foobar")
-    @patch('ebspin.ec2.Ec2.tag_volume', return_value=[])
     @patch('ebspin.ec2.Ec2.attach_volume', return_value="barfoo")
     @patch('ebspin.ec2.Ec2.clean_old_volumes')
     @patch('ebspin.ec2.Ec2.clean_snapshots')
@@ -368,12 +958,7 @@ class base_attach_test(unittest.TestCase):
         client = boto3.client('ec2')
         stubber = Stubber(client)
         stubber.activate()  # this is just to ensure that no real boto3 calls are made
-        options = Mock()
-        options.device = "/dev/xvdf"
-        options.uuid = "01c6b711-a7d4-4bdf-bb2b-10b4b60594bc"
-        options.size = 10
-        options.type = "gp2"
-        options.tags = {}
+        options = attach_options()
         ebspin_base = base.Base(options, metadata={"region": "ap-southeast-2", "availabilityZone": "ap-southeast-2a", "instanceId": "bar"})
         ebspin_ec2 = ec2.Ec2(client)
         ebspin_base.ec2 = ebspin_ec2
@@ -391,12 +976,7 @@ class base_attach_test(unittest.TestCase):
         client = boto3.client('ec2')
         stubber = Stubber(client)
         stubber.activate()  # this is just to ensure that no real boto3 calls are made
-        options = Mock()
-        options.device = "/dev/xvdf"
-        options.uuid = "01c6b711-a7d4-4bdf-bb2b-10b4b60594bc"
-        options.size = 10
-        options.type = "gp2"
-        options.tags = {}
+        options = attach_options()
         ebspin_base = base.Base(options, metadata={"region": "ap-southeast-2", "availabilityZone": "ap-southeast-2a", "instanceId": "bar"})
         ebspin_ec2 = ec2.Ec2(client)
         ebspin_base.ec2 = ebspin_ec2
@@ -409,7 +989,6 @@ class base_attach_test(unittest.TestCase):
     @patch('ebspin.ec2.Ec2.get_volume_region', return_value="ap-southeast-2b")
     @patch('ebspin.ec2.Ec2.create_snapshot', return_value="my_snapshot")
     @patch('ebspin.ec2.Ec2.create_volume', return_value="my_volume")
-    @patch('ebspin.ec2.Ec2.tag_volume', return_value=[])
     @patch('ebspin.ec2.Ec2.attach_volume', return_value="my_volume")
     @patch('ebspin.ec2.Ec2.clean_old_volumes')
     @patch('ebspin.ec2.Ec2.clean_snapshots')
@@ -417,12 +996,7 @@ class base_attach_test(unittest.TestCase):
         client = boto3.client('ec2')
         stubber = Stubber(client)
         stubber.activate()  # this is just to ensure that no real boto3 calls are made
-        options = Mock()
-        options.device = "/dev/xvdf"
-        options.uuid = "01c6b711-a7d4-4bdf-bb2b-10b4b60594bc"
-        options.size = 10
-        options.type = "gp2"
-        options.tags = {}
+        options = attach_options()
         ebspin_base = base.Base(options, metadata={"region": "ap-southeast-2", "availabilityZone": "ap-southeast-2a", "instanceId": "bar"})
         ebspin_ec2 = ec2.Ec2(client)
         ebspin_base.ec2 = ebspin_ec2
@@ -434,7 +1008,6 @@ class base_attach_test(unittest.TestCase):
     @patch('ebspin.ec2.Ec2.get_latest_volume_id_available', return_value=[])
     @patch('ebspin.ec2.Ec2.get_latest_snapshot_id', return_value="my_snapshot")
     @patch('ebspin.ec2.Ec2.create_volume', return_value="my_volume")
-    @patch('ebspin.ec2.Ec2.tag_volume', return_value=[])
     @patch('ebspin.ec2.Ec2.attach_volume', return_value="my_volume")
     @patch('ebspin.ec2.Ec2.clean_old_volumes')
     @patch('ebspin.ec2.Ec2.clean_snapshots')
@@ -442,12 +1015,7 @@ class base_attach_test(unittest.TestCase):
         client = boto3.client('ec2')
         stubber = Stubber(client)
         stubber.activate()  # this is just to ensure that no real boto3 calls are made
-        options = Mock()
-        options.device = "/dev/xvdf"
-        options.uuid = "01c6b711-a7d4-4bdf-bb2b-10b4b60594bc"
-        options.size = 10
-        options.type = "gp2"
-        options.tags = {}
+        options = attach_options()
         ebspin_base = base.Base(options, metadata={"region": "ap-southeast-2", "availabilityZone": "ap-southeast-2a", "instanceId": "bar"})
         ebspin_ec2 = ec2.Ec2(client)
         ebspin_base.ec2 = ebspin_ec2
@@ -455,5 +1023,803 @@ class base_attach_test(unittest.TestCase):
         for arg in args:
             arg.assert_called()
 
+    @patch('ebspin.ec2.Ec2.get_instance_name', return_value="bar")
+    @patch('ebspin.ec2.Ec2.get_latest_volume_id_available', return_value="foo")
+    @patch('ebspin.ec2.Ec2.get_volume_region', return_value="ap-southeast-2b")
+    @patch('ebspin.ec2.Ec2.find_reusable_snapshot', return_value={"SnapshotId": "my_snapshot", "State": "completed"})
+    @patch('ebspin.ec2.Ec2.create_volume', return_value="my_volume")
+    @patch('ebspin.ec2.Ec2.attach_volume', return_value="my_volume")
+    @patch('ebspin.ec2.Ec2.clean_old_volumes')
+    @patch('ebspin.ec2.Ec2.clean_snapshots')
+    def test_can_reuse_snapshot_in_other_az(self, *args):
+        client = boto3.client('ec2')
+        stubber = Stubber(client)
+        stubber.activate()  # this is just to ensure that no real boto3 calls are made
+        options = attach_options(reuse_snapshot=True)
+        ebspin_base = base.Base(options, metadata={"region": "ap-southeast-2", "availabilityZone": "ap-southeast-2a", "instanceId": "bar"})
+        ebspin_ec2 = ec2.Ec2(client)
+        ebspin_base.ec2 = ebspin_ec2
+        with patch('ebspin.ec2.Ec2.create_snapshot') as create_snapshot:
+            ebspin_base.attach()
+            create_snapshot.assert_not_called()
+        for arg in args:
+            arg.assert_called()
+        args[3].assert_called_with(10, "gp2", "ap-southeast-2a", "my_snapshot", [
+            {"Key": "Name", "Value": "bar-/dev/xvdf"}, {"Key": "UUID", "Value": options.uuid}
+        ])
+
+
+    @patch('ebspin.ec2.Ec2.get_instance_name', return_value="bar")
+    @patch('ebspin.ec2.Ec2.get_latest_volume_id_available', return_value="foo")
+    @patch('ebspin.ec2.Ec2.get_volume_region', return_value="ap-southeast-2a")
+    @patch('ebspin.ec2.Ec2.attach_volume', return_value="foo")
+    @patch('subprocess.Popen')
+    def test_can_clean_up_in_background(self, popen, *args):
+        client = boto3.client('ec2')
+        stubber = Stubber(client)
+        stubber.activate()  # this is just to ensure that no real boto3 calls are made
+        options = attach_options(background_cleanup=True, tags={"Team": "DevOps"}, cache_dir="/tmp/ebs-pin", fast_start=True)
+        ebspin_base = base.Base(options, metadata={"region": "ap-southeast-2", "availabilityZone": "ap-southeast-2a", "instanceId": "bar"})
+        ebspin_base.ec2 = ec2.Ec2(client)
+        with patch('ebspin.ec2.Ec2.clean_old_volumes') as clean_old_volumes, patch('ebspin.ec2.Ec2.clean_snapshots') as clean_snapshots:
+            ebspin_base.attach()
+            clean_old_volumes.assert_not_called()
+            clean_snapshots.assert_not_called()
+        command = popen.call_args[0][0]
+        self.assertEqual(command[2:], [
+            '--cache-dir', '/tmp/ebs-pin', '--fast-start', '--retry-mode', 'adaptive', '--connect-timeout', '5', '--read-timeout', '30',
+            'gc', '--uuid', options.uuid, '--volume-id', 'foo', '--concurrency', '1', '--tags', 'Team=DevOps'])
+        self.assertTrue(popen.call_args[1]['start_new_session'])
+
+    @patch('subprocess.Popen')
+    def test_background_cleanup_keeps_no_cache(self, popen):
+        options = attach_options(no_cache=True, cache_dir="/tmp/ebs-pin", retry_mode="standard")
+        ebspin_base = base.Base(options, metadata={"region": "ap-southeast-2", "availabilityZone": "ap-southeast-2a", "instanceId": "bar"})
+        ebspin_base.spawn_gc("foo")
+        command = popen.call_args[0][0]
+        self.assertEqual(command[2:command.index('gc')], ['--no-cache', '--retry-mode', 'standard', '--connect-timeout', '5', '--read-timeout', '30'])
+
+    @patch('subprocess.Popen')
+    def test_background_cleanup_without_log(self, popen):
+        options = attach_options(cleanup_log="/nonexistent/ebs-pin-gc.log")
+        ebspin_base = base.Base(options, metadata={"region": "ap-southeast-2", "availabilityZone": "ap-southeast-2a", "instanceId": "bar"})
+        with self.assertLogs(level="WARNING"):
+            ebspin_base.spawn_gc("foo")
+        self.assertEqual(popen.call_args[1]['stdout'], subprocess.DEVNULL)
+
+
+class base_attach_many_test(unittest.TestCase):
+
+    def test_can_parse_volume_specs(self):
+        self.assertEqual(base.parse_volume_spec("db-data:/dev/xvdf"), {"uuid": "db-data", "device": "/dev/xvdf"})
+        self.assertEqual(base.parse_volume_spec("db-log:/dev/xvdg:100:io1"), {"uuid": "db-log", "device": "/dev/xvdg", "size": 100, "type": "io1"})
+        with self.assertRaises(ValueError):
+            base.parse_volume_spec("db-data")
+        with tempfile.NamedTemporaryFile('w', suffix='.volumes') as f:
+            f.write("# database volumes\ndb-data:/dev/xvdf:50\n\ndb-log:/dev/xvdg  # logs\n")
+            f.flush()
+            self.assertEqual(base.read_volume_specs(f.name), [
+                {"uuid": "db-data", "device": "/dev/xvdf", "size": 50},
+                {"uuid": "db-log", "device": "/dev/xvdg"},
+            ])
+
+    def test_attaches_each_volume_and_reports_failures(self):
+        ebspin_base = base.Base(attach_options(), metadata={"region": "ap-southeast-2", "availabilityZone": "ap-southeast-2a", "instanceId": "bar"})
+        attached = []
+
+        def attach(options):
+            if options.uuid == "broken":
+                sys.exit(1)
+            attached.append((options.uuid, options.device, options.size, options.type))
+            return "vol-" + options.uuid
+
+        with patch.object(ebspin_base, 'attach', side_effect=attach):
+            results = ebspin_base.attach_many([
+                {"uuid": "data", "device": "/dev/xvdf", "size": 50},
+                {"uuid": "broken", "device": "/dev/xvdg"},
+                {"uuid": "log", "device": "/dev/xvdh", "type": "io1"},
+            ])
+        self.assertEqual(sorted(attached), [("data", "/dev/xvdf", 50, "gp2"), ("log", "/dev/xvdh", 10, "io1")])
+        self.assertEqual([(x['uuid'], x['volume_id'], x['status']) for x in results], [
+            ("data", "vol-data", "attached"), ("broken", None, "failed"), ("log", "vol-log", "attached")
+        ])
+
+
+class base_snapshot_test(unittest.TestCase):
+
+    @patch('ebspin.ec2.Ec2.get_volumes', return_value=[{"VolumeId": "a", "Tags": []}, {"VolumeId": "b", "Tags": []}])
+    @patch('ebspin.ec2.Ec2.create_snapshot', side_effect=lambda volume_id, extra_tags, wait, tags: "snap-" + volume_id)
+    @patch('ebspin.ec2.Ec2.wait_for_snapshots')
+    def test_starts_all_snapshots_then_waits_together(self, wait_for_snapshots, create_snapshot, *args):
+        ebspin_base = base.Base(attach_options(concurrency=2), metadata={"region": "ap-southeast-2", "availabilityZone": "ap-southeast-2a", "instanceId": "bar"})
+        self.assertEqual(ebspin_base.snapshot(), {"a": "snap-a", "b": "snap-b"})
+        for call in create_snapshot.call_args_list:
+            self.assertEqual(call[1], {"wait": False, "tags": []})
+        wait_for_snapshots.assert_called_once_with(["snap-a", "snap-b"])
+
+    @patch('ebspin.ec2.Ec2.get_volumes', return_value=[{"VolumeId": "a", "Tags": []}, {"VolumeId": "b", "Tags": []}])
+    @patch('ebspin.ec2.Ec2.create_snapshot', side_effect=lambda volume_id, extra_tags, wait, tags: "snap-" + volume_id)
+    @patch('ebspin.ec2.Ec2.wait_for_snapshots')
+    def test_no_wait(self, wait_for_snapshots, *args):
+        ebspin_base = base.Base(attach_options(no_wait=True), metadata={"region": "ap-southeast-2", "availabilityZone": "ap-southeast-2a", "instanceId": "bar"})
+        ebspin_base.snapshot()
+        wait_for_snapshots.assert_not_called()
+
+
+class base_gc_test(unittest.TestCase):
+
+    @patch('ebspin.ec2.Ec2.get_latest_volume_id_available', return_value="foo")
+    @patch('ebspin.ec2.Ec2.clean_old_volumes', return_value=deleter.DeletionSummary())
+    @patch('ebspin.ec2.Ec2.clean_snapshots', return_value=deleter.DeletionSummary())
+    def test_gc_keeps_latest_volume_and_writes_status(self, clean_snapshots, clean_old_volumes, *args):
+        with tempfile.TemporaryDirectory() as directory:
+            options = attach_options(status_file=os.path.join(directory, "status.json"))
+            ebspin_base = base.Base(options, metadata={"region": "ap-southeast-2", "availabilityZone": "ap-southeast-2a", "instanceId": "bar"})
+            ebspin_base.gc()
+            clean_old_volumes.assert_called_with(options.uuid, "foo")
+            with open(options.status_file) as f:
+                result = json.load(f)
+        self.assertEqual(result['volume_id'], "foo")
+        self.assertEqual(result['snapshots'], {"deleted": [], "skipped": {}, "failed": {}})
+
+    def test_gc_leaves_snapshots_without_a_volume(self):
+        sim = simulator.Simulator()
+        tags = [{"Key": "Name", "Value": "bar-/dev/xvdf"}, {"Key": "UUID", "Value": "foo"}]
+        for x in range(3):
+            sim.add_snapshot(tags=tags, started=-3600 * (x + 1))
+        ebspin_base = base.Base(attach_options(uuid="foo"), metadata={"region": "ap-southeast-2", "availabilityZone": "ap-southeast-2a", "instanceId": "bar"})
+        ebspin_base.ec2 = ec2.Ec2(sim, timer=ebspin_base.timer)
+        volumes, snapshots = ebspin_base.gc()
+        self.assertEqual(len(sim.snapshots), 3)
+        self.assertEqual(snapshots.as_dict()["deleted"], [])
+        self.assertNotIn("DeleteSnapshot", sim.calls)
+
+
+class timing_test(unittest.TestCase):
+
+    def test_spans_nest_and_total(self):
+        timer = timing.Timer()
+        with timer.span('attach'):
+            with timer.span('attach.find_volume'):
+                pass
+            with timer.span('attach.find_volume'):
+                pass
+        totals = timer.totals()
+        self.assertEqual(totals['attach']['count'], 1)
+        self.assertEqual(totals['attach.find_volume']['count'], 2)
+        self.assertEqual([x['parent'] for x in timer.spans if x['name'] == 'attach.find_volume'], ['attach', 'attach'])
+
+    def test_span_records_error(self):
+        timer = timing.Timer()
+        with self.assertRaises(SystemExit):
+            with timer.span('attach'):
+                sys.exit(1)
+        self.assertEqual(timer.spans[0]['error'], 'SystemExit')
+
+    @patch('ebspin.ec2.Ec2.get_latest_volume_id_available', return_value="foo")
+    @patch('ebspin.ec2.Ec2.clean_old_volumes', return_value=deleter.DeletionSummary())
+    @patch('ebspin.ec2.Ec2.clean_snapshots', return_value=deleter.DeletionSummary())
+    def test_write_timings(self, *args):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "timings.json")
+            ebspin_base = base.Base(attach_options(), metadata={"region": "ap-southeast-2", "availabilityZone": "ap-southeast-2a", "instanceId": "bar"})
+            ebspin_base.gc()
+            ebspin_base.write_timings(path, 'gc')
+            with open(path) as f:
+                result = json.load(f)
+        self.assertEqual(result['command'], 'gc')
+        self.assertIn('startup.client', result['totals'])
+        self.assertIn('gc.snapshots', result['totals'])
+        self.assertEqual(result['api'], {'calls': 0, 'retries': 0, 'throttles': 0})
+
+
+class simulator_test(unittest.TestCase):
+
+    metadata = {"region": "ap-southeast-2", "availabilityZone": "ap-southeast-2a", "instanceId": "i-bar"}
+
+    def uuid_tags(self, uuid="foo"):
+        return [{"Key": "Name", "Value": "bar-/dev/xvdf"}, {"Key": "UUID", "Value": uuid}]
+
+    def base(self, sim, **kwargs):
+        ebspin_base = base.Base(attach_options(uuid="foo", **kwargs), metadata=self.metadata)
+        ebspin_base.ec2 = ec2.Ec2(sim, ebspin_base.options.concurrency, timer=ebspin_base.timer)
+        return ebspin_base
+
+    def test_volume_lifecycle_and_eventual_consistency(self):
+        sim = simulator.Simulator(volume_delay=5, visibility_delay=2)
+        with patch('time.sleep', sim.sleep):
+            volume_id = ec2.Ec2(sim).create_volume(10, "gp2", "ap-southeast-2a")
+        self.assertEqual(sim.volumes[volume_id]["State"], "available")
+        self.assertGreaterEqual(sim.now, 5)
+        self.assertGreater(sim.calls["DescribeVolumes"], 1)
+
+    def test_filters_and_pagination(self):
+        sim = simulator.Simulator(page_size=100)
+        sim.populate(["foo", "baz"], volumes=1, snapshots=250)
+        ebspin_ec2 = ec2.Ec2(sim)
+        newest = max((x for x in sim.snapshots.values() if x["Tags"][1]["Value"] == "foo"), key=lambda x: x["StartTime"])
+        self.assertEqual(ebspin_ec2.get_latest_snapshot_id("foo"), newest["SnapshotId"])
+        self.assertEqual(sim.calls["DescribeSnapshots"], 3)
+
+    def test_attach_from_other_az(self):
+        sim = simulator.Simulator()
+        sim.add_instance("i-bar", "ap-southeast-2a", name="bar")
+        old_volume = sim.add_volume(availability_zone="ap-southeast-2b", tags=self.uuid_tags())
+        sim.add_snapshot(volume_id=old_volume, tags=self.uuid_tags(), started=-3600)
+        ebspin_base = self.base(sim)
+        with patch('time.sleep', sim.sleep):
+            volume_id = ebspin_base.attach()
+            sim.sleep(60)
+        self.assertEqual(list(sim.volumes), [volume_id])
+        self.assertEqual(sim.volumes[volume_id]["AvailabilityZone"], "ap-southeast-2a")
+        self.assertEqual(sim.volumes[volume_id]["Attachments"][0]["State"], "attached")
+        self.assertEqual(sim.snapshots, {})
+
+    def test_cleanup_only_matches_the_uuid_tag(self):
+        sim = simulator.Simulator()
+        mine = sim.add_snapshot(tags=self.uuid_tags())
+        other = sim.add_snapshot(tags=[{"Key": "Name", "Value": "copy"}, {"Key": "UUID", "Value": "baz"}, {"Key": "Source", "Value": "foo"}])
+        sim.add_snapshot(owner_id="999999999999", tags=self.uuid_tags())
+        summary = ec2.Ec2(sim).clean_snapshots("foo", {"Source": "foo"})
+        self.assertEqual(summary.deleted, [mine])
+        self.assertIn(other, sim.snapshots)
+        self.assertEqual(len(sim.snapshots), 2)
+
+    def test_cleanup_through_throttling(self):
+        sim = simulator.Simulator(throttle=0.3, throttle_operations=("DeleteSnapshot",), seed=1)
+        for x in range(50):
+            sim.add_snapshot(tags=self.uuid_tags())
+        with patch('time.sleep', sim.sleep):
+            summary = ec2.Ec2(sim, concurrency=4).clean_snapshots("foo")
+        self.assertEqual(len(summary.deleted), 50)
+        self.assertGreater(sim.throttled, 0)
+        self.assertEqual(sim.snapshots, {})
+
+    def test_fuzz_attach_leaves_one_attached_volume(self):
+        for seed in range(5):
+            sim = simulator.Simulator(seed=seed, visibility_delay=seed % 2, page_size=7)
+            sim.add_instance("i-bar", "ap-southeast-2a", name="bar")
+            sim.populate(["foo", "baz"], volumes=sim.random.randint(0, 3), snapshots=sim.random.randint(0, 20))
+            with patch('time.sleep', sim.sleep):
+                volume_id = self.base(sim).attach()
+                sim.sleep(60)
+            volumes = [x for x in sim.volumes.values() if {"Key": "UUID", "Value": "foo"} in x["Tags"]]
+            self.assertEqual([x["VolumeId"] for x in volumes], [volume_id], "seed %s" % seed)
+            self.assertEqual(volumes[0]["Attachments"][0]["InstanceId"], "i-bar")
+            self.assertFalse([x for x in sim.snapshots.values() if {"Key": "UUID", "Value": "foo"} in x["Tags"]], "seed %s" % seed)
+
+
+class daemon_test(unittest.TestCase):
+
+    metadata = {"region": "ap-southeast-2", "availabilityZone": "ap-southeast-2a", "instanceId": "i-bar"}
+    tags = [{"Key": "Name", "Value": "bar-/dev/xvdf"}, {"Key": "UUID", "Value": "foo"}]
+
+    def daemon(self, sim, **kwargs):
+        ebspin_base = base.Base(attach_options(), metadata=self.metadata)
+        ebspin_base.ec2 = ec2.Ec2(sim, timer=ebspin_base.timer)
+        return daemon.Daemon(ebspin_base, ["foo"], **kwargs)
+
+    def test_snapshots_then_keeps_newest(self):
+        sim = simulator.Simulator()
+        volume_id = sim.add_volume(tags=self.tags, instance_id="i-bar")
+        for x in range(10):
+            sim.add_snapshot(volume_id=volume_id, tags=self.tags, started=-3600 * (x + 1))
+        sim.add_snapshot(volume_id=volume_id, tags=[{"Key": "UUID", "Value": "foo"}], started=-86400)
+        with tempfile.TemporaryDirectory() as directory:
+            ebspin_daemon = self.daemon(sim, keep=3, status_file=os.path.join(directory, "daemon.json"))
+            with patch('time.sleep', sim.sleep):
+                result = ebspin_daemon.run_once("foo")
+            with open(ebspin_daemon.status_file) as f:
+                state = json.load(f)
+        self.assertEqual(result["status"], "ok")
+        new_snapshot = result["snapshots"][volume_id]
+        self.assertIn(new_snapshot, sim.snapshots)
+        self.assertEqual(len(sim.snapshots), 4)
+        self.assertEqual(len(result["pruned"]["deleted"]), 8)
+        self.assertEqual(state["uuids"]["foo"]["runs"], 1)
+        self.assertFalse(state["uuids"]["foo"]["running"])
+
+    def test_keeps_whole_multi_volume_sets(self):
+        sim = simulator.Simulator()
+        sim.add_instance("i-bar", "ap-southeast-2a", name="bar")
+        volumes = []
+        for x, device in enumerate(("/dev/xvdf", "/dev/xvdg", "/dev/xvdh")):
+            tags = [{"Key": "Name", "Value": "bar-" + device}, {"Key": "UUID", "Value": "db-%s" % x}]
+            volume_id = sim.add_volume(tags=tags, instance_id="i-bar", device=device)
+            # the volumes' histories are interleaved in time
+            for run in range(5):
+                sim.add_snapshot(volume_id=volume_id, tags=tags, started=-3600 * (run + 1) - 60 * x)
+            volumes.append(volume_id)
+        ebspin_base = base.Base(attach_options(multi_volume=True), metadata=self.metadata)
+        ebspin_base.ec2 = ec2.Ec2(sim, timer=ebspin_base.timer)
+        ebspin_daemon = daemon.Daemon(ebspin_base, ["db-*"], keep=4)
+        with patch('time.sleep', sim.sleep):
+            result = ebspin_daemon.run_once("db-*")
+        self.assertEqual(result["status"], "ok")
+        self.assertEqual(sim.calls["CreateSnapshots"], 1)
+        kept = [[x for x in sim.snapshots.values() if x["VolumeId"] == volume_id] for volume_id in volumes]
+        self.assertEqual([len(x) for x in kept], [4, 4, 4])
+        for volume_id, snapshots in zip(volumes, kept):
+            self.assertIn(result["snapshots"][volume_id], [x["SnapshotId"] for x in snapshots])
+
+    def test_compares_latest_snapshots_every_run(self):
+        sim = simulator.Simulator()
+        sim.add_instance("i-bar", "ap-southeast-2a", name="bar")
+        tags = [{"Key": "Name", "Value": "bar-/dev/xvdf"}, {"Key": "UUID", "Value": "db-0"}]
+        volume_id = sim.add_volume(tags=tags, instance_id="i-bar")
+        for x in range(2):
+            sim.add_snapshot(volume_id=volume_id, tags=tags, started=-3600 * (x + 1))
+        ebspin_base = base.Base(attach_options(skip_unchanged=1, max_age=10 ** 9), metadata=self.metadata)
+        ebspin_base.ec2 = ec2.Ec2(sim, timer=ebspin_base.timer)
+        ebspin_base.ebs = Mock()
+        ebspin_base.ebs.changed_blocks.side_effect = lambda first, second, limit: {
+            "first_snapshot_id": first, "second_snapshot_id": second, "blocks": 5, "bytes": 5 * 524288, "truncated": False}
+        ebspin_daemon = daemon.Daemon(ebspin_base, ["db-*"], keep=None)
+        with patch('time.sleep', sim.sleep):
+            first = ebspin_daemon.run_once("db-*")["snapshots"][volume_id]
+            ebspin_daemon.run_once("db-*")
+        # the second run sees the first run's snapshot completed, under its own UUID
+        self.assertEqual(ebspin_base.ebs.changed_blocks.call_args_list[1][0][1], first)
+
+    def test_keeps_a_bounded_number_of_spans(self):
+        sim = simulator.Simulator()
+        sim.add_volume(tags=self.tags, instance_id="i-bar")
+        with patch('ebspin.daemon.MAX_SPANS', 10):
+            ebspin_daemon = self.daemon(sim, keep=1)
+        with patch('time.sleep', sim.sleep):
+            for x in range(5):
+                ebspin_daemon.run_once("foo")
+        timer = ebspin_daemon.base.timer
+        self.assertEqual(len(timer.spans), 10)
+        self.assertEqual(timer.totals()["daemon.run"]["count"], 5)
+        self.assertEqual(timer.spans[-1]["name"], "daemon.run")
+
+    def test_never_overlaps_runs_of_a_uuid(self):
+        ebspin_daemon = self.daemon(simulator.Simulator())
+        ebspin_daemon._locks["foo"].acquire()
+        self.assertIsNone(ebspin_daemon.run_once("foo"))
+        self.assertEqual(ebspin_daemon.state["foo"]["skipped"], 1)
+
+    def test_runs_on_schedule_until_stopped(self):
+        ebspin_daemon = self.daemon(simulator.Simulator(), interval=0.01, jitter=0)
+        runs = []
+
+        def run_once(uuid):
+            runs.append(uuid)
+            if len(runs) == 3:
+                ebspin_daemon.stop.set()
+
+        ebspin_daemon.run_once = run_once
+        ebspin_daemon.run()
+        self.assertEqual(runs, ["foo"] * 3)
+
+
+class ratelimit_test(unittest.TestCase):
+
+    # the clock is stopped so the bucket only refills as the test says, however slowly it runs
+
+    @patch('time.monotonic', return_value=0.0)
+    @patch('time.sleep')
+    def test_paces_after_burst(self, mock_sleep, mock_monotonic):
+        bucket = ratelimit.TokenBucket(rate=2, burst=1)
+        self.assertEqual([bucket.acquire() for x in range(3)], [0, 0.5, 1.0])
+        self.assertEqual(mock_sleep.call_count, 2)
+
+    @patch('time.monotonic', return_value=0.0)
+    @patch('time.sleep')
+    def test_refills_while_idle(self, mock_sleep, mock_monotonic):
+        bucket = ratelimit.TokenBucket(rate=2, burst=1)
+        bucket.acquire()
+        mock_monotonic.return_value = 0.25
+        self.assertEqual(bucket.acquire(), 0.25)
+
+    @patch('time.monotonic', return_value=0.0)
+    @patch('time.sleep')
+    def test_larger_than_burst(self, mock_sleep, mock_monotonic):
+        bucket = ratelimit.TokenBucket(rate=100, burst=10)
+        self.assertEqual(bucket.acquire(210), 2.0)
+
+
+class fleet_test(unittest.TestCase):
+
+    def tags(self, uuid):
+        return [{"Key": "Name", "Value": "host-%s" % uuid}, {"Key": "UUID", "Value": uuid}]
+
+    def test_snapshots_attached_volumes_of_matching_uuids(self):
+        sim = simulator.Simulator()
+        for uuid in ("db-1", "db-2", "web-1"):
+            sim.add_volume(tags=self.tags(uuid), instance_id="i-%s" % uuid)
+        sim.add_volume(tags=self.tags("db-3"))
+        sim.add_volume(tags=[{"Key": "Name", "Value": "untagged"}], instance_id="i-other")
+        with patch('time.sleep', sim.sleep):
+            report = fleet.Fleet(ec2.Ec2(sim), concurrency=2, bucket=ratelimit.TokenBucket(1000), uuids=["db-*"]).run(wait=True)
+        self.assertEqual(report["volumes"], 2)
+        self.assertEqual(sorted(x["uuid"] for x in report["results"]), ["db-1", "db-2"])
+        self.assertEqual([x["status"] for x in report["results"]], ["completed", "completed"])
+        self.assertEqual(sim.calls["DescribeVolumes"], 1)
+        self.assertEqual(len(sim.snapshots), 2)
+        for snapshot in sim.snapshots.values():
+            self.assertIn({"Key": "UUID", "Value": "db-%s" % snapshot["Tags"][0]["Value"][-1]}, snapshot["Tags"])
+
+    def test_throughput_excludes_discovery(self):
+        sim = simulator.Simulator()
+        sim.add_volume(tags=self.tags("db-1"), instance_id="i-db-1")
+        clock = [1000.0]
+        ebspin_fleet = fleet.Fleet(ec2.Ec2(sim))
+        discover = ebspin_fleet.discover
+
+        def slow_discover():
+            clock[0] += 30
+            return discover()
+
+        def create_snapshot(*args, **kwargs):
+            clock[0] += 2
+            return "snap-1"
+
+        with patch('time.time', side_effect=lambda: clock[0]), \
+                patch.object(ebspin_fleet, 'discover', side_effect=slow_discover), \
+                patch.object(ebspin_fleet.ec2, 'create_snapshot', side_effect=create_snapshot):
+            report = ebspin_fleet.run()
+        self.assertEqual((report["seconds"], report["discover_seconds"], report["snapshot_seconds"]), (32, 30, 2))
+        self.assertEqual(report["snapshots_per_second"], 0.5)
+
+    def test_reports_failures(self):
+        sim = simulator.Simulator(throttle=1, throttle_operations=("CreateSnapshot",))
+        sim.add_volume(tags=self.tags("db-1"), instance_id="i-db-1")
+        report = fleet.Fleet(ec2.Ec2(sim)).run()
+        self.assertEqual(report["failed"], 1)
+        self.assertIn("RequestLimitExceeded", report["results"][0]["error"])
+
+
+class warm_test(unittest.TestCase):
+
+    metadata = {"region": "ap-southeast-2", "availabilityZone": "ap-southeast-2a", "instanceId": "i-bar"}
+
+    def sparse_file(self, size):
+        f = tempfile.NamedTemporaryFile()
+        f.truncate(size)
+        return f
+
+    def test_reads_every_byte(self):
+        size = 10 * warm.MIB + 123
+        with self.sparse_file(size) as f:
+            report = warm.Warmer(f.name, workers=4).run()
+        self.assertEqual(report["bytes"], size)
+        self.assertEqual(report["workers"], 4)
+        self.assertEqual(report["paced_seconds"], 0)
+
+    def test_bandwidth_cap(self):
+        # with the clock stopped the bucket never refills, so the waits don't depend on how fast the reads are
+        with self.sparse_file(16 * warm.MIB) as f, patch('time.sleep') as sleep, patch('time.monotonic', return_value=0.0):
+            report = warm.Warmer(f.name, workers=2, bucket=ratelimit.TokenBucket(4 * warm.MIB)).run()
+        self.assertEqual(report["bytes"], 16 * warm.MIB)
+        # the last MiB is reserved 12 MiB beyond the 4 MiB burst, at 4 MiB/s
+        self.assertEqual(max(x[0][0] for x in sleep.call_args_list), 3)
+        self.assertEqual(report["paced_seconds"], sum(x / 4 for x in range(1, 13)))
+
+    def test_reports_progress(self):
+        with self.sparse_file(4 * warm.MIB) as f, self.assertLogs(level="INFO") as logs:
+            warm.Warmer(f.name, workers=1, interval=0).run()
+        self.assertIn("Warmed 4 of 4 MiB (100.0%)", "\n".join(logs.output))
+
+    def attach(self, availability_zone):
+        sim = simulator.Simulator()
+        sim.add_instance("i-bar", "ap-southeast-2a", name="bar")
+        tags = [{"Key": "Name", "Value": "bar-/dev/xvdf"}, {"Key": "UUID", "Value": "foo"}]
+        sim.add_volume(availability_zone=availability_zone, tags=tags)
+        ebspin_base = base.Base(attach_options(uuid="foo", warm=True), metadata=self.metadata)
+        ebspin_base.ec2 = ec2.Ec2(sim, timer=ebspin_base.timer)
+        with patch('time.sleep', sim.sleep), patch.object(ebspin_base, 'warm') as warm_volume, \
+                patch.object(ebspin_base, 'wait_device', return_value="/dev/nvme1n1"):
+            ebspin_base.attach()
+        return ebspin_base, warm_volume
+
+    def test_attach_warms_restored_volume(self):
+        ebspin_base, warm_volume = self.attach("ap-southeast-2b")
+        warm_volume.assert_called_once_with("/dev/nvme1n1", ebspin_base.options)
+
+    def test_attach_leaves_existing_volume_alone(self):
+        ebspin_base, warm_volume = self.attach("ap-southeast-2a")
+        warm_volume.assert_not_called()
+
+
+class device_test(unittest.TestCase):
+
+    volume_id = "vol-0123456789abcdef0"
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.sys_block = os.path.join(self.directory.name, "sys", "block")
+        self.dev = os.path.join(self.directory.name, "dev")
+        os.makedirs(self.sys_block)
+        os.makedirs(self.dev)
+        self.add_device("nvme0n1", serial="vol0fedcba9876543210")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def add_device(self, name, serial=None, size=20971520):
+        """A block device in the fake sysfs tree, with its node in the fake /dev"""
+
+        os.makedirs(os.path.join(self.sys_block, name, "device"))
+        if serial:
+            with open(os.path.join(self.sys_block, name, "device", "serial"), "w") as f:
+                f.write(serial + "  \n")
+        with open(os.path.join(self.sys_block, name, "size"), "w") as f:
+            f.write("%s\n" % size)
+        open(os.path.join(self.dev, name), "w").close()
+
+    def waiter(self, events=None):
+        return device.DeviceWaiter(self.sys_block, self.dev, events)
+
+    def test_maps_nvme_device_by_serial(self):
+        self.add_device("nvme1n1", serial="vol0aaaaaaaaaaaaaaaa")
+        self.add_device("nvme2n1", serial="vol0123456789abcdef0")
+        self.assertEqual(self.waiter().find(self.volume_id, "/dev/xvdf"), os.path.join(self.dev, "nvme2n1"))
+
+    def test_maps_xen_device_by_name(self):
+        self.add_device("xvdf")
+        self.assertEqual(self.waiter().find(self.volume_id, "/dev/sdf"), os.path.join(self.dev, "xvdf"))
+        self.assertIsNone(self.waiter().find(self.volume_id, "/dev/sdg"))
+
+    def test_waits_for_uevent(self):
+        read_end, write_end = os.pipe()
+        events = os.fdopen(read_end, "rb")
+
+        def attached():
+            self.add_device("nvme1n1", serial="vol0123456789abcdef0")
+            os.write(write_end, b"add@/devices/pci0000:00/0000:00:1f.0/nvme/nvme1/nvme1n1\0")
+
+        threading.Timer(0.1, attached).start()
+        with patch('time.sleep') as sleep:
+            path = self.waiter(events).wait(self.volume_id, "/dev/xvdf", timeout=10)
+        events.close()
+        os.close(write_end)
+        self.assertEqual(path, os.path.join(self.dev, "nvme1n1"))
+        sleep.assert_not_called()
+
+    def test_not_usable_until_it_has_a_size(self):
+        self.add_device("nvme1n1", serial="vol0123456789abcdef0", size=0)
+        with tempfile.TemporaryFile() as events:
+            self.assertIsNone(self.waiter(events).wait(self.volume_id, "/dev/xvdf", timeout=0))
+
+    def test_base_links_device(self):
+        self.add_device("nvme1n1", serial="vol0123456789abcdef0")
+        link = os.path.join(self.directory.name, "ebs-pin", "{uuid}")
+        ebspin_base = base.Base(attach_options(uuid="foo", symlink=link), metadata={"region": "ap-southeast-2", "availabilityZone": "ap-southeast-2a", "instanceId": "bar"})
+        ebspin_base.on_device = Mock()
+        with patch('ebspin.device.SYS_BLOCK', self.sys_block), patch('ebspin.device.DEV', self.dev):
+            self.assertEqual(ebspin_base.wait_device(self.volume_id), os.path.join(self.dev, "nvme1n1"))
+        ebspin_base.on_device.assert_called_once_with(self.volume_id, os.path.join(self.dev, "nvme1n1"))
+        self.assertEqual(os.readlink(link.format(uuid="foo")), os.path.join(self.dev, "nvme1n1"))
+        self.assertEqual(ebspin_base.devices, {self.volume_id: os.path.join(self.dev, "nvme1n1")})
+
+
+class freeze_test(unittest.TestCase):
+
+    metadata = {"region": "ap-southeast-2", "availabilityZone": "ap-southeast-2a", "instanceId": "bar"}
+    volumes = [{"VolumeId": "a", "Tags": []}, {"VolumeId": "b", "Tags": []}]
+
+    def test_thaws_before_waiting(self):
+        commands = []
+        ebspin_base = base.Base(attach_options(freeze=["/data", "/log"], pre_hook="flush", post_hook="unlock"), metadata=self.metadata)
+
+        def create_snapshot(volume_id, *args, **kwargs):
+            commands.append(["CreateSnapshot"])
+            return "snap-" + volume_id
+
+        with patch('ebspin.freeze.run', side_effect=commands.append), \
+                patch.object(ebspin_base.ec2, 'get_volumes', return_value=self.volumes), \
+                patch.object(ebspin_base.ec2, 'create_snapshot', side_effect=create_snapshot), \
+                patch.object(ebspin_base.ec2, 'wait_for_snapshots', side_effect=lambda x: commands.append(["wait"])):
+            self.assertEqual(ebspin_base.snapshot(), {"a": "snap-a", "b": "snap-b"})
+        self.assertEqual(commands, [
+            ["/bin/sh", "-c", "flush"],
+            ["fsfreeze", "--freeze", "/data"],
+            ["fsfreeze", "--freeze", "/log"],
+            ["CreateSnapshot"],
+            ["CreateSnapshot"],
+            ["fsfreeze", "--unfreeze", "/log"],
+            ["fsfreeze", "--unfreeze", "/data"],
+            ["/bin/sh", "-c", "unlock"],
+            ["wait"],
+        ])
+        span = next(x for x in ebspin_base.timer.spans if x["name"] == "snapshot.create")
+        self.assertEqual(span["frozen_seconds"], ebspin_base.frozen)
+        self.assertLessEqual(ebspin_base.frozen, span["seconds"])
+
+    def test_thaws_when_snapshot_fails(self):
+        runner = Mock()
+        ebspin_base = base.Base(attach_options(freeze=["/data"], post_hook="unlock"), metadata=self.metadata)
+        with patch('ebspin.freeze.run', runner), \
+                patch.object(ebspin_base.ec2, 'get_volumes', return_value=self.volumes), \
+                patch.object(ebspin_base.ec2, 'create_snapshot', side_effect=RuntimeError("boom")):
+            with self.assertRaises(RuntimeError):
+                ebspin_base.snapshot()
+        self.assertEqual(runner.call_args_list[-2][0][0], ["fsfreeze", "--unfreeze", "/data"])
+        self.assertEqual(runner.call_args_list[-1][0][0], ["/bin/sh", "-c", "unlock"])
+
+    def test_thaws_what_was_frozen_when_freezing_fails(self):
+        calls = []
+
+        def runner(command):
+            calls.append(command)
+            if command == ["fsfreeze", "--freeze", "/log"]:
+                raise OSError("Device or resource busy")
+
+        freezer = freeze.Freezer(["/data", "/log"], runner=runner)
+        with self.assertRaises(OSError):
+            with freezer:
+                self.fail("snapshots started without a freeze")
+        self.assertEqual(calls[-1], ["fsfreeze", "--unfreeze", "/data"])
+        # the next freeze isn't left waiting on this one
+        with freeze.Freezer(["/data"], runner=Mock()) as other:
+            self.assertEqual(other.frozen, ["/data"])
+
+    def test_no_freeze_by_default(self):
+        self.assertFalse(freeze.Freezer())
+
+
+class multi_volume_snapshot_test(unittest.TestCase):
+
+    metadata = {"region": "ap-southeast-2", "availabilityZone": "ap-southeast-2a", "instanceId": "i-bar"}
+
+    def tags(self, uuid, device):
+        return [{"Key": "Name", "Value": "bar-" + device}, {"Key": "UUID", "Value": uuid}]
+
+    @patch('time.sleep')
+    def test_excludes_boot_and_other_volumes(self, mock_sleep):
+        client = boto3.client('ec2')
+        stubber = Stubber(client)
+        stubber.add_response('describe_instances', {"Reservations": [{"Instances": [{"InstanceId": "i-bar", "RootDeviceName": "/dev/xvda", "BlockDeviceMappings": [
+            {"DeviceName": "/dev/xvda", "Ebs": {"VolumeId": "vol-root"}},
+            {"DeviceName": "/dev/xvdf", "Ebs": {"VolumeId": "vol-a"}},
+            {"DeviceName": "/dev/xvdg", "Ebs": {"VolumeId": "vol-b"}},
+            {"DeviceName": "/dev/xvdh", "Ebs": {"VolumeId": "vol-other"}},
+        ]}]}]}, {"InstanceIds": ["i-bar"]})
+        stubber.add_response('create_snapshots', {"Snapshots": [
+            {"SnapshotId": "snap-a", "VolumeId": "vol-a", "State": "pending"},
+            {"SnapshotId": "snap-b", "VolumeId": "vol-b", "State": "pending"},
+        ]}, {
+            "InstanceSpecification": {"InstanceId": "i-bar", "ExcludeBootVolume": True, "ExcludeDataVolumeIds": ["vol-other"]},
+            "CopyTagsFromSource": "volume",
+            "TagSpecifications": [{"ResourceType": "snapshot", "Tags": [{"Key": "Team", "Value": "DevOps"}]}]
+        })
+        stubber.add_response('describe_snapshots', {"Snapshots": [
+            {"SnapshotId": "snap-a", "VolumeId": "vol-a", "State": "completed"},
+            {"SnapshotId": "snap-b", "VolumeId": "vol-b", "State": "completed"},
+        ]}, {"SnapshotIds": ["snap-a", "snap-b"]})
+        stubber.activate()
+        volumes = [{"VolumeId": "vol-a", "Tags": self.tags("db", "/dev/xvdf")}, {"VolumeId": "vol-b", "Tags": self.tags("db", "/dev/xvdg")}]
+        snapshots = ec2.Ec2(client).create_snapshots("i-bar", volumes, {"Team": "DevOps"})
+        self.assertEqual(snapshots, {"vol-a": "snap-a", "vol-b": "snap-b"})
+        stubber.assert_no_pending_responses()
+
+    def test_snapshot_with_one_call(self):
+        sim = simulator.Simulator()
+        sim.add_instance("i-bar", "ap-southeast-2a", name="bar")
+        sim.add_volume(instance_id="i-bar", device="/dev/xvda")
+        data = sim.add_volume(instance_id="i-bar", device="/dev/xvdf", tags=self.tags("db-data", "/dev/xvdf"))
+        log = sim.add_volume(instance_id="i-bar", device="/dev/xvdg", tags=self.tags("db-log", "/dev/xvdg"))
+        sim.add_volume(instance_id="i-bar", device="/dev/xvdh", tags=self.tags("web", "/dev/xvdh"))
+        ebspin_base = base.Base(attach_options(uuid="db-*", multi_volume=True, tags={"Team": "DevOps"}), metadata=self.metadata)
+        ebspin_base.ec2 = ec2.Ec2(sim, timer=ebspin_base.timer)
+        with patch('time.sleep', sim.sleep):
+            snapshots = ebspin_base.snapshot()
+        self.assertEqual(sorted(snapshots), sorted([data, log]))
+        self.assertEqual(sim.calls["CreateSnapshots"], 1)
+        self.assertNotIn("CreateSnapshot", sim.calls)
+        self.assertEqual(len(sim.snapshots), 2)
+        for volume_id, snapshot_id in snapshots.items():
+            snapshot = sim.snapshots[snapshot_id]
+            self.assertEqual(snapshot["VolumeId"], volume_id)
+            self.assertEqual(snapshot["State"], "completed")
+            self.assertEqual(snapshot["Tags"], sim.volumes[volume_id]["Tags"] + [{"Key": "Team", "Value": "DevOps"}])
+
+
+class changed_blocks_test(unittest.TestCase):
+
+    metadata = {"region": "ap-southeast-2", "availabilityZone": "ap-southeast-2a", "instanceId": "i-bar"}
+    tags = [{"Key": "Name", "Value": "bar-/dev/xvdf"}, {"Key": "UUID", "Value": "foo"}]
+
+    def blocks(self, *indexes):
+        return [{"BlockIndex": x, "FirstBlockToken": "a", "SecondBlockToken": "b"} for x in indexes]
+
+    def stubbed_ebs(self):
+        client = boto3.client('ebs')
+        return client, Stubber(client)
+
+    def test_counts_blocks_across_pages(self):
+        client, stubber = self.stubbed_ebs()
+        params = {"FirstSnapshotId": "snap-old", "SecondSnapshotId": "snap-new", "MaxResults": 10000}
+        stubber.add_response('list_changed_blocks', {"ChangedBlocks": self.blocks(1, 2), "BlockSize": 524288, "NextToken": "page2"}, params)
+        stubber.add_response('list_changed_blocks', {"ChangedBlocks": self.blocks(7), "BlockSize": 524288}, dict(params, NextToken="page2"))
+        stubber.activate()
+        changes = ebs.Ebs(client).changed_blocks("snap-old", "snap-new")
+        self.assertEqual((changes["blocks"], changes["bytes"], changes["truncated"]), (3, 3 * 524288, False))
+        stubber.assert_no_pending_responses()
+
+    def test_stops_paging_over_limit(self):
+        client, stubber = self.stubbed_ebs()
+        stubber.add_response('list_changed_blocks', {"ChangedBlocks": self.blocks(1, 2), "BlockSize": 524288, "NextToken": "page2"})
+        stubber.activate()
+        changes = ebs.Ebs(client).changed_blocks("snap-old", "snap-new", limit=2)
+        self.assertEqual((changes["blocks"], changes["truncated"]), (2, True))
+
+    def snapshot(self, blocks=None, error=None, skip_unchanged=10, max_age=86400, started=-3600):
+        """Snapshot volume of a simulated instance whose last two snapshots differ by `blocks`"""
+
+        sim = simulator.Simulator()
+        volume_id = sim.add_volume(instance_id="i-bar", tags=self.tags)
+        parent = sim.add_snapshot(volume_id=volume_id, tags=self.tags, started=started - 3600)
+        sim.add_snapshot(volume_id=volume_id, tags=self.tags, started=started, state="pending")
+        latest = sim.add_snapshot(volume_id=volume_id, tags=self.tags, started=started - 60)
+        sim.add_snapshot(volume_id="vol-other", tags=self.tags, started=started)
+        client, stubber = self.stubbed_ebs()
+        if blocks is not None:
+            self.add_changes(stubber, parent, latest, blocks)
+        if error:
+            stubber.add_client_error('list_changed_blocks', error)
+        ebspin_base, snapshots = self.run_snapshot(sim, client, stubber, skip_unchanged=skip_unchanged, max_age=max_age)
+        return ebspin_base, sim, snapshots, latest
+
+    def add_changes(self, stubber, first, second, blocks):
+        stubber.add_response('list_changed_blocks', {"ChangedBlocks": self.blocks(*range(blocks)), "BlockSize": 524288},
+                             {"FirstSnapshotId": first, "SecondSnapshotId": second, "MaxResults": 10000})
+
+    def run_snapshot(self, sim, client, stubber, **kwargs):
+        stubber.activate()
+        ebspin_base = base.Base(attach_options(uuid="foo", no_wait=True, **kwargs), metadata=self.metadata)
+        ebspin_base.ec2 = ec2.Ec2(sim, timer=ebspin_base.timer)
+        ebspin_base.ebs = ebs.Ebs(client, ebspin_base.timer)
+        # the simulator's clock starts at its epoch
+        with patch('ebspin.base.datetime') as clock:
+            clock.datetime.now.return_value = simulator.EPOCH
+            clock.timezone = datetime.timezone
+            snapshots = ebspin_base.snapshot()
+        stubber.assert_no_pending_responses()
+        return ebspin_base, snapshots
+
+    def test_skips_unchanged_volume(self):
+        ebspin_base, sim, snapshots, latest = self.snapshot(blocks=3)
+        self.assertEqual(snapshots, {})
+        self.assertNotIn("CreateSnapshot", sim.calls)
+        changes = list(ebspin_base.changes.values())[0]
+        self.assertEqual((changes["second_snapshot_id"], changes["blocks"], changes["bytes"]), (latest, 3, 3 * 524288))
+        span = next(x for x in ebspin_base.timer.spans if x["name"] == "snapshot.changes")
+        self.assertEqual(span["blocks"], 3)
+
+    def test_snapshots_changed_volume(self):
+        ebspin_base, sim, snapshots, latest = self.snapshot(blocks=10)
+        self.assertEqual(len(snapshots), 1)
+        self.assertEqual(sim.calls["CreateSnapshot"], 1)
+
+    def test_snapshots_when_latest_is_too_old(self):
+        ebspin_base, sim, snapshots, latest = self.snapshot(max_age=1800)
+        self.assertEqual(len(snapshots), 1)
+        self.assertEqual(ebspin_base.changes, {})
+
+    def test_snapshots_when_changes_are_unknown(self):
+        ebspin_base, sim, snapshots, latest = self.snapshot(error="AccessDeniedException")
+        self.assertEqual(len(snapshots), 1)
+
+    def test_multi_volume_snapshots_whole_set(self):
+        sim = simulator.Simulator()
+        sim.add_instance("i-bar", "ap-southeast-2a", name="bar")
+        client, stubber = self.stubbed_ebs()
+        volumes = []
+        # the quiet member is checked first, and still snapshotted with the busy one
+        for device, blocks in (("/dev/xvdf", 3), ("/dev/xvdg", 10)):
+            volume_id = sim.add_volume(instance_id="i-bar", device=device, tags=self.tags)
+            parent = sim.add_snapshot(volume_id=volume_id, tags=self.tags, started=-7200)
+            latest = sim.add_snapshot(volume_id=volume_id, tags=self.tags, started=-3600)
+            self.add_changes(stubber, parent, latest, blocks)
+            volumes.append(volume_id)
+        ebspin_base, snapshots = self.run_snapshot(sim, client, stubber, skip_unchanged=10, multi_volume=True)
+        self.assertEqual(sorted(snapshots), sorted(volumes))
+        self.assertTrue(all(snapshots.values()))
+        self.assertEqual(sim.calls["CreateSnapshots"], 1)
+
+
 if __name__ == "__main__":
     unittest.main(verbosity=2)